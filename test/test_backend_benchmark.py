@@ -0,0 +1,104 @@
+# coding=utf-8
+"""
+runs the same db_model calls against the storage backends and prints the durations.
+usage: test_backend_benchmark.py [mysql] [sqlite], default is both.
+MySQL uses the configured database (the records are inserted far in the future and deleted afterwards),
+SQLite uses a temporary database file.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.model.db import backend
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import rollup
+
+BASE_TIME = datetime.datetime(2100, 1, 1)
+RECORDS = 365 * 24 * 6  # one year of 10-minute data
+BATCH = 5000
+SINGLE_INSERTS = 200
+COLUMNS = [db_const.COL_NAME_TIME, "Temp1", "Light", "Rain"]
+
+
+def create_backend(name: str) -> backend.StorageBackend:
+    if name == config.DB_BACKEND_SQLITE:
+        from wetstat.model.db import sqlite_backend
+        return sqlite_backend.SqliteBackend(os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3"))
+    from wetstat.model.db import mysql_backend
+    return mysql_backend.MySqlBackend()
+
+
+def measure(name: str, func, num: int = 1):
+    start = time.perf_counter()
+    for i in range(num):
+        result = func()
+    used = (time.perf_counter() - start) / num
+    print(f"    {name:40}{round(used * 1000, 3)}ms")
+    return result
+
+
+def insert_year() -> None:
+    rng = np.random.default_rng(42)
+    rows = []
+    for i in range(RECORDS):
+        rows.append([BASE_TIME + datetime.timedelta(minutes=10 * i),
+                     float(rng.normal(10, 8)), float(rng.random() * 50000), 0.5 if i % 20 == 0 else None])
+        if len(rows) == BATCH:
+            backend.get_backend().upsert(COLUMNS, rows, update_if_exists=True)
+            rows = []
+    if rows:
+        backend.get_backend().upsert(COLUMNS, rows, update_if_exists=True)
+
+
+def run(name: str) -> None:
+    print(f"{name}:")
+    backend._backend = create_backend(name)
+    backend.get_backend().add_columns(COLUMNS)
+    month_end = BASE_TIME + datetime.timedelta(days=31)
+    year_end = BASE_TIME + datetime.timedelta(days=365)
+    timestamps = [BASE_TIME + datetime.timedelta(days=n, minutes=3) for n in (0, 1, 30, 300)]
+    path = os.path.join(tempfile.gettempdir(), "test_backend_benchmark.csv")
+    try:
+        measure(f"insert {RECORDS} records", insert_year)
+        measure("insert_record", lambda: db_model.insert_record(year_end, update_if_exists=True, Temp1=1.0),
+                SINGLE_INSERTS)
+        data = measure("load one month", lambda: db_model.load_data_for_date_range(BASE_TIME, month_end), 10)
+        print(f"        {len(data)} records")
+        measure("load one month, one column",
+                lambda: db_model.load_data_for_date_range(BASE_TIME, month_end, columns=["Temp1"]), 10)
+        for interval in (datetime.timedelta(days=1), datetime.timedelta(hours=3)):
+            data = measure(f"load year with interval {interval}",
+                           lambda: db_model.load_data_with_interval(interval, start=BASE_TIME, end=year_end), 5)
+            print(f"        {len(data)} records")
+        records = measure("find_nearest_records (4)", lambda: db_model.find_nearest_records(timestamps), 50)
+        print(f"        {[rec[db_const.COL_NAME_TIME] for rec in records]}")
+        sums = measure("get_value_sums_multi (4)",
+                       lambda: db_model.get_value_sums_multi(["Rain"], [(ts - datetime.timedelta(days=1), ts)
+                                                                        for ts in timestamps]), 50)
+        print(f"        {sums}")
+        measure("export year to csv", lambda: db_model.export_to_csv(BASE_TIME, year_end, path))
+    finally:
+        if name == config.DB_BACKEND_MYSQL:
+            with connection_pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM data WHERE Time >= %s", (BASE_TIME,))
+                for level in rollup.ALL_LEVELS:
+                    cur.execute(f"DELETE FROM {level.table} WHERE Time >= %s", (BASE_TIME,))
+                conn.commit()
+                cur.close()
+        backend.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        for backend_name in sys.argv[1:] or [config.DB_BACKEND_MYSQL, config.DB_BACKEND_SQLITE]:
+            run(backend_name)
+    finally:
+        db_model.cleanup()
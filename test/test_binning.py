@@ -0,0 +1,43 @@
+# coding=utf-8
+import datetime
+import time
+
+import numpy as np
+
+from wetstat.model import binning
+from wetstat.sensors.abstract.base_sensor import CompressionFunction
+
+NUM = 20
+INTERVALS = [datetime.timedelta(minutes=30), datetime.timedelta(hours=3), datetime.timedelta(hours=6)]
+
+# one year of 10-minute data
+start = datetime.datetime(2019, 1, 1)
+times = np.arange(0, 365 * 24 * 6, dtype=np.int64) * 600 + binning.datetimes_to_seconds(np.array([start]))[0]
+rng = np.random.default_rng(42)
+temp = rng.normal(10, 8, len(times))
+temp[rng.random(len(times)) < 0.01] = np.nan  # some missing values
+rain = np.where(rng.random(len(times)) < 0.05, rng.random(len(times)), 0.0)
+values = {"Temp": temp, "Rain": rain}
+functions = {"Temp": CompressionFunction.MINMAXAVG, "Rain": CompressionFunction.SUM}
+
+for interval in INTERVALS:
+    seconds = int(interval.total_seconds())
+    t0 = time.perf_counter()
+    for i in range(NUM):
+        result_times, result = binning.aggregate(times, values, functions, seconds)
+    used = (time.perf_counter() - t0) / NUM
+    print(f"interval={interval}: {len(result_times)} buckets in {round(used * 1000, 3)}ms "
+          f"({round(len(times) / used)} rows/s)")
+
+# the same buckets as searching every bucket edge of the range
+for seconds in (1, 600, 3600, 7 * 86400):
+    edges = np.arange(times[0] - times[0] % seconds, times[-1] + 1, seconds, dtype=np.int64)
+    expected = np.unique(np.searchsorted(times, edges, "left"))
+    print(f"interval_seconds={seconds}: same bucket starts as all edges:",
+          np.array_equal(binning.find_bucket_starts(times, seconds), expected[expected < len(times)]))
+
+# a few records over ten years with interval_seconds=1 would be about 315M bucket edges
+sparse = np.array([0, 5, 86400 * 3650, 86400 * 3650 + 1], dtype=np.int64) + times[0]
+t0 = time.perf_counter()
+starts = binning.find_bucket_starts(sparse, 1)
+print(f"sparse ten years, interval_seconds=1: {starts.tolist()} in {round((time.perf_counter() - t0) * 1000, 3)}ms")
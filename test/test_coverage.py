@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+builds the coverage index of a temporary SQLite database with an outage and a sensor which was added later, prints the
+spans and how much narrow() reduces a request. several processes add records at the same time, none of their changes
+may get lost
+"""
+import datetime
+import multiprocessing
+import os
+import tempfile
+import time
+
+from wetstat.common import config
+from wetstat.model.db import backend
+from wetstat.model.db import coverage
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import sqlite_backend
+
+BASE_TIME = datetime.datetime(2020, 1, 1)
+OUTAGE = (BASE_TIME + datetime.timedelta(days=10), BASE_TIME + datetime.timedelta(days=12))
+RAIN_ADDED = BASE_TIME + datetime.timedelta(days=20)
+PROCESSES = 4
+RECORDS_PER_PROCESS = 20
+
+
+def fill() -> None:
+    rows = []
+    for i in range(144 * 30):
+        t = BASE_TIME + datetime.timedelta(minutes=10 * i)
+        if OUTAGE[0] <= t < OUTAGE[1]:
+            continue
+        rows.append([t, float(i % 50), float(i % 3) if t >= RAIN_ADDED else None])
+    backend.get_backend().upsert([db_const.COL_NAME_TIME, "Temp1", "Rain"], rows)
+
+
+def test_spans():
+    t0 = time.perf_counter()
+    coverage.rebuild()
+    print(f"rebuild: {round((time.perf_counter() - t0) * 1000, 1)}ms")
+    for col in ("Temp1", "Rain", "Light"):
+        print(col, coverage.get_spans(col))
+
+
+def test_insert():
+    db_model.insert_record(BASE_TIME + datetime.timedelta(days=40), Temp1=1.0)
+    print("after insert:", coverage.get_spans("Temp1"))
+
+
+def test_narrow():
+    start, end = BASE_TIME - datetime.timedelta(days=365), BASE_TIME + datetime.timedelta(days=15)
+    print("narrow Rain:", coverage.narrow(["Rain"], start, end))
+    print("narrow Temp1, Rain:", coverage.narrow(["Temp1", "Rain"], start, end))
+    end = BASE_TIME + datetime.timedelta(days=25)
+    print("narrow Rain, Temp1 (keeps the order):", coverage.narrow(["Rain", "Temp1"], start, end))
+    print("narrow all:", coverage.narrow(None, start, end))
+    # added after the rebuild and not inserted by db_model, so Wind isn't in the index: it is kept and the range isn't
+    # narrowed
+    db_model.add_column("Wind")
+    backend.get_backend().upsert([db_const.COL_NAME_TIME, "Wind"], [[BASE_TIME - datetime.timedelta(days=100), 5.0]])
+    print("narrow Wind, Rain (Wind not indexed):", coverage.narrow(["Wind", "Rain"], start, end))
+
+
+def add_records(short_name: str) -> None:
+    for i in range(RECORDS_PER_PROCESS):
+        coverage.add_record(BASE_TIME + datetime.timedelta(days=100 + 2 * i), {short_name: 1.0})
+
+
+def test_concurrent_add():
+    names = [f"Parallel{i}" for i in range(PROCESSES)]
+    processes = [multiprocessing.Process(target=add_records, args=(name,)) for name in names]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    counts = {name: len(coverage.get_spans(name)) for name in names}
+    print(f"spans after concurrent adds: {counts} (expected {RECORDS_PER_PROCESS} each)")
+
+
+if __name__ == "__main__":
+    tmp_dir = tempfile.mkdtemp()
+    backend._backend = sqlite_backend.SqliteBackend(os.path.join(tmp_dir, "test_coverage.sqlite3"))
+    config.get_coverage_file = lambda: os.path.join(tmp_dir, "coverage.json")
+    try:
+        fill()
+        test_spans()
+        test_insert()
+        test_narrow()
+        test_concurrent_add()
+    finally:
+        db_model.cleanup()
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""
+a writer process publishes rows as fast as it can (every value of a row is the same counter), the main process reads
+them: a torn read would return different values in one row. prints the time of one read compared with the fallback
+over the current value provider server
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+from wetstat.common import config
+from wetstat.sensors import current_values
+from wetstat.sensors import sensor_master
+
+COLUMNS = ["Light", "DigitalTemp", "Pressure", "Humidity", "Rain"]
+READS = 100000
+
+
+def write_forever(path: str, stop) -> None:
+    config.get_current_values_file = lambda: path
+    counter = 0
+    while not stop.is_set():
+        counter += 1
+        current_values.publish(time.time(), COLUMNS, [float(counter)] * (len(COLUMNS) - 1) + [None])
+
+
+if __name__ == "__main__":
+    path = os.path.join(tempfile.mkdtemp(), "wetstat_current_values")
+    config.get_current_values_file = lambda: path
+    print(f"before the first publish: {current_values.read()}")
+
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=write_forever, args=(path, stop))
+    writer.start()
+    try:
+        while current_values.read() is None:
+            time.sleep(0.01)
+        torn = 0
+        counters = set()
+        t0 = time.perf_counter()
+        for _ in range(READS):
+            values = current_values.read()
+            numbers = {values[col] for col in COLUMNS[:-1]}
+            torn += len(numbers) > 1
+            counters.update(numbers)
+        secs = time.perf_counter() - t0
+        print(f"{READS} reads: {round(secs / READS * 1e6, 2)}us per read, {len(counters)} different rows, "
+              f"torn rows: {torn}, Rain: {values['Rain']}")
+    finally:
+        stop.set()
+        writer.join()
+
+    print(f"max_age 0.5s, 1s after the writer stopped: {(time.sleep(1), current_values.read(max_age=0.5))[1]}")
+
+    config.get_current_values_file = lambda: path + "_missing"
+    current_values.cleanup()
+    t0 = time.perf_counter()
+    values = sensor_master.get_current_values()
+    print(f"fallback over tcp: {values} in {round((time.perf_counter() - t0) * 1000, 2)}ms")
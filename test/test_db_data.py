@@ -0,0 +1,59 @@
+# coding=utf-8
+import datetime
+import sys
+import time
+
+import numpy as np
+
+import wsgi_v2
+from wetstat.model.db import db_model
+
+NUM = 5
+COLUMNS = ["Time", "Temp1", "Temp2", "Humidity", "Pressure", "Light", "Rain"]
+
+# one year of 10-minute data like returned by cursor.fetchall(), about 1% missing values
+start = datetime.datetime(2019, 1, 1)
+rng = np.random.default_rng(42)
+rows = []
+for i in range(365 * 24 * 6):
+    rows.append((start + datetime.timedelta(minutes=10 * i),
+                 *(None if rng.random() < 0.01 else float(rng.normal(10, 8)) for _ in COLUMNS[1:])))
+
+
+def object_array_nbytes(array: np.ndarray) -> int:
+    # pointers plus the referenced python objects, None is a singleton and not counted
+    return array.nbytes + sum(sys.getsizeof(v) for v in array.flat if v is not None)
+
+
+def measure(name, func):
+    t0 = time.perf_counter()
+    for i in range(NUM):
+        func()
+    used = (time.perf_counter() - t0) / NUM
+    print(f"{name}: {round(used * 1000, 3)}ms")
+
+
+obj = np.array(rows)
+data = db_model.DbData.from_rows(rows, COLUMNS)
+print(f"{len(rows)} rows")
+print(f"memory object array: {round(object_array_nbytes(obj) / 2 ** 20, 2)} MiB")
+print(f"memory columnar:     {round(data.get_nbytes() / 2 ** 20, 2)} MiB")
+
+measure("construct object array", lambda: np.array(rows))
+measure("construct columnar    ", lambda: db_model.DbData.from_rows(rows, COLUMNS))
+
+# CustomPlot.split_data_to_lines
+measure("timestamps object array", lambda: [d.timestamp() for d in obj[:, 0]])
+measure("timestamps columnar    ", lambda: data.timestamps())
+
+# bokeh_view.generate_cds_from_data
+range_start, range_end = datetime.datetime(2019, 3, 1), datetime.datetime(2019, 9, 1)
+measure("select range object array", lambda: obj[np.searchsorted(obj[:, 0], range_start, "left"):
+                                                 np.searchsorted(obj[:, 0], range_end, "right"), 1])
+measure("select range columnar    ", lambda: data.between(range_start, range_end).column("Temp1"))
+
+# wsgi_v2.get_values
+measure("csv object array", lambda: [wsgi_v2.row_to_csv(row) for row in obj])
+measure("csv columnar    ", lambda: wsgi_v2.data_to_csv_lines(data))
+
+print("same csv:", [wsgi_v2.row_to_csv(row) for row in obj[:1000]] == wsgi_v2.data_to_csv_lines(data.slice(0, 1000)))
@@ -1,4 +1,8 @@
 # coding=utf-8
+"""
+uses the backend of config.get_db_backend(), run with the environment variable WETSTAT_DB_BACKEND=sqlite
+to test the sqlite backend. bulk_load_archive() is only for MySQL.
+"""
 import datetime
 import os
 import tempfile
@@ -6,6 +10,7 @@ import time
 
 from wetstat.common import config
 from wetstat.model import csvtools
+from wetstat.model.db import bulk_load
 from wetstat.model.db import db_model
 
 
@@ -21,6 +26,11 @@ def insert_all_data() -> None:
     print(f"inserting finished in {end - start} seconds.")
 
 
+def bulk_load_archive() -> None:
+    rows = bulk_load.load_csv_archive(datetime.date(2000, 1, 1), datetime.date(2019, 9, 28))
+    print(f"imported {rows} rows")
+
+
 def load1() -> None:
     start = datetime.datetime(2015, 1, 1)
     end = datetime.datetime(2015, 1, 2)
@@ -56,9 +66,24 @@ def test_nearest_record() -> None:
     print(result)
 
 
+def test_nearest_records_and_sums_multi() -> None:
+    now = datetime.datetime(2015, 6, 15, 12, 5, 1)
+    timestamps = [now - datetime.timedelta(days=n) for n in (0, 1, 30, 365)]
+    print(db_model.find_nearest_records(timestamps))
+    print(db_model.get_value_sums_multi(["Rain"], [(ts - datetime.timedelta(days=1), ts) for ts in timestamps]))
+
+
+def test_load_with_interval_rollup() -> None:
+    start = datetime.datetime(2015, 1, 1)
+    end = datetime.datetime(2015, 12, 31)
+    result = db_model.load_data_with_interval(datetime.timedelta(days=1), start=start, end=end)
+    print(result.columns, result.values.shape)
+
+
 if __name__ == "__main__":
     try:
         # insert_all_data()
+        # bulk_load_archive()
         # load1()
         # insert1()
         # test_export()
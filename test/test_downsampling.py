@@ -0,0 +1,93 @@
+# coding=utf-8
+"""
+downsamples ten years of synthetic 10-minute data and prints size, duration and whether the extremes are kept. the
+result must never have more than max_points records, even if every series selects other records. the records keep the
+time of the selected record, and the envelope of aggregated data (with _MIN and _MAX columns) keeps the extremes of
+every bucket
+"""
+import datetime
+import time
+
+import numpy as np
+
+import wsgi_v2
+from wetstat.model import downsampling
+from wetstat.model.db import db_model
+
+MAX_POINTS = 2000
+COLUMNS = ["Time", "Temp1", "Light", "Rain"]
+
+start = datetime.datetime(2010, 1, 1)
+n = 10 * 365 * 24 * 6
+rng = np.random.default_rng(42)
+days = np.arange(n) / 144
+temp = 10 - 12 * np.cos(days / 365 * 2 * np.pi) - 6 * np.cos(days * 2 * np.pi) + rng.normal(0, 1, n)
+temp[rng.random(n) < 0.01] = np.nan
+light = np.maximum(0, -np.cos(days * 2 * np.pi)) * 50000
+rain = np.where(rng.random(n) < 0.02, rng.random(n) * 3, 0.0)
+data = db_model.DbData((np.datetime64(start, "s") + np.arange(n) * 600).astype("datetime64[s]"),
+                       np.asfortranarray(np.stack([temp, light, rain], axis=1)), COLUMNS)
+
+
+def test_downsample():
+    t0 = time.perf_counter()
+    result = downsampling.downsample(data, MAX_POINTS)
+    used = time.perf_counter() - t0
+    print(f"{len(data)} records -> {len(result)} records in {round(used * 1000, 1)}ms, columns {result.columns}")
+    print("lttb selected (one record for all columns) max:", np.nanmax(result.column("Temp1")) == np.nanmax(temp),
+          "min:", np.nanmin(result.column("Temp1")) == np.nanmin(temp))
+    print("envelope covers all:", np.nanmin(result.column("Temp1_MIN")) == np.nanmin(temp),
+          np.nanmax(result.column("Temp1_MAX")) == np.nanmax(temp))
+    print("rain sum kept:", round(np.nansum(result.column("Rain")), 3) == round(rain.sum(), 3))
+    t0 = time.perf_counter()
+    csv_full = "\n".join(wsgi_v2.data_to_csv_lines(data))
+    csv_small = "\n".join(wsgi_v2.data_to_csv_lines(result))
+    print(f"csv {len(csv_full) // 1024} KiB -> {len(csv_small) // 1024} KiB "
+          f"({round((time.perf_counter() - t0) * 1000, 1)}ms)")
+
+
+def test_max_points():
+    series = [f"Noise{i}" for i in range(5)]
+    noise = db_model.DbData(data.times, np.asfortranarray(rng.normal(0, 1, (n, len(series)))), ["Time", *series])
+    for max_points in (3, 100, MAX_POINTS):
+        result = downsampling.downsample(noise, max_points)
+        print(f"{len(series)} series, max_points {max_points}: {len(result)} records, "
+              f"at most max_points: {len(result) <= max_points}")
+    result = downsampling.downsample(data, 100)
+    print(f"3 series, max_points 100: {len(result)} records, at most max_points: {len(result) <= 100}, "
+          f"rain sum kept: {round(np.nansum(result.column('Rain')), 3) == round(rain.sum(), 3)}")
+
+
+def test_selected_times():
+    result = downsampling.downsample(data, MAX_POINTS)
+    rows = np.searchsorted(data.times, result.times)
+    print("times of selected records:", np.array_equal(data.times[rows], result.times),
+          "values of these records:", np.array_equal(data.column("Light")[rows], result.column("Light")))
+
+
+def test_aggregated():
+    hourly = temp.reshape(-1, 6)
+    aggregated = db_model.DbData(data.times[::6], np.asfortranarray(np.stack(
+        [np.nanmean(hourly, axis=1), np.nanmin(hourly, axis=1), np.nanmax(hourly, axis=1)], axis=1)),
+        ["Time", "Temp1", "Temp1_MIN", "Temp1_MAX"])
+    result = downsampling.downsample(aggregated, MAX_POINTS)
+    starts = downsampling.bucket_edges(len(aggregated), MAX_POINTS)[:-1]
+    expected_min = np.fmin.reduceat(aggregated.column("Temp1_MIN"), starts)
+    expected_max = np.fmax.reduceat(aggregated.column("Temp1_MAX"), starts)
+    print(f"aggregated {len(aggregated)} records -> {len(result)} records, columns {result.columns}, "
+          f"buckets with the true minimum: {np.mean(result.column('Temp1_MIN') == expected_min):.0%}, "
+          f"maximum: {np.mean(result.column('Temp1_MAX') == expected_max):.0%}")
+
+
+def test_small():
+    small = data.slice(0, 10)
+    print("unchanged if small:", downsampling.downsample(small, 20) is small)
+    print(downsampling.downsample(small, 4).to_object_array())
+
+
+if __name__ == "__main__":
+    test_downsample()
+    test_max_points()
+    test_selected_times()
+    test_aggregated()
+    test_small()
@@ -0,0 +1,50 @@
+# coding=utf-8
+"""
+compares the aggregation in the database (backend.load_aggregated()) with binning.aggregate() for intervals
+without calendar boundaries and prints the durations. uses the configured backend (WETSTAT_DB_BACKEND) and the last
+30 days of data.
+"""
+import datetime
+import time
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.model.db import backend
+from wetstat.model.db import db_model
+
+INTERVALS = [datetime.timedelta(minutes=30), datetime.timedelta(hours=3), datetime.timedelta(hours=6),
+             datetime.timedelta(seconds=7200), datetime.timedelta(seconds=1234)]
+END = config.get_date()
+START = END - datetime.timedelta(days=30)
+
+
+def load_python(interval: datetime.timedelta) -> db_model.DbData:
+    # what _load_data_with_interval() does if the backend can't aggregate
+    original = backend.get_backend().load_aggregated
+    backend.get_backend().load_aggregated = lambda *args: None
+    try:
+        return db_model._load_data_with_interval(interval, START, END, None)
+    finally:
+        backend.get_backend().load_aggregated = original
+
+
+def test_same_results():
+    for interval in INTERVALS:
+        t0 = time.perf_counter()
+        in_db = backend.get_backend().load_aggregated(interval, START, END, None)
+        t1 = time.perf_counter()
+        in_python = load_python(interval)
+        t2 = time.perf_counter()
+        common = [col for col in in_python.columns if col in in_db.columns]
+        same = len(in_db) == len(in_python) and np.array_equal(in_db.times, in_python.times) \
+            and all(np.allclose(in_db.column(col), in_python.column(col), equal_nan=True) for col in common[1:])
+        print(f"{interval}: {len(in_db)} rows, same: {same}, "
+              f"database {round((t1 - t0) * 1000, 1)}ms, python {round((t2 - t1) * 1000, 1)}ms")
+
+
+if __name__ == "__main__":
+    try:
+        test_same_results()
+    finally:
+        db_model.cleanup()
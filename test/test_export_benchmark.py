@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+compares the download formats (csv + zip like DataDownload, parquet, arrow, npz) with two years of 10-minute data in a
+temporary SQLite database, prints the duration, the throughput and the file size. checks that the npz export contains
+the same values as db_model.load_data_for_date_range() and that the streamed npz (iter_bytes(), like api/values) is
+the same archive, delivered in parts.
+"""
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from wetstat.model import columnar_export
+from wetstat.model import util
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import sqlite_backend
+
+BASE_TIME = datetime.datetime(2018, 1, 1)
+RECORDS = 2 * 365 * 24 * 6
+BATCH = 5000
+COLUMNS = [db_const.COL_NAME_TIME, "Temp1", "Pressure", "Light", "Rain"]
+END = BASE_TIME + datetime.timedelta(minutes=10 * RECORDS)
+
+
+def fill() -> None:
+    rng = np.random.default_rng(42)
+    rows = []
+    for i in range(RECORDS):
+        rows.append([BASE_TIME + datetime.timedelta(minutes=10 * i), round(float(rng.normal(10, 8)), 2),
+                     round(float(rng.normal(940, 5)), 1), float(rng.integers(0, 50000)),
+                     0.5 if i % 20 == 0 else None])
+        if len(rows) == BATCH:
+            backend.get_backend().upsert(COLUMNS, rows)
+            rows = []
+    if rows:
+        backend.get_backend().upsert(COLUMNS, rows)
+
+
+def report(name: str, used: float, path: str) -> None:
+    size = os.path.getsize(path)
+    print(f"{name:12}{round(used, 3):>8}s {util.human_readable_size(RECORDS / used, unit=''):>10}records/s "
+          f"{util.human_readable_size(size):>10}")
+
+
+def test_formats(tmp_dir: str) -> None:
+    csv_path = os.path.join(tmp_dir, "export.csv")
+    t0 = time.perf_counter()
+    db_model.export_to_csv(BASE_TIME, END, csv_path)
+    shutil.make_archive(os.path.join(tmp_dir, "export"), "zip", root_dir=tmp_dir, base_dir="export.csv")
+    report("csv + zip", time.perf_counter() - t0, os.path.join(tmp_dir, "export.zip"))
+    for fmt in columnar_export.FORMATS.keys():
+        if not columnar_export.is_available(fmt):
+            print(f"{fmt:12}not available (pyarrow isn't installed)")
+            continue
+        path = os.path.join(tmp_dir, "export." + columnar_export.get_extension(fmt))
+        t0 = time.perf_counter()
+        columnar_export.export_to_columnar(BASE_TIME, END, path, fmt=fmt)
+        report(fmt, time.perf_counter() - t0, path)
+
+
+def test_npz_content(tmp_dir: str) -> None:
+    expected = db_model.load_data_for_date_range(BASE_TIME, END)
+    with np.load(os.path.join(tmp_dir, "export.npz")) as npz:
+        same = list(npz.keys()) == expected.columns and np.array_equal(npz[db_const.COL_NAME_TIME], expected.times) \
+               and all(np.array_equal(npz[col], expected.column(col), equal_nan=True)
+                       for col in expected.get_value_columns())
+    print("npz content same:", same)
+
+
+def test_npz_stream(tmp_dir: str) -> None:
+    parts = []
+    t0 = time.perf_counter()
+    for part in columnar_export.iter_bytes(db_model.iter_range(BASE_TIME, END), columnar_export.FORMAT_NPZ):
+        parts.append(part)
+    used = time.perf_counter() - t0
+    with np.load(os.path.join(tmp_dir, "export.npz")) as expected, np.load(io.BytesIO(b"".join(parts))) as npz:
+        same = list(npz.keys()) == list(expected.keys()) and all(np.array_equal(npz[name], expected[name],
+                                                                                equal_nan=True) for name in npz.keys())
+    print(f"npz stream: {len(parts)} parts, largest {util.human_readable_size(max(map(len, parts)))} "
+          f"in {round(used, 3)}s, same content: {same}")
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    backend._backend = sqlite_backend.SqliteBackend(os.path.join(tmp, "test_export.sqlite3"))
+    try:
+        fill()
+        test_formats(tmp)
+        test_npz_content(tmp)
+        test_npz_stream(tmp)
+    finally:
+        db_model.cleanup()
+        shutil.rmtree(tmp, ignore_errors=True)
@@ -1,4 +1,24 @@
 # coding=utf-8
+"""
+prints the average time of one sampled row and the read latencies of the sensors, then measures forever.
+set config.SHARED_SAMPLE_MAX_AGE_SECONDS = 0 to compare with a separate BME280 reading per sensor.
+"""
+import time
+
+from wetstat.common import config
+from wetstat.sensors import sampling
 from wetstat.sensors.sensor_master import SensorMaster
 
+BENCHMARK_ROWS = 10
+
+scheduler = SensorMaster._get_scheduler()
+t0 = time.perf_counter()
+for _ in range(BENCHMARK_ROWS):
+    scheduler.sample_row()
+    time.sleep(config.SHARED_SAMPLE_MAX_AGE_SECONDS)  # every row gets a new reading, like every 5 seconds
+row_ms = (time.perf_counter() - t0 - BENCHMARK_ROWS * config.SHARED_SAMPLE_MAX_AGE_SECONDS) / BENCHMARK_ROWS * 1000
+print(f"one row: {round(row_ms, 3)}ms (SHARED_SAMPLE_MAX_AGE_SECONDS={config.SHARED_SAMPLE_MAX_AGE_SECONDS})")
+for short_name, stats in sampling.get_stats()["sensors"].items():
+    print(short_name, stats)
+
 SensorMaster.measure(120)
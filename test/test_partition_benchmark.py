@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+compares typical week/month/year queries on a plain and on a monthly partitioned copy of the data table.
+EXPLAIN shows which partitions are read (pruning), the durations are printed per query.
+the tables bench_plain and bench_partitioned are created with synthetic data and dropped afterwards.
+"""
+import datetime
+import time
+
+from wetstat.model.db import connection_pool
+from wetstat.model.db import partition
+
+NUM = 10
+YEARS = 8
+BASE_TIME = datetime.datetime(2012, 1, 1)
+TABLES = ["bench_plain", "bench_partitioned"]
+QUERIES = {
+    "week": ("SELECT * FROM {table} WHERE Time BETWEEN %s AND %s",
+             datetime.datetime(2018, 6, 4), datetime.datetime(2018, 6, 10, 23, 59, 59)),
+    "month": ("SELECT * FROM {table} WHERE Time BETWEEN %s AND %s",
+              datetime.datetime(2018, 6, 1), datetime.datetime(2018, 6, 30, 23, 59, 59)),
+    "year group by day": ("SELECT DATE(Time), AVG(Temp1), MIN(Temp1), MAX(Temp1) FROM {table} "
+                          "WHERE Time BETWEEN %s AND %s GROUP BY DATE(Time)",
+                          datetime.datetime(2018, 1, 1), datetime.datetime(2018, 12, 31, 23, 59, 59)),
+    "years group by year": ("SELECT YEAR(Time), AVG(Temp1) FROM {table} WHERE Time BETWEEN %s AND %s "
+                            "GROUP BY YEAR(Time)",
+                            datetime.datetime(2016, 1, 1), datetime.datetime(2017, 12, 31, 23, 59, 59)),
+}
+
+
+def create_tables(conn, cur) -> None:
+    months = []
+    month = BASE_TIME
+    while month < BASE_TIME.replace(year=BASE_TIME.year + YEARS):
+        months.append(month)
+        month = partition._next_month(month)
+    for table in TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table};")
+        cur.execute(f"CREATE TABLE {table} (Time DATETIME NOT NULL PRIMARY KEY, Temp1 FLOAT, Light FLOAT)")
+    cur.execute(f"ALTER TABLE bench_partitioned PARTITION BY RANGE COLUMNS(Time) "
+                f"({', '.join(map(partition._partition_definition, months))}, {partition._future_definition()});")
+    rows = [(BASE_TIME + datetime.timedelta(minutes=10 * i), i % 300 / 10, i % 5000)
+            for i in range(YEARS * 365 * 24 * 6)]
+    for table in TABLES:
+        for i in range(0, len(rows), 10000):
+            cur.executemany(f"INSERT INTO {table} (Time, Temp1, Light) VALUES (%s, %s, %s)", rows[i:i + 10000])
+        conn.commit()
+    print(f"{len(rows)} records in {len(months)} partitions")
+
+
+def run_queries(cur) -> None:
+    for name, (statement, start, end) in QUERIES.items():
+        print(f"{name}:")
+        for table in TABLES:
+            cur.execute("EXPLAIN " + statement.format(table=table), (start, end))
+            explain = cur.fetchall()
+            columns = cur.column_names
+            partitions = explain[0][columns.index("partitions")] if "partitions" in columns else None
+            t0 = time.perf_counter()
+            for i in range(NUM):
+                cur.execute(statement.format(table=table), (start, end))
+                cur.fetchall()
+            used = (time.perf_counter() - t0) / NUM
+            print(f"    {table:20}{round(used * 1000, 3):>10}ms    partitions: {partitions}")
+
+
+if __name__ == "__main__":
+    try:
+        with connection_pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                create_tables(connection, cursor)
+                run_queries(cursor)
+            finally:
+                for tab in TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {tab};")
+                cursor.close()
+    finally:
+        connection_pool.cleanup()
@@ -0,0 +1,37 @@
+# coding=utf-8
+import json
+import time
+
+from wetstat.model.db import profiler
+
+STATEMENTS = [
+    "SELECT Time, Temp1 FROM data WHERE Time BETWEEN '2020-01-01 00:00:00' AND '2020-01-31 23:59:59'",
+    "SELECT Time, Temp1 FROM data WHERE Time BETWEEN '2021-03-01 00:00:00' AND '2021-03-31 23:59:59'",
+    "(SELECT 0 AS QueryIndex, data.* FROM data WHERE Time >= %s ORDER BY Time ASC LIMIT 1) UNION ALL "
+    "(SELECT 0 AS QueryIndex, data.* FROM data WHERE Time <= %s ORDER BY Time DESC LIMIT 1) UNION ALL "
+    "(SELECT 1 AS QueryIndex, data.* FROM data WHERE Time >= %s ORDER BY Time ASC LIMIT 1) UNION ALL "
+    "(SELECT 1 AS QueryIndex, data.* FROM data WHERE Time <= %s ORDER BY Time DESC LIMIT 1)",
+]
+
+
+def test_fingerprint():
+    for statement in STATEMENTS:
+        print(profiler.fingerprint(statement))
+
+
+def test_overhead():
+    num = 10000
+    start = time.perf_counter()
+    for i in range(num):
+        with profiler.profile(STATEMENTS[i % len(STATEMENTS)]) as entry:
+            entry.set_result(i % 100, columns=2)
+    print(f"profile(): {round((time.perf_counter() - start) / num * 1e6, 2)}us per query")
+    start = time.perf_counter()
+    stats = profiler.get_stats()
+    print(f"get_stats(): {round((time.perf_counter() - start) * 1000, 2)}ms for {stats['buffered']} entries")
+    print(json.dumps(stats["queries"][:2], indent=2))
+
+
+if __name__ == "__main__":
+    test_fingerprint()
+    test_overhead()
@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+compares the old string formatted sql with the prepared statements of wetstat.model.db.query
+"""
+import datetime
+import time
+
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+
+NUM = 500
+BASE_TIME = datetime.datetime(2100, 1, 1)  # far in the future, the records are deleted afterwards
+VALUES = {"Temp1": 12.345, "Light": 54321.0}
+
+
+def string_insert(conn, cur, i: int) -> None:
+    cols = list(VALUES.keys()) + [db_const.COL_NAME_TIME]
+    vals = list(VALUES.values()) + [BASE_TIME + datetime.timedelta(minutes=10 * i)]
+    cur.execute(f"INSERT INTO data ({', '.join(cols)}) VALUES ({', '.join(map(db_model.to_sql_str, vals))});")
+    conn.commit()
+
+
+def prepared_insert(conn, cur, i: int) -> None:
+    db_model.do_insert(conn, cur, list(VALUES.keys()) + [db_const.COL_NAME_TIME],
+                       list(VALUES.values()) + [BASE_TIME + datetime.timedelta(minutes=10 * i)])
+
+
+def string_nearest(conn, cur, i: int) -> None:
+    time_str = db_model.to_sql_str(datetime.datetime(2015, 6, 15, 12, 5) + datetime.timedelta(hours=i))
+    cur.execute(f"SELECT * FROM data WHERE Time >= {time_str} ORDER BY Time ASC LIMIT 1;")
+    cur.fetchall()
+    cur.execute(f"SELECT * FROM data WHERE Time <= {time_str} ORDER BY Time DESC LIMIT 1;")
+    cur.fetchall()
+
+
+def prepared_nearest(conn, cur, i: int) -> None:
+    timestamp = datetime.datetime(2015, 6, 15, 12, 5) + datetime.timedelta(hours=i)
+    db_model.query.fetch_all(conn, db_model.NEAREST_FUTURE_STATEMENT, (timestamp,))
+    db_model.query.fetch_all(conn, db_model.NEAREST_PAST_STATEMENT, (timestamp,))
+
+
+def cleanup(conn, cur) -> None:
+    cur.execute("DELETE FROM data WHERE Time >= %s", (BASE_TIME,))
+    conn.commit()
+
+
+def run(name: str, func, conn, cur, offset: int = 0) -> None:
+    start = time.perf_counter()
+    for i in range(NUM):
+        func(conn, cur, offset + i)
+    used = time.perf_counter() - start
+    print(f"{name:20}{round(used / NUM * 1000, 4)}ms per call")
+
+
+if __name__ == "__main__":
+    try:
+        with connection_pool.connection() as connection:
+            cursor = connection.cursor()
+            cleanup(connection, cursor)
+            run("string insert", string_insert, connection, cursor)
+            run("prepared insert", prepared_insert, connection, cursor, NUM)
+            run("string nearest", string_nearest, connection, cursor)
+            run("prepared nearest", prepared_nearest, connection, cursor)
+            cleanup(connection, cursor)
+            cursor.close()
+    finally:
+        db_model.cleanup()
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+checks the query budget with a temporary SQLite database: row limit, execution time limit, the interval switch of
+api/values and that a closed streamed response stops reading
+"""
+import datetime
+import os
+import tempfile
+import time
+
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import query_budget
+from wetstat.model.db import sqlite_backend
+
+BASE_TIME = datetime.datetime(2019, 1, 1)
+RECORDS = 365 * 24 * 6
+END = BASE_TIME + datetime.timedelta(minutes=10 * RECORDS)
+
+
+def fill() -> None:
+    backend.get_backend().upsert([db_const.COL_NAME_TIME, "Temp1", "Light"],
+                                 [[BASE_TIME + datetime.timedelta(minutes=10 * i), float(i % 50), float(i)]
+                                  for i in range(RECORDS)])
+
+
+def expect(name: str, exception_type, func) -> None:
+    t0 = time.perf_counter()
+    try:
+        result = func()
+        print(f"{name}: no exception, {len(result)} rows")
+    except exception_type as e:
+        print(f"{name}: {type(e).__name__} after {round((time.perf_counter() - t0) * 1000, 1)}ms ({e})")
+
+
+def test_limits():
+    with query_budget.limit(query_budget.QueryBudget(max_rows=1000)):
+        expect("row limit", query_budget.RowLimitError, lambda: backend.get_backend().load_range(BASE_TIME, END, None))
+        expect("row limit stream", query_budget.RowLimitError,
+               lambda: [len(chunk) for chunk in db_model.iter_range(BASE_TIME, END, chunk_rows=100)])
+        expect("below row limit", query_budget.RowLimitError,
+               lambda: backend.get_backend().load_range(BASE_TIME, BASE_TIME + datetime.timedelta(days=1), None))
+    with query_budget.limit(query_budget.QueryBudget(max_execution_seconds=0.001)):
+        expect("time limit", TimeoutError,
+               lambda: backend.get_backend().load_aggregated(datetime.timedelta(seconds=7), BASE_TIME, END, None))
+    with query_budget.limit(query_budget.QueryBudget(max_execution_seconds=0.05)):
+        stream = db_model.iter_range(BASE_TIME, END, chunk_rows=100)
+        next(stream)
+    time.sleep(0.1)  # the time of the open stream is over, but it must not interrupt other queries of the thread
+    expect("other query while a stream is open", Exception,
+           lambda: backend.get_backend().load_range(BASE_TIME, END, None))
+    stream.close()
+
+
+def test_wsgi():
+    import wsgi_v2
+    from_ts, to_ts = int(BASE_TIME.timestamp()), int(END.timestamp())
+    responses = []
+
+    def start_response(status, headers):
+        responses.append(status)
+
+    for query in (f"from={from_ts}&to={to_ts}&interval=10min",
+                  f"from={from_ts}&to={to_ts}&interval=10min&auto_interval=0"):
+        wsgi_v2.ENDPOINT_BUDGETS["/api/values"] = query_budget.QueryBudget(max_rows=10000)
+        body = wsgi_v2.application({"REQUEST_URI": "/api/values?" + query}, start_response)
+        print(f"{query}: {responses[-1]}, {len(b''.join(body).splitlines())} lines")
+    wsgi_v2.ENDPOINT_BUDGETS["/api/values"] = query_budget.QueryBudget(max_rows=2 * RECORDS)
+    stream = wsgi_v2.application({"REQUEST_URI": f"/api/values?from={from_ts}&to={to_ts}"}, start_response)
+    first = next(stream)
+    stream.close()  # like a server whose client is gone
+    print(f"stream closed after {len(first.splitlines())} lines, {responses[-1]}")
+
+
+if __name__ == "__main__":
+    backend._backend = sqlite_backend.SqliteBackend(os.path.join(tempfile.mkdtemp(), "test_query_budget.sqlite3"))
+    try:
+        fill()
+        test_limits()
+        test_wsgi()
+    finally:
+        db_model.cleanup()
@@ -0,0 +1,87 @@
+# coding=utf-8
+"""
+moves a date picker like window over a temporary SQLite database, compares RangeBuffer with fresh loads and with
+load_data_for_date_range(already_existing=...) and prints the durations
+"""
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import range_buffer
+from wetstat.model.db import range_cache
+from wetstat.model.db import sqlite_backend
+
+BASE_TIME = datetime.datetime(2019, 1, 1)
+COLUMNS = ["Temp1", "Light"]
+# (start, end) of the window after each date picker change
+WINDOWS = [(BASE_TIME + datetime.timedelta(days=100 - n), BASE_TIME + datetime.timedelta(days=107 + n, hours=23))
+           for n in range(0, 90, 3)]
+
+
+def same(a: db_model.DbData, b: db_model.DbData) -> bool:
+    return a.columns == b.columns and np.array_equal(a.times, b.times) \
+           and np.array_equal(a.values, b.values, equal_nan=True)
+
+
+def run_buffer() -> bool:
+    buffer = range_buffer.RangeBuffer(COLUMNS)
+    all_same = True
+    for start, end in WINDOWS:
+        buffer.ensure(start, end)
+        buffer.trim(start - datetime.timedelta(days=31), end + datetime.timedelta(days=31))
+        all_same &= same(buffer.between(start, end), db_model.load_data_for_date_range(start, end, columns=COLUMNS))
+    return all_same
+
+
+def run_buffer_only() -> None:
+    buffer = range_buffer.RangeBuffer(COLUMNS)
+    for start, end in WINDOWS:
+        buffer.ensure(start, end)
+        buffer.trim(start - datetime.timedelta(days=31), end + datetime.timedelta(days=31))
+        buffer.between(start, end)
+
+
+def run_already_existing() -> None:
+    data = None
+    for start, end in WINDOWS:
+        data = db_model.load_data_for_date_range(start, end, already_existing=data, columns=COLUMNS)
+        data.between(start, end)
+
+
+def test_trim():
+    buffer = range_buffer.RangeBuffer(COLUMNS)
+    buffer.ensure(BASE_TIME, BASE_TIME + datetime.timedelta(days=60))
+    print(f"{len(buffer.blocks)} blocks, {buffer.get_nbytes()} bytes")
+    buffer.trim(BASE_TIME + datetime.timedelta(days=20, hours=5), BASE_TIME + datetime.timedelta(days=40))
+    print(f"{len(buffer.blocks)} blocks after trim, loaded {buffer.loaded_start} to {buffer.loaded_end}")
+    buffer.ensure(BASE_TIME + datetime.timedelta(days=10), BASE_TIME + datetime.timedelta(days=50))
+    start, end = BASE_TIME + datetime.timedelta(days=10), BASE_TIME + datetime.timedelta(days=50)
+    print("same after trim and extend:", same(buffer.between(start, end),
+                                             db_model.load_data_for_date_range(start, end, columns=COLUMNS)))
+
+
+def measure(name, func):
+    t0 = time.perf_counter()
+    func()
+    print(f"{name}: {round((time.perf_counter() - t0) * 1000, 3)}ms for {len(WINDOWS)} changes")
+
+
+if __name__ == "__main__":
+    backend._backend = sqlite_backend.SqliteBackend(os.path.join(tempfile.mkdtemp(), "test_range_buffer.sqlite3"))
+    range_cache.MAX_BYTES = 0  # measure the database loads
+    try:
+        backend.get_backend().upsert([db_const.COL_NAME_TIME, "Temp1", "Light"],
+                                     [[BASE_TIME + datetime.timedelta(minutes=10 * i), float(i % 50), float(i)]
+                                      for i in range(144 * 365)])
+        print("same as fresh loads:", run_buffer())
+        test_trim()
+        measure("RangeBuffer     ", run_buffer_only)
+        measure("already_existing", run_already_existing)
+    finally:
+        db_model.cleanup()
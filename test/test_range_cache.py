@@ -0,0 +1,100 @@
+# coding=utf-8
+"""
+compares the cached loads with uncached loads and prints the durations, uses a temporary SQLite database. another
+process inserts into a cached day, the cache of this process must not return the old values (also after the shared
+invalidation log was replaced)
+"""
+import datetime
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import range_cache
+from wetstat.model.db import sqlite_backend
+
+NUM = 20
+BASE_TIME = datetime.datetime(2020, 1, 1)
+START = BASE_TIME + datetime.timedelta(hours=5)
+END = BASE_TIME + datetime.timedelta(days=30, hours=3)
+
+
+def load_uncached(columns=None) -> db_model.DbData:
+    return backend.get_backend().load_range(START, END, db_model.select_columns(columns))
+
+
+def same(a: db_model.DbData, b: db_model.DbData) -> bool:
+    return a.columns == b.columns and np.array_equal(a.times, b.times) \
+           and np.array_equal(a.values, b.values, equal_nan=True)
+
+
+def measure(name, func):
+    t0 = time.perf_counter()
+    for i in range(NUM):
+        func()
+    print(f"{name}: {round((time.perf_counter() - t0) / NUM * 1000, 3)}ms")
+
+
+def test_same_results():
+    for columns in (None, ["Temp1"]):
+        print(f"range {columns}:", same(db_model.load_data_for_date_range(START, END, columns=columns),
+                                        load_uncached(columns)))
+    for interval in (datetime.timedelta(hours=1), datetime.timedelta(days=1), datetime.timedelta(weeks=1)):
+        expected = db_model._load_data_with_interval(interval, START, END, None)
+        db_model.load_data_with_interval(interval, start=START, end=END)
+        print(f"interval {interval}:", same(db_model.load_data_with_interval(interval, start=START, end=END), expected))
+    print(range_cache.get_stats())
+
+
+def test_invalidation():
+    db_model.insert_record(BASE_TIME + datetime.timedelta(days=3, hours=2), update_if_exists=True, Temp1=999.0)
+    print("inserted value loaded:", 999.0 in db_model.load_data_for_date_range(START, END).column("Temp1"))
+    print(range_cache.get_stats())
+
+
+def insert_in_other_process(path: str, day: int, value: float, max_log_bytes: int) -> None:
+    backend._backend = sqlite_backend.SqliteBackend(path)
+    range_cache.MAX_LOG_BYTES = max_log_bytes
+    try:
+        db_model.insert_record(BASE_TIME + datetime.timedelta(days=day, hours=4), update_if_exists=True, Temp1=value)
+    finally:
+        db_model.cleanup()
+
+
+def test_other_process(path: str):
+    for day, value, max_log_bytes in ((5, 555.0, range_cache.MAX_LOG_BYTES), (6, 666.0, 1)):
+        db_model.load_data_for_date_range(START, END)  # cached
+        process = multiprocessing.Process(target=insert_in_other_process, args=(path, day, value, max_log_bytes))
+        process.start()
+        process.join()
+        print(f"value inserted by another process loaded{' (log replaced)' if max_log_bytes == 1 else ''}:",
+              value in db_model.load_data_for_date_range(START, END).column("Temp1"))
+    print(range_cache.get_stats())
+
+
+def test_speed():
+    measure("uncached", load_uncached)
+    measure("cached  ", lambda: db_model.load_data_for_date_range(START, END))
+
+
+if __name__ == "__main__":
+    tmp_dir = tempfile.mkdtemp()
+    db_path = os.path.join(tmp_dir, "test_range_cache.sqlite3")
+    config.get_range_cache_invalidation_file = lambda: os.path.join(tmp_dir, "invalidations")
+    backend._backend = sqlite_backend.SqliteBackend(db_path)
+    try:
+        backend.get_backend().upsert([db_const.COL_NAME_TIME, "Temp1", "Light"],
+                                     [[BASE_TIME + datetime.timedelta(minutes=10 * i), float(i % 50), float(i)]
+                                      for i in range(144 * 40)])
+        test_same_results()
+        test_invalidation()
+        test_other_process(db_path)
+        test_speed()
+    finally:
+        db_model.cleanup()
@@ -0,0 +1,82 @@
+# coding=utf-8
+"""
+writes two days of samples (5 seconds) into a temporary raw sample store, with a sensor added in the middle of the
+second day, and checks load(), the time order, a torn last record and the retention. a load from 1970 lists the
+folder only once
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.model.db import db_model
+from wetstat.model.db import raw_samples
+
+BASE_TIME = datetime.datetime(2020, 3, 1)
+STEP = datetime.timedelta(seconds=5)
+SAMPLES_PER_DAY = 24 * 60 * 12
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp(prefix="wetstat_raw_")
+    config.get_raw_samples_folder = lambda: folder
+    config.get_date = lambda: BASE_TIME + datetime.timedelta(days=2)
+    try:
+        t0 = time.perf_counter()
+        for i in range(2 * SAMPLES_PER_DAY):
+            timestamp = BASE_TIME + i * STEP
+            if i < SAMPLES_PER_DAY + SAMPLES_PER_DAY // 2:
+                raw_samples.append(timestamp, ["Temp1", "Light"], [i % 100 / 10, None if i % 7 == 0 else float(i)])
+            else:
+                raw_samples.append(timestamp, ["Temp1", "Light", "Humidity"], [i % 100 / 10, float(i), 50.0])
+        raw_samples.append(BASE_TIME, ["Temp1", "Light", "Humidity"], [1.0, 1.0, 1.0])  # older, dropped
+        secs = time.perf_counter() - t0
+        per_sample_us = round(secs / 2 / SAMPLES_PER_DAY * 1e6, 1)
+        print(f"appended {2 * SAMPLES_PER_DAY} samples in {round(secs, 3)}s ({per_sample_us}us/sample), "
+              f"files: {sorted(os.listdir(folder))}")
+
+        start = BASE_TIME + datetime.timedelta(hours=12, seconds=3)
+        data = db_model.load_raw_samples(start, start + datetime.timedelta(minutes=10))
+        print(f"10 minutes: {len(data)} samples (expected 120), columns {data.columns}, "
+              f"first {data.times[0]}, NaN in Light: {int(np.isnan(data.column('Light')).sum())}")
+
+        t0 = time.perf_counter()
+        data = db_model.load_raw_samples(BASE_TIME, BASE_TIME + datetime.timedelta(days=2), ["Light", "Humidity"])
+        print(f"2 days: {len(data)} samples in {round(time.perf_counter() - t0, 4)}s, sorted: "
+              f"{bool(np.all(np.diff(data.seconds()) > 0))}, Humidity values: "
+              f"{int((~np.isnan(data.column('Humidity'))).sum())} (expected {SAMPLES_PER_DAY // 2})")
+
+        listdir_calls = []
+        listdir = os.listdir
+        os.listdir = lambda path: listdir_calls.append(path) or listdir(path)
+        try:
+            t0 = time.perf_counter()
+            data = db_model.load_raw_samples(datetime.datetime(1970, 1, 1), BASE_TIME + datetime.timedelta(days=2))
+        finally:
+            os.listdir = listdir
+        print(f"from 1970: {len(data)} samples in {round(time.perf_counter() - t0, 4)}s, folder listed "
+              f"{len(listdir_calls)} times")
+
+        raw_samples.cleanup()
+        last_file = os.path.join(folder, sorted(os.listdir(folder))[-1])
+        with open(last_file, "ab") as f:
+            f.write(b"\x01\x02\x03")  # half written record
+        raw_samples._last_seconds = None
+        raw_samples.append(BASE_TIME + 2 * SAMPLES_PER_DAY * STEP - datetime.timedelta(seconds=1),
+                           ["Temp1", "Light", "Humidity"], [1.0, 2.0, 3.0])
+        last = db_model.load_raw_samples(BASE_TIME, BASE_TIME + datetime.timedelta(days=3)).slice(-2, None)
+        print(f"appended after torn record, last records (expected ...23:59:55 and ...23:59:59): {last.times}, "
+              f"{last.values.tolist()}")
+
+        config.RAW_SAMPLE_RETENTION_DAYS = 1
+        raw_samples.append(BASE_TIME + datetime.timedelta(days=2), ["Temp1", "Light", "Humidity"], [1.0, 2.0, 3.0])
+        print(f"files after retention of 1 day: {sorted(os.listdir(folder))}")
+        data = db_model.load_raw_samples(BASE_TIME, BASE_TIME + datetime.timedelta(days=3))
+        print(f"load after 1 day of retention starts at {data.times[0]} "
+              f"(expected 2020-03-02T00:00:00, today is 2020-03-03)")
+    finally:
+        raw_samples.cleanup()
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,52 @@
+# coding=utf-8
+"""
+adds a sensor column after the rollup tables were created and inserts a record with it: the rollup tables must get
+the new columns and keep being refreshed. uses the MySQL database wetstat_test (wetstat_user needs the CREATE and
+DROP privileges), which is dropped afterwards.
+"""
+import datetime
+
+from mysql import connector
+
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import rollup
+from wetstat.model.db import schema
+
+TEST_DATABASE = "wetstat_test"
+TIME = datetime.datetime(2020, 6, 1, 12, 10)
+
+
+def run_on_server(statement: str) -> None:
+    conn = connector.connect(user="wetstat_user", password="wetstat", host="localhost", port=3306)
+    try:
+        conn.cursor().execute(statement)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_on_server(f"CREATE DATABASE IF NOT EXISTS {TEST_DATABASE}")
+    db_const.DATABASE_NAME = TEST_DATABASE
+    try:
+        with connection_pool.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {db_const.DATA_DB_NAME}")
+            cur.execute(f"CREATE TABLE {db_const.DATA_DB_NAME} ({db_const.COL_NAME_TIME} DATETIME NOT NULL "
+                        f"PRIMARY KEY, Light FLOAT)")
+            schema.invalidate()
+            rollup.create_tables(cur, drop_existing=True)
+            cur.execute(f"EXPLAIN {rollup.LEVEL_HOUR.table}")
+            print(f"rollup columns before: {[row[0] for row in cur.fetchall()]}")
+
+        db_model.add_column("Humidity")
+        db_model.insert_record(TIME, Light=100.0, Humidity=55.5)
+        db_model.insert_record(TIME + datetime.timedelta(minutes=10), Light=200.0, Humidity=60.5)
+
+        with connection_pool.cursor() as cur:
+            for level in rollup.ALL_LEVELS:
+                cur.execute(f"SELECT Light_SUM, Humidity_SUM, Humidity_CNT FROM {level.table}")
+                print(f"{level.table}: {cur.fetchall()} (expected [(300.0, 116.0, 2)])")
+    finally:
+        db_model.cleanup()
+        run_on_server(f"DROP DATABASE {TEST_DATABASE}")
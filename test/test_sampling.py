@@ -0,0 +1,64 @@
+# coding=utf-8
+"""
+checks sampling.SamplingScheduler with a fast, a slow, a hanging and a failing sensor: the ticks stay on their
+deadlines, the late and failed reads are missing values and the hanging sensor only blocks one worker
+"""
+import time
+
+from wetstat.sensors import sampling
+from wetstat.sensors.real.fake_sensor import FakeSensor
+
+INTERVAL = 0.5
+READ_TIMEOUT = 0.2
+TICKS = 8
+
+
+class DelayedSensor(FakeSensor):
+
+    def __init__(self, number: int, delay: float, fail: bool = False) -> None:
+        super().__init__(number)
+        self.delay = delay
+        self.fail = fail
+
+    def measure(self):
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError("I2C bus error")
+        return super().measure()
+
+
+if __name__ == "__main__":
+    sensors = [
+        DelayedSensor(1, 0.0),
+        DelayedSensor(2, 0.1),
+        DelayedSensor(3, 3.0),  # hangs longer than some ticks
+        DelayedSensor(4, 0.05, fail=True),
+    ]
+    scheduler = sampling.SamplingScheduler(sensors, interval=INTERVAL, read_timeout=READ_TIMEOUT)
+    tick_times = []
+    rows = []
+
+    def on_row(row):
+        tick_times.append(time.monotonic())
+        rows.append(row)
+
+    start = time.monotonic()
+    finished = scheduler.run(start + (TICKS - 0.5) * INTERVAL, on_row)
+    scheduler.shutdown()
+
+    print(f"finished: {finished}, rows: {len(rows)} (expected {TICKS})")
+    drift = [round(t - start - i * INTERVAL, 3) for i, t in enumerate(tick_times)]
+    print(f"row finished after tick (s): {drift}, all below read timeout: {max(drift) < READ_TIMEOUT + 0.05}")
+    for i, sensor in enumerate(sensors):
+        column = [row[i] for row in rows]
+        print(f"{sensor.get_short_name()}: {sum(v is not None for v in column)} of {len(column)} values")
+    stats = sampling.get_stats()
+    print(f"missed ticks: {stats['missed_ticks']}")
+    for short_name, sensor_stats in stats["sensors"].items():
+        print(short_name, sensor_stats)
+
+    stopped = sampling.SamplingScheduler(sensors[:1], interval=INTERVAL)
+    t0 = time.monotonic()
+    print(f"should_stop ends run: {not stopped.run(t0 + 60, on_row, should_stop=lambda: time.monotonic() - t0 > 1)}"
+          f" after {round(time.monotonic() - t0, 2)}s")
+    stopped.shutdown()
@@ -0,0 +1,123 @@
+# coding=utf-8
+"""
+checks the write-ahead log with a temporary SQLite database which fails on demand: records measured while the
+database is down stay in the log, a half written record is dropped, and the replayer inserts the backlog when the
+database is back. a crash between resetting the checkpoint and truncating the log must not lose the records which are
+appended afterwards
+"""
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from wetstat.common import config
+from wetstat.model.db import backend
+from wetstat.model.db import db_model
+from wetstat.model.db import sqlite_backend
+from wetstat.model.db import wal
+
+BASE_TIME = datetime.datetime(2020, 5, 1)
+STEP = datetime.timedelta(minutes=10)
+
+
+class FlakyBackend(sqlite_backend.SqliteBackend):
+    fail = False
+
+    def upsert(self, column_names, rows, update_if_exists=False) -> None:
+        if self.fail:
+            raise sqlite3.OperationalError("database is locked")
+        super().upsert(column_names, rows, update_if_exists)
+
+
+def measure(i: int) -> None:
+    """
+    like the end of SensorMaster.measure_now()
+    """
+    wal.append(BASE_TIME + i * STEP, {"Temp1": float(i), "Light": None if i % 2 else 100.0 + i})
+    try:
+        wal.replay()
+    except sqlite3.OperationalError as e:
+        print(f"record {i}: insert failed ({e}), backlog {wal.get_backlog()}")
+
+
+def count_records() -> int:
+    return len(db_model.load_data_for_date_range(BASE_TIME, BASE_TIME + datetime.timedelta(days=1)))
+
+
+def test_crash_while_truncating(flaky: FlakyBackend) -> None:
+    """
+    a backlog is replayed in batches, so the checkpoint moves through the log. at the end the reset of the checkpoint
+    and the truncation of the log are two steps, the process crashes before the second one
+    """
+    flaky.fail = True
+    for i in range(10, 15):
+        measure(i)
+    flaky.fail = False
+    steps = []
+
+    def crash_in_second_step(function):
+        def wrapper(*args):
+            if function is truncate or args[1] == b"0":
+                steps.append(function.__name__)
+                if len(steps) == 2:
+                    raise SystemExit("crash")
+            function(*args)
+        return wrapper
+
+    fsync_write, truncate, batch = wal._fsync_write, wal._truncate_log_locked, wal.REPLAY_BATCH_RECORDS
+    wal._fsync_write, wal._truncate_log_locked = crash_in_second_step(fsync_write), crash_in_second_step(truncate)
+    wal.REPLAY_BATCH_RECORDS = 2
+    try:
+        wal.replay()
+    except SystemExit:
+        pass
+    finally:
+        wal._fsync_write, wal._truncate_log_locked, wal.REPLAY_BATCH_RECORDS = fsync_write, truncate, batch
+    flaky.fail = True
+    for i in range(15, 21):  # the log grows past the offset of the batches before the crash
+        measure(i)
+    flaky.fail = False
+    wal.replay()
+    data = db_model.load_data_for_date_range(BASE_TIME + 10 * STEP, BASE_TIME + 20 * STEP)
+    print(f"after crash while truncating: backlog {wal.get_backlog()}, {len(data)} records (expected 11), "
+          f"Temp1 {data.column('Temp1').tolist()}")
+
+
+if __name__ == "__main__":
+    folder = tempfile.mkdtemp(prefix="wetstat_wal_")
+    config.get_wal_file = lambda: os.path.join(folder, "measurements.wal")
+    flaky = FlakyBackend(os.path.join(folder, "test_wal.sqlite3"))
+    backend._backend = flaky
+    try:
+        measure(0)
+        print(f"database up: {count_records()} records, backlog {wal.get_backlog()}, "
+              f"log size {os.path.getsize(config.get_wal_file())}")
+
+        flaky.fail = True
+        for i in range(1, 4):
+            measure(i)
+        with open(config.get_wal_file(), "ab") as f:
+            f.write(b'{"time": "2020-05-01T00:40:00", "val')  # crash while appending
+        print(f"after crash: backlog {wal.get_backlog()} (expected 3), {count_records()} records")
+        measure(5)
+
+        wal.REPLAY_INTERVAL_SECONDS = 0.2
+        stop = threading.Event()
+        replayer = threading.Thread(target=wal.run_replayer, args=(stop,))
+        replayer.start()
+        time.sleep(0.5)
+        flaky.fail = False
+        t0 = time.perf_counter()
+        while wal.get_backlog() and time.perf_counter() - t0 < 5:
+            time.sleep(0.05)
+        stop.set()
+        replayer.join()
+        data = db_model.load_data_for_date_range(BASE_TIME, BASE_TIME + datetime.timedelta(days=1))
+        print(f"database back: backlog {wal.get_backlog()}, {len(data)} records (expected 5), "
+              f"Temp1 {data.column('Temp1').tolist()}, Light {data.column('Light').tolist()}, "
+              f"log size {os.path.getsize(config.get_wal_file())}")
+        test_crash_while_truncating(flaky)
+    finally:
+        db_model.cleanup()
@@ -17,7 +17,7 @@ from django.shortcuts import render
 from django.utils.safestring import mark_safe
 
 from wetstat.model import util
-from wetstat.model.db import db_model
+from wetstat.model.db import range_buffer
 from wetstat.sensors import sensor_master
 from wetstat.sensors.abstract.base_sensor import CompressionFunction
 from wetstat.view import views
@@ -34,6 +34,7 @@ INTERVAL_LENTGHS = {
 }
 
 MAX_SUBPLOTS = 3
+BUFFER_MARGIN = datetime.timedelta(days=31)  # loaded records further away from the selected range are removed
 
 ALL_SHORT_NAMES = sensor_master.SensorMaster.get_used_sensor_short_names()
 
@@ -256,7 +257,8 @@ class WetstatBokehApp(object):
         self.now = datetime.datetime.now() - datetime.timedelta(days=365)
         self.end = self.now
         self.start = self.end - datetime.timedelta(days=1)
-        self.data = None
+        self.data = range_buffer.RangeBuffer(ALL_SHORT_NAMES)
+        self.visible = None  # records between start and end
         self.sources: Dict[str, ColumnDataSource] = {}  # short_name is key
         self.so_rows = []
         self.so_widgets = {}
@@ -284,22 +286,19 @@ class WetstatBokehApp(object):
             self.update_source(sn)
 
     def generate_cds_from_data(self, short_name: str) -> ColumnDataSource:
-        time_all = self.data.array[:, self.data.columns.index("Time")]
-        istart = np.searchsorted(time_all, self.start, "left")
-        iend = np.searchsorted(time_all, self.end, "right")
-
-        time_col = self.data.array[istart:iend, self.data.columns.index("Time")]
-        data_col = self.data.array[istart:iend, self.data.columns.index(short_name)]
+        time_col = self.visible.times
+        data_col = self.visible.column(short_name)
 
         iname = self.get_interval_of_sensor(short_name)
 
         sens = sensor_master.SensorMaster.get_sensor_for_info("short_name", short_name)
-        if iname == "none" or not any(data_col):
+        if iname == "none" or np.isnan(data_col).all():
             maxy = data_col
             avgy = data_col
             miny = data_col
             times = time_col
         else:
+            time_col = time_col.astype(object)  # relevant() needs datetime.datetime
             times = np.array([])
             miny = np.array([])
             maxy = np.array([])
@@ -439,14 +438,12 @@ class WetstatBokehApp(object):
             return
         self.start = util.date_to_datetime(new_start)
         self.end = util.date_to_datetime(new_end, True)
-        self.data = db_model.load_data_for_date_range(self.start, self.end, already_existing=self.data)
-        time_col = self.data.array[:, self.data.columns.index("Time")]
-        data_start = time_col[0]
-        data_end = time_col[-1]
-        if data_start > self.start:
-            self.start = data_start
-        if data_end < self.end:
-            self.end = data_end
+        self.data.ensure(self.start, self.end)
+        self.data.trim(self.start - BUFFER_MARGIN, self.end + BUFFER_MARGIN)
+        self.visible = self.data.between(self.start, self.end)
+        if len(self.visible):
+            self.start = self.visible.times[0].item()
+            self.end = self.visible.times[-1].item()
 
         self.update_all_existing_sources()
 
@@ -520,7 +517,8 @@ class WetstatBokehApp(object):
 
         self.msg_div = Div(text=".")
 
-        self.data = db_model.load_data_for_date_range(self.start, self.end)
+        self.data.ensure(self.start, self.end)
+        self.visible = self.data.between(self.start, self.end)
         # self.set_new_dbdata(self.data)
 
         self.callback_sensor_active("value", 0, 0)
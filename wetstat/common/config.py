@@ -3,6 +3,7 @@ import datetime
 import io
 import os.path
 import sys
+import tempfile
 
 
 def get_wetstat_dir() -> str:
@@ -13,6 +14,51 @@ def get_datafolder() -> str:
     return os.path.join(get_wetstat_dir(), "data")
 
 
+def get_archive_folder() -> str:
+    """
+    :return: folder for the csv files of dropped partitions, see wetstat.model.db.partition
+    """
+    return os.path.join(get_datafolder(), "archive")
+
+
+def get_coverage_file() -> str:
+    """
+    :return: json file of the coverage index, see wetstat.model.db.coverage
+    """
+    return os.path.join(get_datafolder(), "coverage.json")
+
+
+def get_raw_samples_folder() -> str:
+    """
+    :return: folder for the daily files of the raw sample store, see wetstat.model.db.raw_samples
+    """
+    return os.path.join(get_datafolder(), "raw_samples")
+
+
+def get_wal_file() -> str:
+    """
+    :return: write-ahead log of the measured records, see wetstat.model.db.wal
+    """
+    return os.path.join(get_datafolder(), "measurements.wal")
+
+
+def get_current_values_file() -> str:
+    """
+    :return: file which is mapped into memory for the current values, see wetstat.sensors.current_values
+    """
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()  # /dev/shm is never written to disk
+    return os.path.join(folder, "wetstat_current_values")
+
+
+def get_range_cache_invalidation_file() -> str:
+    """
+    :return: log of the days which were changed, shared by the range caches of all processes, see
+             wetstat.model.db.range_cache
+    """
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(folder, "wetstat_range_cache_invalidations")
+
+
 def get_staticfolder() -> str:
     return os.path.join(get_wetstat_dir(), "wetstat", "static")
 
@@ -32,6 +78,13 @@ def get_sqlite_database() -> str:
     return os.path.join(get_wetstat_dir(), "db.sqlite3")
 
 
+def get_db_backend() -> str:
+    """
+    :return: DB_BACKEND_MYSQL or DB_BACKEND_SQLITE, can be overridden with the environment variable WETSTAT_DB_BACKEND
+    """
+    return os.environ.get("WETSTAT_DB_BACKEND", DB_BACKEND)
+
+
 def on_pi() -> bool:
     cpus = ('BCM2708',
             'BCM2709',
@@ -51,5 +104,12 @@ def on_pi() -> bool:
 
 
 MEASURING_FREQ_SECONDS = 600  # 10 minutes
+SHARED_SAMPLE_MAX_AGE_SECONDS = 1.0  # sensors of the same device reuse a reading which is at most this old
+
+DB_BACKEND_MYSQL = "mysql"
+DB_BACKEND_SQLITE = "sqlite"
+DB_BACKEND = DB_BACKEND_MYSQL
+DATA_RETENTION_MONTHS = None  # older months are archived and removed from the data table, None keeps everything
+RAW_SAMPLE_RETENTION_DAYS = 30  # days the raw samples of the sensors are kept, None keeps everything, 0 disables them
 
 ENDL = "\n" if on_pi() else "\r\n"
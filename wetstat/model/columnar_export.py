@@ -0,0 +1,246 @@
+# coding=utf-8
+"""
+Export of records in binary columnar formats, the chunks of db_model.iter_range() are written one after another, so
+the memory usage doesn't depend on the size of the range. write() writes to a file, iter_bytes() yields the bytes for
+a streamed http response.
+
+- parquet: one row group per chunk, zstd compressed (needs pyarrow)
+- arrow: Arrow IPC file, one record batch per chunk, zstd compressed (needs pyarrow)
+- npz: numpy .npz archive (compressed), one array per column. Time is datetime64[s], the values are float64 with NaN
+  for missing values. The header of each array contains the number of records, so the columns are collected in
+  temporary files and copied into the archive at the end: iter_bytes() yields the first bytes after the last chunk
+  was read, but the archive is still streamed in blocks of COPY_BLOCK_BYTES.
+
+In parquet and arrow files Time is a timestamp (seconds, without time zone) and missing values are null.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import BinaryIO
+from typing import Collection
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from wetstat.common import logger
+from wetstat.model import util
+from wetstat.model.db import db_model
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+FORMAT_ARROW = "arrow"
+FORMAT_NPZ = "npz"
+
+# format: (file extension, mime type)
+FORMATS: Dict[str, tuple] = {
+    FORMAT_PARQUET: ("parquet", "application/vnd.apache.parquet"),
+    FORMAT_ARROW: ("arrow", "application/vnd.apache.arrow.file"),
+    FORMAT_NPZ: ("npz", "application/octet-stream"),
+}
+COMPRESSION = "zstd"
+EXPORT_CHUNK_ROWS = 65536
+COPY_BLOCK_BYTES = 1 << 20
+
+
+def is_available(fmt: str) -> bool:
+    """
+    :return: False if the format is unknown or needs pyarrow which isn't installed
+    """
+    if fmt not in FORMATS.keys():
+        return False
+    return fmt == FORMAT_NPZ or pyarrow is not None
+
+
+def check_format(fmt: str) -> None:
+    if fmt not in FORMATS.keys():
+        raise ValueError(f"Unknown export format: '{fmt}', possible are {list(FORMATS.keys())}")
+    if not is_available(fmt):
+        raise ValueError(f"The format {fmt} needs pyarrow, install it with 'pip install pyarrow'")
+
+
+def get_extension(fmt: str) -> str:
+    return FORMATS[fmt][0]
+
+
+def get_mime_type(fmt: str) -> str:
+    return FORMATS[fmt][1]
+
+
+def _to_record_batch(data: "db_model.DbData") -> "pyarrow.RecordBatch":
+    arrays = [pyarrow.array(data.times, type=pyarrow.timestamp("s"))]
+    for short_name in data.get_value_columns():
+        column = data.column(short_name)
+        arrays.append(pyarrow.array(column, mask=np.isnan(column)))
+    return pyarrow.RecordBatch.from_arrays(arrays, names=data.columns)
+
+
+class _StreamBuffer(object):
+    """
+    write-only file object which keeps the written bytes until they are taken with drain(). it can't seek, so
+    zipfile writes the sizes behind each entry
+    """
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _iter_write_arrow(chunks: Iterable["db_model.DbData"], out: BinaryIO, fmt: str) -> Iterator[int]:
+    """
+    yields the number of written records after each chunk and after the end of the file
+    """
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            batch = _to_record_batch(chunk)  # written before the next chunk overwrites the arrays
+            if writer is None:
+                if fmt == FORMAT_PARQUET:
+                    writer = pyarrow.parquet.ParquetWriter(out, batch.schema, compression=COMPRESSION)
+                else:
+                    options = pyarrow.ipc.IpcWriteOptions(compression=COMPRESSION)
+                    writer = pyarrow.ipc.new_file(out, batch.schema, options=options)
+            if len(chunk):
+                if fmt == FORMAT_PARQUET:
+                    writer.write_table(pyarrow.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+            rows += len(chunk)
+            yield rows
+    finally:
+        if writer is not None:
+            writer.close()
+    yield rows
+
+
+def _iter_write_npz(chunks: Iterable["db_model.DbData"], out: BinaryIO) -> Iterator[int]:
+    """
+    yields the number of read records after each chunk and after each block which is copied into the archive
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="wetstat_npz_")
+    try:
+        files: Dict[str, BinaryIO] = {}
+        dtypes: Dict[str, np.dtype] = {}
+        rows = 0
+        try:
+            for chunk in chunks:
+                for name in chunk.columns:
+                    if name not in files:
+                        files[name] = open(os.path.join(tmp_dir, f"{len(files)}.bin"), "wb")
+                    column = chunk.column(name)
+                    dtypes[name] = column.dtype
+                    files[name].write(np.ascontiguousarray(column).tobytes())
+                rows += len(chunk)
+                yield rows
+        finally:
+            for f in files.values():
+                f.close()
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for name, f in files.items():
+                with zf.open(name + ".npy", "w", force_zip64=True) as entry, open(f.name, "rb") as raw:
+                    header = {"descr": np.lib.format.dtype_to_descr(dtypes[name]), "fortran_order": False,
+                              "shape": (rows,)}
+                    np.lib.format.write_array_header_2_0(entry, header)
+                    while True:
+                        block = raw.read(COPY_BLOCK_BYTES)
+                        if not block:
+                            break
+                        entry.write(block)
+                        yield rows
+        yield rows
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _iter_write(chunks: Iterable["db_model.DbData"], out: BinaryIO, fmt: str) -> Iterator[int]:
+    check_format(fmt)
+    if fmt == FORMAT_NPZ:
+        return _iter_write_npz(chunks, out)
+    return _iter_write_arrow(chunks, out, fmt)
+
+
+def write(chunks: Iterable["db_model.DbData"], out: BinaryIO, fmt: str) -> int:
+    """
+    writes the chunks (all with the same columns) to a binary file object
+    :return: number of written records
+    """
+    rows = 0
+    for rows in _iter_write(chunks, out, fmt):
+        pass
+    return rows
+
+
+def iter_bytes(chunks: Iterable["db_model.DbData"], fmt: str) -> Iterator[bytes]:
+    """
+    like write(), but yields the written bytes after each chunk, so only one chunk is in memory
+    """
+    buffer = _StreamBuffer()
+    steps = _iter_write(chunks, buffer, fmt)
+    try:
+        for _ in steps:
+            data = buffer.drain()
+            if data:
+                yield data
+    finally:
+        steps.close()
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()  # if the client is gone, the query is aborted
+
+
+def export_to_columnar(start: datetime.datetime,
+                       end: datetime.datetime,
+                       path: str,
+                       columns: Optional[Collection[str]] = None,
+                       fmt: str = FORMAT_PARQUET) -> None:
+    """
+    like db_model.export_to_csv()
+    :param columns: short names, None for all. Time is always exported
+    """
+    check_format(fmt)
+    start_ts = time.perf_counter()
+    with open(path, "wb") as out:
+        rows = write(db_model.iter_range(start, end, columns, EXPORT_CHUNK_ROWS), out, fmt)
+    secs = time.perf_counter() - start_ts
+    size = os.path.getsize(path)
+    logger.log.info(f"Exported {rows} records as {fmt} ({util.human_readable_size(size)}) in {round(secs, 5)} "
+                    f"seconds to '{path}' ({util.human_readable_size(size / secs)}/s)")
+
@@ -2,7 +2,7 @@
 import datetime
 import os
 from dataclasses import dataclass
-from typing import Optional, Set, Dict
+from typing import Optional, Set, Dict, Iterator
 
 import numpy as np
 
@@ -43,6 +43,19 @@ def load_csv_for_range(folder: str, start: datetime.date, end: datetime.date, ig
     return container
 
 
+def iter_csv_for_range(folder: str, start: datetime.date, end: datetime.date) -> Iterator[DayData]:
+    """
+    like load_csv_for_range(), but loads one file after another and skips missing files
+    """
+    if start > end:
+        raise ValueError("end must be after start!!!")
+    while start <= end:
+        filename = os.path.join(folder, get_filename_for_date(start))
+        start = start + datetime.timedelta(days=1)
+        if os.path.isfile(filename):
+            yield load_csv_to_daydata(filename)
+
+
 def save_range_to_csv(folder: str, container: DataContainer):
     for daydata in container.data:
         save_daydata_to_csv(daydata, folder)
@@ -12,7 +12,7 @@ from numpy.core.multiarray import ndarray
 
 from wetstat.common import logger
 from wetstat.model.custom_plot.sensor_options import CustomPlotSensorOptions
-from wetstat.model.db import db_model, db_const
+from wetstat.model.db import db_model
 from wetstat.model.db.db_model import DbData
 from wetstat.view.message_container import MessageContainer
 
@@ -113,7 +113,8 @@ class CustomPlot(object):
         if self.data is not None:
             # data already here
             return
-        self.data = db_model.load_data_for_date_range(self.start, self.end)
+        columns = [op.get_sensor().get_short_name() for op in self.sensoroptions.values()]
+        self.data = db_model.load_data_for_date_range(self.start, self.end, columns=columns)
 
     def add_message(self, message: str, percent=None):
         timestamp = (perf_counter_ns() - self.start_ts) / 10 ** 9
@@ -151,12 +152,10 @@ class CustomPlot(object):
             return  # Already splitted
         else:
             self.datalines = {}
+        x = self.data.timestamps()
         for hr_hash in self.sensoroptions:
             short_name = self.sensoroptions[hr_hash].get_sensor().get_short_name()
-            x = self.data.array[:, 0]
-            y = self.data.array[:, self.data.columns.index(short_name)]
-            x = [d.timestamp() for d in x]
-            self.datalines[hr_hash] = (x, y)
+            self.datalines[hr_hash] = (x, self.data.column(short_name))
 
     def make_all_lines_minmaxavg(self) -> None:
         for hr_hash in self.sensoroptions:
@@ -285,9 +284,9 @@ class CustomPlot(object):
             raise ValueError("Load data first!!")
         self.xtick_pos = []
         self.xtick_str = []
-        time_col_index = self.data.columns.index(db_const.COL_NAME_TIME)
-        start = self.data.array[0, time_col_index].timestamp()
-        end = self.data.array[-1, time_col_index].timestamp()
+        timestamps = self.data.timestamps()
+        start = timestamps[0]
+        end = timestamps[-1]
 
         self.xtick_pos = np.linspace(start, end, self.max_xticks)
         self.xtick_pos = self.vectorized_from_ts(self.xtick_pos)
@@ -6,6 +6,7 @@ from datetime import datetime
 from typing import Optional
 
 from wetstat.common import config
+from wetstat.model import columnar_export
 from wetstat.model.db import db_model
 
 
@@ -13,7 +14,8 @@ class DataDownload(object):
     col_selection: Optional[set]
     start: Optional[datetime]
     end: Optional[datetime]
-    make_zip: bool = True
+    make_zip: bool = True  # only for csv, the other formats are compressed already
+    file_format: str = columnar_export.FORMAT_CSV
     file_id: str
 
     def __init__(self) -> None:
@@ -43,6 +45,10 @@ class DataDownload(object):
         """
         :return: the file path ready for download
         """
+        if self.file_format != columnar_export.FORMAT_CSV:
+            path = self.get_filepath() + "." + columnar_export.get_extension(self.file_format)
+            columnar_export.export_to_columnar(self.start, self.end, path, self.col_selection, self.file_format)
+            return path
         csv_path = self.get_filepath() + ".csv"
         db_model.export_to_csv(self.start, self.end, csv_path, columns=self.col_selection)
         if self.make_zip:
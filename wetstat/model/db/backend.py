@@ -0,0 +1,154 @@
+# coding=utf-8
+"""
+Interface of the storage backends (MySQL or SQLite), selected with config.get_db_backend().
+
+The backends only contain the database specific statements, everything else (projection, extending loaded ranges,
+picking the nearest record, export) is done in db_model for all backends.
+"""
+import datetime
+import threading
+from abc import ABC
+from abc import abstractmethod
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model.db import db_model
+
+Window = Tuple[datetime.datetime, datetime.datetime]
+
+
+class StorageBackend(ABC):
+    name: str
+
+    @abstractmethod
+    def get_columns(self) -> List[str]:
+        """
+        :return: all columns of the data table, including Time
+        """
+        pass
+
+    @abstractmethod
+    def add_columns(self, names: Iterable[str]) -> None:
+        """
+        adds the columns which don't exist yet
+        """
+        pass
+
+    @abstractmethod
+    def load_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]]) -> "db_model.DbData":
+        """
+        :param columns: existing columns starting with Time (see db_model.select_columns()), None for all
+        """
+        pass
+
+    @abstractmethod
+    def iter_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]],
+                   chunk_rows: int) -> Iterator["db_model.DbData"]:
+        """
+        like load_range() in chunks of at most chunk_rows records, see db_model.iter_range()
+        """
+        pass
+
+    @abstractmethod
+    def load_aggregated(self,
+                        interval: datetime.timedelta,
+                        start: datetime.datetime,
+                        end: datetime.datetime,
+                        short_names: Optional[Sequence[str]]) -> Optional["db_model.DbData"]:
+        """
+        :return: the same columns as db_model.load_data_with_interval(),
+                 None if the backend can't aggregate this interval in the database
+        """
+        pass
+
+    @abstractmethod
+    def select_nearest(self, timestamps: Sequence[datetime.datetime]) -> Tuple[List[tuple], List[str]]:
+        """
+        :return: (rows, column names), the next and the previous record of each timestamp (if there is one).
+                 the first column is the index of the timestamp, Time is a datetime.datetime
+        """
+        pass
+
+    @abstractmethod
+    def select_sums(self, columns: Sequence[str], windows: Sequence[Window]) -> Tuple[List[tuple], List[str]]:
+        """
+        :param columns: valid column names
+        :return: (rows, column names), one row for each window, the first column is the index of the window
+        """
+        pass
+
+    @abstractmethod
+    def upsert(self, column_names: Sequence[str], rows: Sequence[Sequence[object]], update_if_exists=False) -> None:
+        """
+        inserts the rows in one transaction
+        :param update_if_exists: update existing records with the same time instead of failing
+        """
+        pass
+
+    def insert_daydatas(self, daydatas: Iterable, add_missing_columns=False, update_if_exists=False) -> int:
+        """
+        :return: number of inserted rows
+        """
+        count = 0
+        for daydata in daydatas:
+            missing = set(daydata.fields) - set(self.get_columns())
+            if missing:
+                if not add_missing_columns:
+                    raise ValueError(f"The following columns are missing in the table: {missing}")
+                self.add_columns(missing)
+            self.upsert(daydata.fields, daydata.array, update_if_exists)
+            count += len(daydata.array)
+        return count
+
+    def get_stats(self) -> dict:
+        return {}
+
+    @abstractmethod
+    def cleanup(self) -> None:
+        pass
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(config.get_db_backend())
+    return _backend
+
+
+def _create_backend(name: str) -> StorageBackend:
+    if name == config.DB_BACKEND_MYSQL:
+        from wetstat.model.db import mysql_backend
+        backend = mysql_backend.MySqlBackend()
+    elif name == config.DB_BACKEND_SQLITE:
+        from wetstat.model.db import sqlite_backend
+        backend = sqlite_backend.SqliteBackend(config.get_sqlite_database())
+    else:
+        raise ValueError(f"Unknown database backend: '{name}'")
+    logger.log.info(f"Using {name} database backend")
+    return backend
+
+
+def cleanup() -> None:
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.cleanup()
+            _backend = None
@@ -0,0 +1,196 @@
+# coding=utf-8
+"""
+Fast import of many records, for example the csv archive in the data folder.
+
+Records are collected into batches and written by a small number of worker threads which share the connection pool.
+Existing records are updated in the same statement (INSERT ... ON DUPLICATE KEY UPDATE). After each batch the days of
+the batch are removed from range_cache and the batch is added to the coverage index. The first failed batch stops the
+import, the batches which are still waiting are cancelled.
+"""
+import datetime
+import os
+import tempfile
+import threading
+import time
+from concurrent import futures
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model import csvtools
+from wetstat.model import util
+from wetstat.model.db import connection_pool
+from wetstat.model.db import coverage
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import range_cache
+from wetstat.model.db import rollup
+from wetstat.model.db import schema
+
+BATCH_ROWS = 5000
+MAX_WORKERS = 4
+PROGRESS_INTERVAL_SECONDS = 5.0
+STAGING_TABLE_NAME = "data_staging"
+
+
+class _Progress(object):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.first: Optional[datetime.datetime] = None
+        self.last: Optional[datetime.datetime] = None
+        self.start = time.perf_counter()
+        self.last_log = self.start
+
+    def add(self, rows: Sequence[Sequence[object]], time_index: int) -> None:
+        with self.lock:
+            self.rows += len(rows)
+            first, last = rows[0][time_index], rows[-1][time_index]
+            self.first = first if self.first is None else min(self.first, first)
+            self.last = last if self.last is None else max(self.last, last)
+            now = time.perf_counter()
+            if now - self.last_log > PROGRESS_INTERVAL_SECONDS:
+                self.last_log = now
+                logger.log.info(f"bulk load: {self.rows} rows ({round(self.get_rows_per_second())} rows/s), "
+                                f"last batch ended at {last}")
+
+    def get_rows_per_second(self) -> float:
+        return self.rows / max(time.perf_counter() - self.start, 1e-9)
+
+
+def insert_daydatas(daydatas: Iterable[csvtools.DayData],
+                    workers: int = MAX_WORKERS,
+                    use_load_data=False,
+                    add_missing_columns=True,
+                    refresh_rollups=True) -> int:
+    """
+    :param daydatas: can be a generator, only a few batches are kept in memory
+    :param workers: number of threads, each thread uses one connection of the pool
+    :param use_load_data: True to use LOAD DATA LOCAL INFILE instead of executemany
+    :param add_missing_columns: adds the columns which are in the daydatas but not in the database
+    :param refresh_rollups: recalculates the rollup tables for the imported range at the end
+    :return: number of imported rows
+    """
+    workers = max(1, min(workers, connection_pool.MAX_CONNECTIONS - 1))  # leave one for the measurement
+    progress = _Progress()
+    slots = threading.BoundedSemaphore(workers * 2)  # limits the number of batches waiting in memory
+    pending: Set[futures.Future] = set()
+
+    def submit(fields: Tuple[str, ...], rows: List[Sequence[object]]) -> None:
+        slots.acquire()
+        _check_done(pending)  # a failed batch has released its slot, so it is found here at the latest
+        future = executor.submit(_insert_batch, fields, rows, use_load_data, progress)
+        future.add_done_callback(lambda f: slots.release())
+        pending.add(future)
+
+    executor = futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk_load")
+    try:
+        batch_fields: Optional[Tuple[str, ...]] = None
+        batch_rows: List[Sequence[object]] = []
+        for daydata in daydatas:
+            fields = tuple(daydata.fields)
+            missing = set(fields) - set(schema.get_columns())
+            if missing:
+                if not add_missing_columns:
+                    raise ValueError(f"The following columns are missing in the table: {missing}")
+                schema.add_columns(missing)
+            if fields != batch_fields or len(batch_rows) >= BATCH_ROWS:
+                if batch_rows:
+                    submit(batch_fields, batch_rows)
+                batch_fields, batch_rows = fields, []
+            batch_rows.extend(daydata.array)
+        if batch_rows:
+            submit(batch_fields, batch_rows)
+        for future in futures.as_completed(pending):
+            future.result()  # raises the exception of the first failed worker
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        logger.log.error(f"bulk load aborted after {progress.rows} rows")
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    logger.log.info(f"bulk load finished: {progress.rows} rows in {round(time.perf_counter() - progress.start, 3)} "
+                    f"seconds ({round(progress.get_rows_per_second())} rows/s)")
+    if refresh_rollups and progress.rows:
+        with connection_pool.cursor() as cur:
+            rollup.refresh_in_chunks(progress.first, progress.last, cur)
+    return progress.rows
+
+
+def load_csv_archive(start: datetime.date, end: datetime.date, folder: Optional[str] = None, **kwargs) -> int:
+    """
+    imports the dayNNNinYY.csv files between start and end (both inclusive), see insert_daydatas() for kwargs
+    """
+    if folder is None:
+        folder = config.get_datafolder()
+    return insert_daydatas(csvtools.iter_csv_for_range(folder, start, end), **kwargs)
+
+
+def _check_done(pending: Set[futures.Future]) -> None:
+    """
+    removes the finished futures, raises the exception of a failed one
+    """
+    for future in [f for f in pending if f.done()]:
+        pending.discard(future)
+        future.result()
+
+
+def _insert_batch(fields: Tuple[str, ...],
+                  rows: List[Sequence[object]],
+                  use_load_data: bool,
+                  progress: _Progress) -> None:
+    with connection_pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            if use_load_data:
+                _load_data_infile(cur, fields, rows)
+            else:
+                cur.executemany(db_model.build_insert_statement(fields, update_if_exists=True),
+                                [tuple(row) for row in rows])
+            conn.commit()
+        finally:
+            cur.close()
+    time_index = fields.index(db_const.COL_NAME_TIME)
+    times = [row[time_index] for row in rows]
+    range_cache.invalidate(min(times), max(times))
+    coverage.add_rows(fields, rows)
+    progress.add(rows, time_index)
+
+
+def _load_data_infile(cursor, fields: Tuple[str, ...], rows: List[Sequence[object]]) -> None:
+    """
+    loads the rows into a temporary staging table and copies them from there, because LOAD DATA itself
+    can only ignore or replace whole rows on duplicate keys
+    """
+    if not all(map(util.is_valid_sql_name, fields)):
+        raise ValueError("Invalid column name!!!")
+    columns = ", ".join(fields)
+    fd, path = tempfile.mkstemp(suffix=".tsv")
+    try:
+        with os.fdopen(fd, "w") as file:
+            for row in rows:
+                file.write("\t".join(_to_infile_str(value) for value in row))
+                file.write("\n")
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {STAGING_TABLE_NAME};")
+        cursor.execute(f"CREATE TEMPORARY TABLE {STAGING_TABLE_NAME} LIKE {db_const.DATA_DB_NAME};")
+        cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE {STAGING_TABLE_NAME} ({columns});", (path,))
+        updates = ", ".join(f"{col}=VALUES({col})" for col in fields if col != db_const.COL_NAME_TIME)
+        cursor.execute(f"INSERT INTO {db_const.DATA_DB_NAME} ({columns}) SELECT {columns} FROM {STAGING_TABLE_NAME} "
+                       f"ON DUPLICATE KEY UPDATE {updates};")
+    finally:
+        os.remove(path)
+
+
+def _to_infile_str(value: object) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        return value.strftime(db_const.DATETIME_FORMAT)
+    return str(value)
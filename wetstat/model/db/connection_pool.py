@@ -1,67 +1,252 @@
 # coding=utf-8
+import bisect
+import contextlib
+import tempfile
 import threading
 import time
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
 
 from mysql import connector
 from mysql.connector import MySQLConnection
+from mysql.connector.cursor import MySQLCursor
 
 from wetstat.model.db import db_const
+from wetstat.model.db import query
 
 MAX_CONNECTIONS = 16
-_connections: List[MySQLConnection] = []
-_used: List[bool] = []
-_meta_lock = threading.Lock()
-
-
-def find_conn() -> MySQLConnection:
-    with _meta_lock:
-        if all(_used) and len(_connections) < MAX_CONNECTIONS:
-            conn = _new_connection()
-            _connections.append(conn)
-            _used.append(True)
-            conn.commit()
-            return conn
-    while True:
-        with _meta_lock:
-            for i, lo in enumerate(_used):
-                if not lo:
-                    _used[i] = True
-                    conn = _connections[i]
-                    conn.ping(reconnect=True, attempts=10, delay=1)
-                    conn.commit()
-                    return conn
-        time.sleep(0.1)
-
-
-def release_conn(conn: MySQLConnection) -> None:
-    for i, co in enumerate(_connections):
-        if co == conn:
-            with _meta_lock:
-                _used[i] = False
+RESERVED_FOR_WRITERS = 1  # readers can only use MAX_CONNECTIONS - RESERVED_FOR_WRITERS, so inserts never starve
+CHECKOUT_TIMEOUT_SECONDS = 30.0
+PING_IF_IDLE_SECONDS = 60.0  # connections which were used recently are handed out without a round trip
+
+_connections: Dict[int, MySQLConnection] = {}  # key is id(connection)
+_idle: List[MySQLConnection] = []  # used as stack, so the most recently used (warmest) connection is reused first
+_last_release: Dict[int, float] = {}
+_checkout_time: Dict[int, float] = {}
+_connecting = 0  # number of connections which are being created right now
+_condition = threading.Condition()
+_local = threading.local()  # wait_time: seconds the last find_conn() of the thread waited, see pop_wait_time()
+
+
+class Histogram(object):
+    """
+    counts durations in fixed buckets, thread safe
+    """
+    BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)  # last bucket is everything above the last bound
+        self.total = 0.0
+        self.maximum = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        ms = seconds * 1000
+        with self.lock:
+            self.counts[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+            self.total += ms
+            self.maximum = max(self.maximum, ms)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            count = sum(self.counts)
+            labels = [f"<={b}ms" for b in self.BOUNDS_MS] + [f">{self.BOUNDS_MS[-1]}ms"]
+            return {
+                "count": count,
+                "avg_ms": round(self.total / count, 3) if count else 0,
+                "max_ms": round(self.maximum, 3),
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+wait_histogram = Histogram()
+hold_histogram = Histogram()
+timeout_count = 0
+
+
+def find_conn(timeout: Optional[float] = None, writer: bool = False) -> MySQLConnection:
+    """
+    takes a connection out of the pool, waits if all MAX_CONNECTIONS are in use.
+    every connection must be given back with release_conn(), prefer the connection() context manager.
+    :param timeout: maximum seconds to wait, default is CHECKOUT_TIMEOUT_SECONDS
+    :param writer: True for inserts, they can also use the RESERVED_FOR_WRITERS connections
+    :raise TimeoutError: if no connection was free after timeout seconds
+    """
+    global timeout_count, _connecting
+    if timeout is None:
+        timeout = CHECKOUT_TIMEOUT_SECONDS
+    start = time.perf_counter()
+    create_new = False
+    with _condition:
+        if not _is_free(writer):
+            if not _condition.wait_for(lambda: _is_free(writer), timeout):
+                timeout_count += 1
+                raise TimeoutError(f"No free database connection after {timeout} seconds "
+                                   f"({len(_connections)} open, {_get_used_count_locked()} in use)")
+        if _idle:
+            conn = _idle.pop()
+            idle_seconds = time.monotonic() - _last_release.get(id(conn), 0)
+        else:
+            create_new = True
+            conn = None
+            idle_seconds = 0
+            _connecting += 1
+    if create_new:
+        conn = _add_new_connection()
+    elif idle_seconds > PING_IF_IDLE_SECONDS:
+        try:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+        except Exception:
+            _discard(conn)
+            raise
+    now = time.perf_counter()
+    wait_histogram.add(now - start)
+    _local.wait_time = now - start
+    _checkout_time[id(conn)] = now
+    return conn
+
+
+def release_conn(conn: Optional[MySQLConnection]) -> None:
+    if conn is None:
+        return
+    checkout = _checkout_time.pop(id(conn), None)
+    if checkout is not None:
+        hold_histogram.add(time.perf_counter() - checkout)
+    with _condition:
+        if id(conn) not in _connections:
             return
+        _last_release[id(conn)] = time.monotonic()
+        _idle.append(conn)
+        _condition.notify_all()  # readers and writers wait for different conditions
+
+
+def discard(conn: MySQLConnection) -> None:
+    """
+    closes a connection which is checked out instead of giving it back, for example to abort a running query.
+    release_conn() can still be called afterwards.
+    """
+    _checkout_time.pop(id(conn), None)
+    try:
+        conn.shutdown()  # closes the socket without reading the rest of the result, the server aborts the query
+    except Exception:
+        pass
+    _discard(conn)
+
+
+@contextlib.contextmanager
+def connection(timeout: Optional[float] = None, writer: bool = False) -> Iterator[MySQLConnection]:
+    """
+    :param writer: see find_conn()
+    """
+    conn = find_conn(timeout, writer)
+    try:
+        yield conn
+    finally:
+        release_conn(conn)
+
+
+@contextlib.contextmanager
+def cursor(timeout: Optional[float] = None, **cursor_kwargs) -> Iterator[MySQLCursor]:
+    """
+    for read only usage, use connection() if you need to commit
+    """
+    with connection(timeout) as conn:
+        cur = conn.cursor(**cursor_kwargs)
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+
+def pop_wait_time() -> float:
+    """
+    :return: seconds the last find_conn() of this thread waited (including connecting), 0 if it was already returned
+    """
+    wait_time = getattr(_local, "wait_time", 0.0)
+    _local.wait_time = 0.0
+    return wait_time
 
 
 def get_used_count() -> int:
-    with _meta_lock:
-        return _used.count(True)
+    with _condition:
+        return _get_used_count_locked()
+
+
+def _get_used_count_locked() -> int:
+    return len(_connections) + _connecting - len(_idle)
 
 
 def get_open_count() -> int:
-    with _meta_lock:
-        return len(_used)
+    with _condition:
+        return len(_connections)
+
+
+def get_stats() -> dict:
+    return {
+        "max_connections": MAX_CONNECTIONS,
+        "reserved_for_writers": RESERVED_FOR_WRITERS,
+        "used_connections": get_used_count(),
+        "open_connections": get_open_count(),
+        "checkout_timeouts": timeout_count,
+        "wait_time": wait_histogram.to_dict(),
+        "hold_time": hold_histogram.to_dict(),
+    }
+
+
+def _is_free(writer: bool) -> bool:
+    # if fewer connections than the limit are used, there is an idle one or a new one can be created
+    limit = MAX_CONNECTIONS if writer else MAX_CONNECTIONS - RESERVED_FOR_WRITERS
+    return _get_used_count_locked() < limit
+
+
+def _add_new_connection() -> MySQLConnection:
+    global _connecting
+    try:
+        conn = _new_connection()
+    except Exception:
+        with _condition:
+            _connecting -= 1
+            _condition.notify_all()
+        raise
+    with _condition:
+        _connecting -= 1
+        _connections[id(conn)] = conn
+    return conn
+
+
+def _discard(conn: MySQLConnection) -> None:
+    with _condition:
+        _connections.pop(id(conn), None)
+        _last_release.pop(id(conn), None)
+        _condition.notify_all()
+    query.forget_connection(conn)
+    try:
+        conn.close()
+    except Exception:
+        pass
 
 
 def _new_connection() -> MySQLConnection:
+    # autocommit, so that a connection doesn't keep an old snapshot of the data between two checkouts.
+    # functions which need a transaction start one explicitly.
     return connector.connect(database=db_const.DATABASE_NAME,
                              user="wetstat_user",
                              password="wetstat",
                              host="localhost",
                              port=3306,
                              buffered=True,
+                             autocommit=True,
+                             allow_local_infile_in_path=tempfile.gettempdir(),  # for bulk_load
                              )
 
 
 def cleanup():
-    for co in _connections:
+    with _condition:
+        connections = list(_connections.values())
+        _connections.clear()
+        _idle.clear()
+    for co in connections:
+        query.forget_connection(co)
         co.close()
@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+Index of the time spans in which each column of the data table has values.
+
+A span is a run of records with a value in the column where two neighbouring records are at most MAX_GAP apart, so
+outages, sensors which were added later (the older records are NULL) and retired sensors leave gaps between the spans.
+The index is saved as json in config.get_coverage_file() and reloaded when the file changed, so the inserting process
+(SensorMaster), the importers (bulk_load) and the readers (wsgi_v2) share it. The inserting functions of db_model and
+bulk_load add the new records, records which are inserted another way are only found by rebuild(). The writers hold a
+file lock (the file next to the index with LOCK_SUFFIX) while they read, change and replace the index, so the processes
+don't lose each other's changes.
+
+The index doesn't exist until rebuild() was called once (run this file), until then narrow() changes nothing. Columns
+without an entry in the index are never dropped by narrow() and the range isn't narrowed for them.
+"""
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model import binning
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+
+MAX_GAP = datetime.timedelta(hours=1)
+_MAX_GAP_SECONDS = int(MAX_GAP.total_seconds())
+REBUILD_CHUNK_ROWS = 65536
+LOCK_SUFFIX = ".lock"
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ALL_TIME = (datetime.datetime(1970, 1, 1), datetime.datetime(9999, 12, 31, 23, 59, 59))
+
+Span = Tuple[int, int]  # first and last record with a value, naive seconds like DbData.seconds()
+
+# key: short name, value: sorted spans which don't overlap. None if the index doesn't exist
+_spans: Optional[Dict[str, List[Span]]] = None
+_version: Optional[Tuple[int, int]] = None  # inode and mtime of the loaded file, os.replace() changes the inode
+_lock = threading.Lock()
+
+
+def _to_datetime(seconds: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(seconds=int(seconds))
+
+
+def _to_seconds(dt: datetime.datetime) -> int:
+    return (dt - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+def find_spans(seconds: np.ndarray) -> List[Span]:
+    """
+    :param seconds: sorted int64 seconds of the records with a value
+    """
+    if not len(seconds):
+        return []
+    breaks = np.flatnonzero(np.diff(seconds) > _MAX_GAP_SECONDS)
+    starts = seconds[np.concatenate(([0], breaks + 1))]
+    ends = seconds[np.concatenate((breaks, [len(seconds) - 1]))]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def merge_spans(spans: Iterable[Span]) -> List[Span]:
+    """
+    :return: the spans sorted, spans which overlap or are at most MAX_GAP apart are joined
+    """
+    result: List[List[int]] = []
+    for start, end in sorted(spans):
+        if result and start - result[-1][1] <= _MAX_GAP_SECONDS:
+            result[-1][1] = max(result[-1][1], end)
+        else:
+            result.append([start, end])
+    return [(start, end) for start, end in result]
+
+
+def _get_version(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _load_locked() -> None:
+    global _spans, _version
+    path = config.get_coverage_file()
+    try:
+        with open(path) as f:
+            version = _get_version(path)
+            if version == _version:
+                return
+            content = json.load(f)
+    except FileNotFoundError:
+        _spans = _version = None
+        return
+    if content.get("max_gap") != _MAX_GAP_SECONDS:
+        logger.log.warning(f"{path} was built with another MAX_GAP, run wetstat/model/db/coverage.py to rebuild it")
+        _spans = _version = None
+        return
+    _spans = {short_name: [(start, end) for start, end in spans] for short_name, spans in content["columns"].items()}
+    _version = version
+
+
+@contextlib.contextmanager
+def _write_lock() -> Iterator[None]:
+    """
+    locks the index for this process and the other processes and loads the latest version of it
+    """
+    global _version
+    path = config.get_coverage_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock, open(path + LOCK_SUFFIX, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            _version = None  # another process could have replaced it within the resolution of mtime
+            _load_locked()
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _save_locked(spans: Dict[str, List[Span]]) -> None:
+    global _spans, _version
+    path = config.get_coverage_file()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"max_gap": _MAX_GAP_SECONDS, "columns": spans}, f)
+    os.replace(tmp_path, path)  # the readers never see a half written file
+    _spans = spans
+    _version = _get_version(path)
+
+
+def is_available() -> bool:
+    with _lock:
+        _load_locked()
+        return _spans is not None
+
+
+def add(times: np.ndarray, columns: Dict[str, np.ndarray]) -> None:
+    """
+    adds inserted records to the index, does nothing if the index doesn't exist
+    :param times: int64 seconds, sorted
+    :param columns: key: short name, value: float64 array with the same length as times, NaN means no value
+    """
+    if not os.path.exists(config.get_coverage_file()):
+        return  # no lock file next to an index which doesn't exist
+    with _write_lock():
+        if _spans is None:
+            return
+        spans = dict(_spans)
+        changed = False
+        for short_name, column in columns.items():
+            new = find_spans(times[~np.isnan(column)])
+            if not new:
+                continue
+            merged = merge_spans([*spans.get(short_name, []), *new])
+            if merged != spans.get(short_name):
+                spans[short_name] = merged
+                changed = True
+        if changed:
+            _save_locked(spans)
+
+
+def add_daydata(daydata) -> None:
+    add_rows(daydata.fields, daydata.array)
+
+
+def add_rows(fields: Sequence[str], rows: Sequence[Sequence[object]]) -> None:
+    """
+    :param fields: short names, one of them is Time
+    :param rows: values in the order of fields, None means no value
+    """
+    if not len(rows):
+        return
+    array = np.array(rows, dtype=object)
+    time_index = list(fields).index(db_const.COL_NAME_TIME)
+    times = binning.datetimes_to_seconds(array[:, time_index])
+    order = np.argsort(times, kind="stable")
+    add(times[order], {field: binning.objects_to_float(array[order, i])
+                       for i, field in enumerate(fields) if i != time_index})
+
+
+def add_record(timestamp: datetime.datetime, values: Dict[str, object]) -> None:
+    add(np.array([_to_seconds(timestamp)], dtype=np.int64),
+        {short_name: np.array([value if value is not None else np.nan], dtype=np.float64)
+         for short_name, value in values.items()})
+
+
+def remove(start: datetime.datetime, end: datetime.datetime) -> None:
+    """
+    cuts the range between start and end (both inclusive) out of the spans, call it after records were deleted
+    """
+    first, last = _to_seconds(start), _to_seconds(end)
+    if not os.path.exists(config.get_coverage_file()):
+        return
+    with _write_lock():
+        if _spans is None:
+            return
+        spans = {}
+        for short_name, column_spans in _spans.items():
+            kept = []
+            for span_start, span_end in column_spans:
+                if span_start < first:
+                    kept.append((span_start, min(span_end, first - 1)))
+                if span_end > last:
+                    kept.append((max(span_start, last + 1), span_end))
+            spans[short_name] = kept  # an empty list still means that the column is in the index
+        _save_locked(spans)
+
+
+def rebuild() -> None:
+    """
+    scans the whole data table and replaces the index
+    """
+    # the columns without any value get an empty list, so narrow() knows that they are empty
+    spans: Dict[str, List[Span]] = {short_name: [] for short_name in backend.get_backend().get_columns()
+                                    if short_name != db_const.COL_NAME_TIME}
+    for chunk in db_model.iter_range(*_ALL_TIME, chunk_rows=REBUILD_CHUNK_ROWS):
+        seconds = chunk.seconds()
+        for short_name in chunk.get_value_columns():
+            new = find_spans(seconds[~np.isnan(chunk.column(short_name))])
+            if new:
+                # the first span of a chunk can continue the last span of the previous chunk
+                spans[short_name] = merge_spans([*spans.get(short_name, []), *new])
+    with _write_lock():
+        _save_locked(spans)
+    logger.log.info(f"Rebuilt coverage index: {sum(map(len, spans.values()))} spans in {len(spans)} columns")
+
+
+def get_spans(short_name: str,
+              start: Optional[datetime.datetime] = None,
+              end: Optional[datetime.datetime] = None) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    :return: the spans of the column which overlap start to end, clipped to this range. empty if the index doesn't
+             exist or the column has no values
+    """
+    first = _to_seconds(start) if start is not None else None
+    last = _to_seconds(end) if end is not None else None
+    with _lock:
+        _load_locked()
+        column_spans = _spans.get(short_name, []) if _spans is not None else []
+    result = []
+    for span_start, span_end in column_spans:
+        if (last is not None and span_start > last) or (first is not None and span_end < first):
+            continue
+        result.append((_to_datetime(max(span_start, first) if first is not None else span_start),
+                       _to_datetime(min(span_end, last) if last is not None else span_end)))
+    return result
+
+
+def get_columns() -> List[str]:
+    """
+    :return: the columns which have values, empty if the index doesn't exist
+    """
+    with _lock:
+        _load_locked()
+        return [short_name for short_name, spans in _spans.items() if spans] if _spans is not None else []
+
+
+def narrow(columns: Optional[Iterable[str]],
+           start: datetime.datetime,
+           end: datetime.datetime) -> Optional[Tuple[Optional[List[str]], datetime.datetime, datetime.datetime]]:
+    """
+    removes the columns without values between start and end, and moves start and end to the first and the last
+    value of the remaining columns, so the loaders don't scan the empty parts. a column which isn't in the index (e.g.
+    added after the last rebuild()) is kept and start and end stay as they are.
+    :param columns: short names, None for all columns of the data table
+    :return: (columns, start, end) unchanged if the index doesn't exist, None if there are no values at all.
+             the columns keep the requested order (the order of the data table for None)
+    """
+    if not is_available():
+        return (list(columns) if columns is not None else None), start, end
+    if columns is None:
+        columns = backend.get_backend().get_columns()
+    with _lock:
+        indexed = set(_spans.keys()) if _spans is not None else set()
+    covered = []
+    first = last = None
+    for short_name in dict.fromkeys(columns):
+        if short_name == db_const.COL_NAME_TIME:
+            continue
+        if short_name not in indexed:
+            spans = [(start, end)]
+        else:
+            spans = get_spans(short_name, start, end)
+            if not spans:
+                continue
+        covered.append(short_name)
+        first = min(first, spans[0][0]) if first is not None else spans[0][0]
+        last = max(last, spans[-1][1]) if last is not None else spans[-1][1]
+    if not covered:
+        return None
+    return covered, first, last
+
+
+if __name__ == '__main__':
+    try:
+        rebuild()
+        for col in get_columns():
+            print(col, get_spans(col))
+    finally:
+        db_model.cleanup()
@@ -1,28 +1,42 @@
 # coding=utf-8
-import collections
+import collections.abc
+import contextlib
 import datetime
-import sys
 import time
-import json
-from concurrent import futures
+import math
 from dataclasses import dataclass
 from typing import Collection
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 import numpy as np
 from mysql import connector
-from mysql.connector import IntegrityError
+from mysql.connector import Error
 from mysql.connector import MySQLConnection
 from mysql.connector.cursor import MySQLCursor
 
+from wetstat.common import config
 from wetstat.common import logger
+from wetstat.model import binning
 from wetstat.model import util
+from wetstat.model.db import backend
+from wetstat.model.db import bulk_load
 from wetstat.model.db import connection_pool
+from wetstat.model.db import coverage
 from wetstat.model.db import db_const
+from wetstat.model.db import profiler
+from wetstat.model.db import query
+from wetstat.model.db import query_budget
+from wetstat.model.db import range_cache
+from wetstat.model.db import raw_samples
+from wetstat.model.db import rollup
+from wetstat.model.db import schema
 from wetstat.sensors import sensor_master
 from wetstat.sensors.abstract.base_sensor import CompressionFunction
 
@@ -36,11 +50,115 @@ SPECIAL_INTERVALS_GROUP_BY = {
     datetime.timedelta(days=366): "YEAR(Time)",
 }
 
+# seconds since 1970-01-01 without time zone conversion (unlike UNIX_TIMESTAMP()), like DbData.seconds()
+EPOCH_SQL = "TIMESTAMP '1970-01-01 00:00:00'"
+EPOCH_SECONDS_SQL = f"TIMESTAMPDIFF(SECOND, {EPOCH_SQL}, {db_const.COL_NAME_TIME})"
+
+STREAM_CHUNK_ROWS = 4096
+
+NEAREST_FUTURE_STATEMENT = f"SELECT * FROM {db_const.DATA_DB_NAME} WHERE {db_const.COL_NAME_TIME} >= %s " \
+                           f"ORDER BY {db_const.COL_NAME_TIME} ASC LIMIT 1"
+NEAREST_PAST_STATEMENT = f"SELECT * FROM {db_const.DATA_DB_NAME} WHERE {db_const.COL_NAME_TIME} <= %s " \
+                         f"ORDER BY {db_const.COL_NAME_TIME} DESC LIMIT 1"
+
 
-@dataclass
 class DbData(object):
-    array: np.ndarray
-    columns: List[str]
+    """
+    columnar result of a select: a datetime64[s] time vector and one float64 column per sensor, NaN means no value.
+    the loaders store values column major, so column() returns a contiguous view without copying.
+    """
+
+    def __init__(self, times: np.ndarray, values: np.ndarray, columns: Sequence[str]) -> None:
+        """
+        :param times: datetime64[s], sorted
+        :param values: float64, shape (len(times), len(columns) - 1)
+        :param columns: Time first, then the names of the value columns
+        """
+        self.times = times.astype("datetime64[s]", copy=False)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.columns = list(columns)
+        self._index = {name: i - 1 for i, name in enumerate(self.columns)}
+
+    @staticmethod
+    def from_rows(rows: Sequence[Sequence[object]], column_names: Sequence[str]) -> "DbData":
+        """
+        :param rows: like cursor.fetchall(), None is converted to NaN
+        """
+        column_names = list(column_names)
+        time_idx = column_names.index(db_const.COL_NAME_TIME)
+        value_idxs = [i for i in range(len(column_names)) if i != time_idx]
+        columns = [db_const.COL_NAME_TIME, *(column_names[i] for i in value_idxs)]
+        if not len(rows):
+            return DbData.empty(columns)
+        block = np.array(rows, dtype=object)
+        return DbData(binning.datetimes_to_seconds(block[:, time_idx]).view("datetime64[s]"),
+                      np.asfortranarray(block[:, value_idxs], dtype=np.float64),
+                      columns)
+
+    @staticmethod
+    def empty(columns: Sequence[str]) -> "DbData":
+        return DbData(np.empty(0, dtype="datetime64[s]"), np.empty((0, len(columns) - 1), order="F"), columns)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def get_value_columns(self) -> List[str]:
+        return self.columns[1:]
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        :return: view of the column (no copy), datetime64[s] for Time, otherwise float64
+        """
+        if name == db_const.COL_NAME_TIME:
+            return self.times
+        return self.values[:, self._index[name]]
+
+    def seconds(self) -> np.ndarray:
+        """
+        :return: view of the times as int64 seconds (naive, like binning.datetimes_to_seconds)
+        """
+        return self.times.view(np.int64)
+
+    def timestamps(self) -> np.ndarray:
+        """
+        :return: float64 unix timestamps, the times are interpreted as local time like datetime.timestamp() does
+        """
+        return binning.local_seconds_to_timestamps(self.seconds())
+
+    def slice(self, start: int, stop: int) -> "DbData":
+        return DbData(self.times[start:stop], self.values[start:stop], self.columns)
+
+    def between(self, start: datetime.datetime, end: datetime.datetime) -> "DbData":
+        """
+        :return: the records between start and end (both inclusive)
+        """
+        istart = np.searchsorted(self.times, np.datetime64(start, "s"), "left")
+        iend = np.searchsorted(self.times, np.datetime64(end, "s"), "right")
+        return self.slice(istart, iend)
+
+    def to_object_array(self) -> np.ndarray:
+        """
+        :return: 2D object array like np.array(cursor.fetchall()), datetime.datetime for Time and None for NaN
+        """
+        result = np.empty((len(self.times), len(self.columns)), dtype=object)
+        result[:, 0] = self.times.astype(object)
+        result[:, 1:] = np.where(np.isnan(self.values), None, self.values)
+        return result
+
+    def get_nbytes(self) -> int:
+        return self.times.nbytes + self.values.nbytes
+
+
+def concatenate(datas: Sequence[DbData]) -> DbData:
+    """
+    concatenates DbData objects with the same columns
+    """
+    for data in datas[1:]:
+        if data.columns != datas[0].columns:
+            raise ValueError(f"Columns don't match: {data.columns} != {datas[0].columns}")
+    return DbData(np.concatenate([data.times for data in datas]),
+                  np.asfortranarray(np.concatenate([data.values for data in datas])),
+                  datas[0].columns)
 
 
 def create_connection() -> MySQLConnection:
@@ -69,40 +187,20 @@ def create_connection() -> MySQLConnection:
 
 
 def get_all_columns(cursor: MySQLCursor = None) -> List[str]:
-    if not cursor:
-        conn = connection_pool.find_conn()
-        cursor = conn.cursor()
-        is_own_cursor = True
-    else:
-        conn = None
-        is_own_cursor = False
-    try:
-        cursor.execute("EXPLAIN " + db_const.DATA_DB_NAME)
-        exp = cursor.fetchall()
-    finally:
-        if is_own_cursor:
-            cursor.close()
-            connection_pool.release_conn(conn)
-    return [col[0] for col in exp]
+    """
+    cached, see schema.invalidate()
+    :param cursor: MySQL only
+    """
+    if cursor is not None:
+        return schema.get_columns(cursor)
+    return backend.get_backend().get_columns()
 
 
 def add_column(col_name: str, cursor: MySQLCursor = None):
-    if not cursor:
-        conn = connection_pool.find_conn()
-        cursor = conn.cursor()
-        is_own_cursor = True
+    if cursor is not None:
+        schema.add_columns([col_name], cursor)
     else:
-        conn = None
-        is_own_cursor = False
-    try:
-        if not util.is_valid_sql_name(col_name):
-            raise ValueError(f"Invalid column name: '{col_name}'!!!!")
-        cursor.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} ADD {col_name} FLOAT;")
-        logger.log.info(f"Added column '{col_name}' in {db_const.DATABASE_NAME}.{db_const.DATA_DB_NAME}")
-    finally:
-        if is_own_cursor:
-            cursor.close()
-            connection_pool.release_conn(conn)
+        backend.get_backend().add_columns([col_name])
 
 
 def to_sql_str(value: object) -> str:
@@ -113,142 +211,178 @@ def to_sql_str(value: object) -> str:
 
 
 def insert_daydata(daydata, add_missing_columns=False, create_own_connection=False) -> None:
-    if create_own_connection:
-        connection = create_connection()
-    else:
-        connection = connection_pool.find_conn()
-    cur = None
+    """
+    :param create_own_connection: MySQL only, uses a new connection instead of one of the pool
+    """
     try:
-        cur = connection.cursor()
-        db_heads = get_all_columns(cur)
+        if create_own_connection:
+            with contextlib.closing(create_connection()) as connection:
+                _insert_daydata(connection, daydata, add_missing_columns)
+        else:
+            backend.get_backend().insert_daydatas([daydata], add_missing_columns)
+        coverage.add_daydata(daydata)
+    finally:
+        invalidate_cache(daydata)
+
+
+def _insert_daydata(connection, daydata, add_missing_columns: bool, update_if_exists=False) -> None:
+    cur = connection.cursor()
+    try:
+        db_heads = schema.get_columns(cur)
         dd_heads = daydata.fields
         missing = set(dd_heads) - set(db_heads)  # fields which are in dd_heads but not in db_heads
         if len(missing):
             if add_missing_columns:
-                for m in missing:
-                    add_column(m)
+                schema.add_columns(missing, cur)
             else:
                 raise ValueError(f"The following columns are missing in the table: {missing}")
         if not all(map(util.is_valid_sql_name, dd_heads)):
             raise ValueError("Invalid column name in DayData!!!")
-        do_insert(connection, cur, dd_heads, daydata.array)
+        do_insert(connection, cur, dd_heads, daydata.array, update_if_exists)
+        time_col = daydata.array[:, dd_heads.index(db_const.COL_NAME_TIME)]
+        refresh_rollups(time_col[0], time_col[-1], connection, cur)
     except Exception as e:
         connection.rollback()
         raise e
-
     finally:
-        if cur:
-            cur.close()
-        if create_own_connection:
-            connection.close()
-        else:
-            connection_pool.release_conn(connection)
+        cur.close()
+
+
+def build_insert_statement(column_names: Sequence[str], update_if_exists=False) -> str:
+    """
+    :return: INSERT statement with one %s placeholder per column
+    """
+    if not all(map(util.is_valid_sql_name, column_names)):
+        raise ValueError("Invalid column name!!!")
+    statement = f"INSERT INTO {db_const.DATA_DB_NAME} ({', '.join(column_names)}) " \
+                f"VALUES ({', '.join(['%s'] * len(column_names))})"
+    if update_if_exists:
+        statement += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{col}=VALUES({col})" for col in column_names
+                                                             if col != db_const.COL_NAME_TIME)
+    return statement
 
 
 def do_insert(connection, cursor, column_names, values: Union[Iterable[object], Iterable[Iterable[object]]],
               update_if_exists=False):
-    columns = ", ".join(column_names)
-    statement = f"INSERT INTO data ({columns}) VALUES "
-    records = []
-    is_multi_insert = True
-    if not isinstance(values[0], collections.Iterable):
-        is_multi_insert = False
-        values = (values,)
-    for record in values:
-        records.append("(" + ", ".join(map(to_sql_str, record)) + ")")
-    final_command = statement + ", ".join(records) + ";"
-    try:
-        cursor.execute(final_command)
-        connection.commit()
-    except IntegrityError as e:
-        if "Duplicate entry" in e.msg and update_if_exists:
-            if is_multi_insert:
-                # single insert because not all records have errors, so some require insert and some require update
-                for record in values:
-                    do_insert(connection, cursor, column_names, record)
-            else:
-                # only one record, we know that this record causes the problem
-                values = values[0]
-                timestamp = values[column_names.index(db_const.COL_NAME_TIME)]
-                do_update(connection, cursor, timestamp, column_names, values)
-        else:
-            raise e
+    """
+    inserts one record (values is a list of values) or many records (values is a list of records).
+    if update_if_exists is True, existing records with the same timestamp are updated in the same statement.
+    """
+    statement = build_insert_statement(column_names, update_if_exists)
+    if isinstance(values[0], collections.abc.Iterable) and not isinstance(values[0], str):
+        cursor.executemany(statement, [tuple(record) for record in values])
+    else:
+        query.execute(connection, statement, values)
+    connection.commit()
 
 
 def do_update(connection, cursor, timestamp, column_names, values: Iterable[object]) -> None:
-    sets = [f"{col}={val}" for col, val in zip(column_names, values)]
-    final_command = f"UPDATE {db_const.DATA_DB_NAME} SET {', '.join(sets)} " \
-                    f"WHERE {db_const.COL_NAME_TIME}={to_sql_str(timestamp)};"
-    cursor.execute(final_command)
+    if not all(map(util.is_valid_sql_name, column_names)):
+        raise ValueError("Invalid column name!!!")
+    sets = [f"{col}=%s" for col in column_names]
+    statement = f"UPDATE {db_const.DATA_DB_NAME} SET {', '.join(sets)} WHERE {db_const.COL_NAME_TIME}=%s"
+    query.execute(connection, statement, [*values, timestamp])
     connection.commit()
 
 
-def insert_datacontainer(container, use_threads=False, add_missing_columns=True) -> None:
-    if use_threads:
-        ex = futures.ThreadPoolExecutor()
-        for dd in container.data:
-            ex.submit(insert_daydata, dd, add_missing_columns=add_missing_columns, create_own_connection=True)
-        ex.shutdown()
-    else:
-        for dd in container.data:
-            insert_daydata(dd, add_missing_columns=add_missing_columns)
+def refresh_rollups(start: datetime.datetime, end: datetime.datetime, connection, cursor) -> None:
+    """
+    updates the rollup tables after records between start and end were inserted or changed.
+    a failure is only logged because the raw data is already saved and rollup.backfill() can repair it later.
+    """
+    try:
+        if not connection.in_transaction:
+            connection.start_transaction()
+        rollup.refresh(start, end, cursor)
+        connection.commit()
+    except Error:
+        connection.rollback()
+        logger.log.exception(f"Could not refresh rollup tables for {start} to {end}")
 
 
-def load_data_for_date_range(start: datetime.datetime, end: datetime.datetime,
-                             already_existing: Optional[DbData] = None, delete_too_much_existing=False) -> DbData:
-    cur = None
-    conn = None
+def insert_datacontainer(container, use_threads=False, add_missing_columns=True) -> None:
+    """
+    :param use_threads: MySQL only, see bulk_load.insert_daydatas()
+    """
     try:
-        conn = connection_pool.find_conn()
-        cur = conn.cursor()
-        if already_existing is None:
-            execute_select_range(start, end, cur)
-            db_data = fetch_to_db_data(cur)
-            return db_data
+        if use_threads and config.get_db_backend() == config.DB_BACKEND_MYSQL:
+            bulk_load.insert_daydatas(container.data, add_missing_columns=add_missing_columns)  # updates coverage
         else:
-            result_arr = already_existing.array
-            ex_time_data = already_existing.array[:, already_existing.columns.index("Time")]
-            ex_start = ex_time_data[0]
-            ex_end = ex_time_data[-1]
-            print(f"extend existing {ex_start} to {ex_end}")
-            if start < ex_start:
-                before_data = load_data_for_date_range(start, ex_start)
-                result_arr = np.concatenate((before_data.array, result_arr))
-                print(f"loaded before data {start} to {ex_start}")
-            elif ex_start < start and delete_too_much_existing:
-                i = 0
-                while ex_time_data[i] < start:
-                    i += 1
-                result_arr = result_arr[i:]
-            if end > ex_end:
-                after_data = load_data_for_date_range(ex_end, end)
-                result_arr = np.concatenate((result_arr, after_data.array))
-                print(f"loaded after data {ex_end} to {end}")
-            elif ex_end > end and delete_too_much_existing:
-                i = 1
-                while ex_time_data[-i] > end:
-                    i += 1
-                result_arr = result_arr[:-i]
-            already_existing.array = result_arr
-            return already_existing
+            backend.get_backend().insert_daydatas(container.data, add_missing_columns)
+            for daydata in container.data:
+                coverage.add_daydata(daydata)
     finally:
-        if cur:
-            cur.close()
-        connection_pool.release_conn(conn)
+        for daydata in container.data:
+            invalidate_cache(daydata)
 
 
-def load_data_with_group_by(group_by: str,
-                            start: Optional[datetime.datetime] = None,
-                            end: Optional[datetime.datetime] = None,
-                            duration: Optional[datetime.timedelta] = None) -> DbData:
-    start, end, duration = util.calculate_missing_start_end_duration(start, end, duration)
-    columns = [f"FROM_UNIXTIME(AVG(UNIX_TIMESTAMP({db_const.COL_NAME_TIME})))"]
+def invalidate_cache(daydata) -> None:
+    """
+    removes the days of the daydata from range_cache
+    """
+    if len(daydata.array):
+        time_col = daydata.array[:, daydata.fields.index(db_const.COL_NAME_TIME)]
+        range_cache.invalidate(min(time_col), max(time_col))
+
+
+def select_columns(columns: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """
+    :param columns: short names, None means all columns
+    :return: Time and the given columns which exist in the data table, None if columns is None
+    """
+    if columns is None:
+        return None
+    existing = set(backend.get_backend().get_columns())
+    return [db_const.COL_NAME_TIME,
+            *(col for col in dict.fromkeys(columns) if col != db_const.COL_NAME_TIME and col in existing)]
+
+
+def load_data_for_date_range(start: datetime.datetime, end: datetime.datetime,
+                             already_existing: Optional[DbData] = None, delete_too_much_existing=False,
+                             columns: Optional[Iterable[str]] = None) -> DbData:
+    """
+    :param already_existing: only the records before and after it are loaded
+    :param columns: only load these columns (and Time), None for all. columns which don't exist are skipped.
+    """
+    columns = select_columns(columns)
+    if already_existing is not None and columns is not None and columns != already_existing.columns:
+        already_existing = None  # other columns requested, the existing data can't be extended
+    if already_existing is None:
+        variant = ("range", tuple(columns if columns is not None else backend.get_backend().get_columns()))
+        return range_cache.load(variant, start, end, lambda s, e: backend.get_backend().load_range(s, e, columns))
+    if not len(already_existing):
+        return load_data_for_date_range(start, end, columns=already_existing.columns)
+    parts = [already_existing]
+    ex_start = already_existing.times[0].item()
+    ex_end = already_existing.times[-1].item()
+    logger.log.debug(f"extend existing {ex_start} to {ex_end}")
+    if start < ex_start:
+        parts.insert(0, load_data_for_date_range(start, ex_start - datetime.timedelta(seconds=1),
+                                                 columns=already_existing.columns))
+        logger.log.debug(f"loaded before data {start} to {ex_start}")
+    if end > ex_end:
+        parts.append(load_data_for_date_range(ex_end + datetime.timedelta(seconds=1), end,
+                                              columns=already_existing.columns))
+        logger.log.debug(f"loaded after data {ex_end} to {end}")
+    result = concatenate(parts) if len(parts) > 1 else already_existing
+    if delete_too_much_existing:
+        result = result.between(start, end)
+    return result
+
+
+def _aggregate_select_columns(short_names: Optional[Collection[str]]) -> List[str]:
+    """
+    :return: the aggregate expressions of the sensors for a GROUP BY select, MINMAXAVG sensors get three columns
+    """
+    columns = []
     for sens in sensor_master.ALL_SENSORS:
         short_name = sens.get_short_name()
+        if short_names is not None and short_name not in short_names:
+            continue
         if sens.get_compression_function() == CompressionFunction.MINMAXAVG:
             columns.append(f"AVG({short_name}) AS '{short_name}'")
-            columns.append(f"MIN({short_name}) AS '{short_name}_MIN'")
-            columns.append(f"MAX({short_name}) AS '{short_name}_MAX'")
+            columns.append(f"MIN({short_name}) AS '{short_name}{binning.SUFFIX_MIN}'")
+            columns.append(f"MAX({short_name}) AS '{short_name}{binning.SUFFIX_MAX}'")
         else:
             func = {
                 CompressionFunction.MIN: "MIN",
@@ -256,72 +390,106 @@ def load_data_with_group_by(group_by: str,
                 CompressionFunction.SUM: "SUM"
             }[sens.get_compression_function()]
             columns.append(f"{func}({short_name}) AS '{short_name}'")
-    command = f"SELECT {', '.join(columns)} FROM data WHERE {db_const.COL_NAME_TIME} " \
-              f"BETWEEN {start.strftime(db_const.DATETIME_FORMAT)} AND {end.strftime(db_const.DATETIME_FORMAT)} " \
-              f"GROUP BY {group_by};"
-    print(command, file=sys.stderr)
-    cur = None
-    conn = None
-    try:
-        conn = connection_pool.find_conn()
-        cur = conn.cursor()
-        cur.execute(command)
-        db_data = fetch_to_db_data(cur)
-    finally:
-        if cur:
-            cur.close()
-        connection_pool.release_conn(conn)
-    return db_data
+    return columns
+
+
+def load_data_with_group_by(group_by: str,
+                            start: Optional[datetime.datetime] = None,
+                            end: Optional[datetime.datetime] = None,
+                            duration: Optional[datetime.timedelta] = None,
+                            short_names: Optional[Collection[str]] = None) -> DbData:
+    """
+    :param short_names: only these sensors, None for all
+    """
+    start, end, duration = util.calculate_missing_start_end_duration(start, end, duration)
+    columns = [f"FROM_UNIXTIME(AVG(UNIX_TIMESTAMP({db_const.COL_NAME_TIME})))", *_aggregate_select_columns(short_names)]
+    command = f"SELECT {query_budget.mysql_hint()}{', '.join(columns)} FROM data " \
+              f"WHERE {db_const.COL_NAME_TIME} BETWEEN %s AND %s GROUP BY {group_by};"
+    with connection_pool.cursor() as cur, profiler.profile(command) as entry:
+        cur.execute(command, (start, end))
+        data = fetch_to_db_data(cur)
+        entry.set_result(len(data), data.get_nbytes())
+        return data
+
+
+def load_data_with_epoch_buckets(interval_seconds: int,
+                                 start: datetime.datetime,
+                                 end: datetime.datetime,
+                                 short_names: Optional[Collection[str]] = None) -> DbData:
+    """
+    aggregates any interval in the database, the buckets are aligned to multiples of interval_seconds since
+    1970-01-01 and the time of a bucket is the average time of its records, the same as binning.aggregate()
+    :param short_names: only these sensors, None for all
+    """
+    if interval_seconds < 1:
+        raise ValueError("interval_seconds must be at least 1")
+    columns = [f"DATE_ADD({EPOCH_SQL}, INTERVAL FLOOR(AVG({EPOCH_SECONDS_SQL})) SECOND)",
+               *_aggregate_select_columns(short_names)]
+    command = f"SELECT {query_budget.mysql_hint()}{', '.join(columns)} FROM {db_const.DATA_DB_NAME} " \
+              f"WHERE {db_const.COL_NAME_TIME} BETWEEN %s AND %s " \
+              f"GROUP BY {EPOCH_SECONDS_SQL} DIV {int(interval_seconds)} ORDER BY 1;"
+    with connection_pool.cursor() as cur, profiler.profile(command) as entry:
+        cur.execute(command, (start, end))
+        data = fetch_to_db_data(cur)
+        entry.set_result(len(data), data.get_nbytes())
+        return data
+
+
+def load_data_from_rollup(level: "rollup.RollupLevel",
+                          start: datetime.datetime,
+                          end: datetime.datetime,
+                          short_names: Optional[Collection[str]] = None) -> DbData:
+    with connection_pool.cursor() as cur, profiler.profile() as entry:
+        rollup.select_level(level, start, end, cur, short_names)
+        entry.statement = cur.statement
+        data = fetch_to_db_data(cur)
+        entry.set_result(len(data), data.get_nbytes())
+        return data
 
 
 def load_data_with_interval(interval: datetime.timedelta, *,
                             start: datetime.datetime = None,
                             end: datetime.datetime = None,
-                            duration: datetime.timedelta = None) -> DbData:
+                            duration: datetime.timedelta = None,
+                            columns: Optional[Collection[str]] = None) -> DbData:
+    """
+    :param columns: short names of the sensors to load, None for all
+    """
     start, end, duration = util.calculate_missing_start_end_duration(start, end, duration)
-    if interval in SPECIAL_INTERVALS_GROUP_BY.keys():
-        return load_data_with_group_by(SPECIAL_INTERVALS_GROUP_BY[interval], start, end)
-    raw = load_data_for_date_range(start, end)
-    result = []
-    time_idx = raw.columns.index("Time")
-    idx_a = 0
-    rowcount = raw.array.shape[0]
-    while idx_a < rowcount:
-        dt_a = raw.array[idx_a, time_idx]
-        dt_b = dt_a + interval
-        idx_b = idx_a + 1
-        while raw.array[idx_b, time_idx] < dt_b and rowcount > idx_b:
-            idx_b += 1
-        chunk = raw.array[idx_a:idx_b]
-        row = []
-        for col_index, short_name in enumerate(raw.columns):
-            if short_name == "Time":
-                method = "avg"
-            else:
-                method = sensor_master.SensorMaster.get_sensor_for_info("short_name",
-                                                                        short_name).get_compression_function()
-            column = chunk[:, col_index]
-            if "avg" in method:
-                # TODO implement min and max also (for minmaxavg)
-                value = np.mean(column)
-            elif "sum" == method:
-                value = np.sum(column)
-            elif "min" == method:
-                value = np.min(column)
-            elif "max" == method:
-                value = np.max(column)
-            else:
-                logger.log.warn(f"shouldn't get here (method={method})")
-                value = np.mean(column)
-            row.append(value)
-        result.append(row)
-        idx_a = idx_b
-    return DbData(np.array(result), raw.columns)
+    if range_cache.is_aligned_interval(interval):
+        variant = ("interval", interval, tuple(columns) if columns is not None else None)
+        return range_cache.load(variant, start, end, lambda s, e: _load_data_with_interval(interval, s, e, columns))
+    return _load_data_with_interval(interval, start, end, columns)
+
+
+def _load_data_with_interval(interval: datetime.timedelta,
+                             start: datetime.datetime,
+                             end: datetime.datetime,
+                             columns: Optional[Collection[str]]) -> DbData:
+    aggregated = backend.get_backend().load_aggregated(interval, start, end, columns)
+    if aggregated is not None:
+        return aggregated
+    raw = load_data_for_date_range(start, end, columns=columns)
+    if not len(raw):
+        return raw
+    values = {}
+    functions = {}
+    for short_name in raw.get_value_columns():
+        sensor = sensor_master.SensorMaster.get_sensor_for_info("short_name", short_name)
+        if sensor is None:
+            continue
+        values[short_name] = raw.column(short_name)
+        functions[short_name] = sensor.get_compression_function()
+    result_times, result_columns = binning.aggregate(raw.seconds(), values, functions, int(interval.total_seconds()))
+    result_values = np.empty((len(result_times), len(result_columns)), order="F")
+    for col_index, column in enumerate(result_columns.values()):
+        result_values[:, col_index] = column
+    return DbData(result_times.astype("datetime64[s]"), result_values, [db_const.COL_NAME_TIME, *result_columns.keys()])
 
 
 def execute_select_range(start, end, cursor, columns=None) -> None:
     """
-    Executes the select statement on the given cursor.
+    Executes the select statement on the given cursor, the caller profiles it (see profiler.profile()).
     :return: None
     """
     if columns is None:
@@ -329,80 +497,91 @@ def execute_select_range(start, end, cursor, columns=None) -> None:
     else:
         column_list = ", ".join(columns)
     util.validate_start_end(start, end)
-    start_str, end_str = start.strftime(db_const.DATETIME_FORMAT), end.strftime(db_const.DATETIME_FORMAT)
-    command=f"SELECT {column_list} FROM {db_const.DATA_DB_NAME} WHERE {db_const.COL_NAME_TIME} BETWEEN '{start_str}' AND '{end_str}'"
-    print(command, file=sys.stderr)
-    cursor.execute(command)
+    command = f"SELECT {query_budget.mysql_hint()}{column_list} FROM {db_const.DATA_DB_NAME} " \
+              f"WHERE {db_const.COL_NAME_TIME} BETWEEN %s AND %s{query_budget.limit_clause()}"
+    cursor.execute(command, (start, end))
+
+
+def iter_range(start: datetime.datetime,
+               end: datetime.datetime,
+               columns: Optional[Sequence[str]] = None,
+               chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[DbData]:
+    """
+    reads the records between start and end in chunks (MySQL uses an unbuffered cursor), so the memory usage
+    doesn't depend on the size of the range. at least one chunk is yielded (it can be empty), so the columns are always known.
+    the arrays of a chunk are reused for the next chunk, copy them if you need them longer.
+    :param columns: None for all columns, Time is always selected and columns which don't exist are skipped
+    :param chunk_rows: maximum number of rows in one chunk
+    """
+    util.validate_start_end(start, end)
+    return backend.get_backend().iter_range(start, end, select_columns(columns), chunk_rows)
+
+
+def load_raw_samples(start: datetime.datetime,
+                     end: datetime.datetime,
+                     columns: Optional[Sequence[str]] = None) -> DbData:
+    """
+    loads the samples of the sensors (every few seconds) from the raw sample store instead of the records of the
+    data table, they are only kept for config.RAW_SAMPLE_RETENTION_DAYS
+    :param columns: None for all sampled columns
+    """
+    util.validate_start_end(start, end)
+    data = raw_samples.load(start, end, columns)
+    query_budget.check_rows(len(data))
+    return data
 
 
 def insert_record(timestamp: datetime.datetime, update_if_exists=False, **values):
     """
     example call: insert_record(time, Temp1=3, Light=5, update_if_exists=True)
     """
-    cur = None
-    conn = None
     try:
-        conn = connection_pool.find_conn()
-        cur = conn.cursor()
-        cols = list(values.keys())
-        cols.append(db_const.COL_NAME_TIME)
-        vals = list(values.values())
-        vals.append(to_sql_str(timestamp))
-        do_insert(conn, cur, cols, vals, update_if_exists)
+        backend.get_backend().upsert([*values.keys(), db_const.COL_NAME_TIME], [[*values.values(), timestamp]],
+                                     update_if_exists)
+        coverage.add_record(timestamp, values)
+    finally:
+        range_cache.invalidate(timestamp)
+
+
+def insert_records(records: Sequence[Tuple[datetime.datetime, Dict[str, object]]], update_if_exists=False) -> None:
+    """
+    like insert_record() for many records, with one upsert per set of columns
+    :param records: (timestamp, values) sorted by timestamp, values like the keyword arguments of insert_record()
+    """
+    groups: Dict[Tuple[str, ...], List[Tuple[datetime.datetime, Dict[str, object]]]] = {}
+    for timestamp, values in records:
+        groups.setdefault(tuple(values.keys()), []).append((timestamp, values))
+    try:
+        for columns, group in groups.items():
+            backend.get_backend().upsert([*columns, db_const.COL_NAME_TIME],
+                                         [[*values.values(), timestamp] for timestamp, values in group],
+                                         update_if_exists)
+            coverage.add(binning.datetimes_to_seconds([timestamp for timestamp, _ in group]),
+                         {col: np.array([values[col] if values[col] is not None else np.nan for _, values in group],
+                                        dtype=np.float64)
+                          for col in columns})
     finally:
-        if cur:
-            cur.close()
-        connection_pool.release_conn(conn)
+        for day in sorted({timestamp.date() for timestamp, _ in records}):
+            range_cache.invalidate(util.date_to_datetime(day))
 
 
 def fetch_to_db_data(cursor: MySQLCursor) -> DbData:
-    return DbData(np.array(cursor.fetchall()), cursor.column_names)
+    return DbData.from_rows(cursor.fetchall(), cursor.column_names)
 
 
 def export_to_csv(start: datetime.datetime, end: datetime.datetime, path: str,
                   columns: Optional[Collection[str]] = None, delimiter=";", none_value: str = ""):
     start_ts = time.perf_counter()
-    cur = None
-    conn = None
-    out = None
-    try:
-        conn = connection_pool.find_conn()
-        cur = conn.cursor()
-        execute_select_range(start, end, cur)
-        if columns is None:
-            columns = cur.column_names
-            col_nums = range(len(columns))
-        else:
-            col_nums = []
-            for df_col in columns:
-                try:
-                    col_nums.append(cur.column_names.index(df_col))
-                except ValueError:
-                    pass
-        out = open(path, "w")
-        out.write(delimiter.join([cur.column_names[n] for n in col_nums]) + "\n")
-
-        def to_str(value: object) -> str:
-            if value is None:
-                return none_value
-            if isinstance(value, datetime.datetime):
-                return value.strftime(db_const.EXPORT_DATETIME_FORMAT)
-            elif isinstance(value, float):
-                return str(round(value, 3))
-            else:
-                return str(value)
-
-        while True:
-            db_row = cur.fetchone()
-            if not db_row:
-                break
-            db_row = list(db_row)
-            try:
-                time_index = cur.column_names.index(db_const.COL_NAME_TIME)
-                db_row[time_index] = db_row[time_index].isoformat()
-            except ValueError:
-                pass
-            out.write(delimiter.join([to_str(db_row[n]) for n in col_nums]) + "\n")
+    with open(path, "w") as out:
+        header_written = False
+        for chunk in iter_range(start, end, columns):
+            if not header_written:
+                out.write(delimiter.join(chunk.columns) + "\n")
+                header_written = True
+            time_strs = np.datetime_as_string(chunk.times, unit="s")
+            rounded = np.round(chunk.values, 3).tolist()
+            for time_str, row in zip(time_strs, rounded):
+                out.write(delimiter.join([time_str, *(none_value if math.isnan(v) else str(v) for v in row)]) + "\n")
 
         end = time.perf_counter()
         size = out.tell()
@@ -410,12 +589,6 @@ def export_to_csv(start: datetime.datetime, end: datetime.datetime, path: str,
         by_per_sec = size / secs
         logger.log.info(f"Exported {util.human_readable_size(size)} in {round(secs, 5)} seconds to '{path}'"
                         f"({util.human_readable_size(by_per_sec)}/s)")
-    finally:
-        if cur:
-            cur.close()
-        if out:
-            out.close()
-        connection_pool.release_conn(conn)
 
 
 def find_nearest_record(timestamp: datetime.datetime):
@@ -423,42 +596,29 @@ def find_nearest_record(timestamp: datetime.datetime):
     :param timestamp: datetime.datetime
     :return: nearest record, to past if one record is as far as another record
     """
-    time_str = to_sql_str(timestamp)
-    cur = None
-    conn = None
-    try:
-        conn = connection_pool.find_conn()
-        cur = conn.cursor()
-
-        cur.execute(f"SELECT * FROM data WHERE Time >= {time_str} ORDER BY Time ASC LIMIT 1;")
-        res_future = cur.fetchone()
-        future_cols = cur.column_names
-        future_time_index = future_cols.index(db_const.COL_NAME_TIME)
-
-        cur.execute(f"SELECT * FROM data WHERE Time <= {time_str} ORDER BY Time DESC LIMIT 1;")
-        res_past = cur.fetchone()
-        past_cols = cur.column_names
-        past_time_index = past_cols.index(db_const.COL_NAME_TIME)
-
-        if res_future is not None and res_past is not None:
-            to_future = res_future[future_time_index] - timestamp
-            to_past = timestamp - res_past[past_time_index]
-            if to_future < to_past:
-                record, columns = res_future, future_cols
-            else:
-                record, columns = res_past, past_cols
-        elif res_future is not None:
-            record, columns = res_future, future_cols
-        elif res_past is not None:
-            record, columns = res_past, past_cols
-        else:  # both None
-            return None
-        return record_to_dict(record, columns)
+    return find_nearest_records([timestamp])[0]
 
-    finally:
-        if cur:
-            cur.close()
-        connection_pool.release_conn(conn)
+
+def find_nearest_records(timestamps: Sequence[datetime.datetime]) -> List[Optional[Dict[str, object]]]:
+    """
+    like find_nearest_record() for many timestamps, with one query
+    :return: one record dict (or None if the table is empty) for each timestamp, in the same order
+    """
+    if not timestamps:
+        return []
+    rows, column_names = backend.get_backend().select_nearest(timestamps)
+    time_index = column_names.index(db_const.COL_NAME_TIME)
+    best: List[Optional[tuple]] = [None] * len(timestamps)
+    for row in rows:
+        i = row[0]
+        timestamp = timestamps[i]
+        if best[i] is None or _nearest_key(row[time_index], timestamp) < _nearest_key(best[i][time_index], timestamp):
+            best[i] = row
+    return [record_to_dict(row[1:], column_names[1:]) if row is not None else None for row in best]
+
+
+def _nearest_key(record_time: datetime.datetime, timestamp: datetime.datetime) -> Tuple[datetime.timedelta, bool]:
+    return abs(record_time - timestamp), record_time > timestamp  # past wins if both are as far
 
 
 def get_value_sums(columns,
@@ -466,32 +626,38 @@ def get_value_sums(columns,
                    start: datetime.datetime = None,
                    end: datetime.datetime = None,
                    duration: datetime.timedelta = None) -> Dict[str, float]:
-    print(f"start={start}, end={end}", file=sys.stderr)
     start, end, duration = util.calculate_missing_start_end_duration(start, end, duration)
+    return get_value_sums_multi(columns, [(start, end)])[0]
+
+
+def get_value_sums_multi(columns: Sequence[str],
+                         windows: Sequence[Tuple[datetime.datetime, datetime.datetime]]) -> List[Dict[str, float]]:
+    """
+    like get_value_sums() for many time windows, with one query
+    :param windows: list of (start, end), both inclusive
+    :return: one dict for each window, in the same order. the sum is 0 if there are no values.
+    """
+    if not windows:
+        return []
     if not all(map(util.is_valid_sql_name, columns)):
         raise ValueError("At least one of the given column names is invalid!!!")
-    col_list = (f"SUM({sn}) AS {sn}" for sn in columns)
-    cur = None
-    con = None
-    try:
-        con = connection_pool.find_conn()
-        cur = con.cursor()
-        execute_select_range(start, end, cur, col_list)
-        result = record_to_dict(cur.fetchone(), cur.column_names, none_value=0)
-        print(f"start={start}, result={json.dumps(result)}", file=sys.stderr)
-        return result
-    finally:
-        if cur:
-            cur.close()
-        connection_pool.release_conn(con)
+    for start, end in windows:
+        util.validate_start_end(start, end)
+    rows, column_names = backend.get_backend().select_sums(columns, windows)
+    result: List[Dict[str, float]] = [{} for _ in windows]
+    for row in rows:
+        result[row[0]] = record_to_dict(row[1:], column_names[1:], none_value=0)
+    return result
 
 
 def record_to_dict(record: Iterable, columns: Iterable[str], none_value=None):
-    #print(record, columns, none_value, file=sys.stderr)
     return {col: value if value is not None else none_value
             for col, value in zip(columns, record)}
 
 
 def cleanup() -> None:
+    range_cache.clear()
+    raw_samples.cleanup()
+    backend.cleanup()
     connection_pool.cleanup()
     logger.log.debug("Database connection closed.")
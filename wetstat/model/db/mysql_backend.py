@@ -0,0 +1,203 @@
+# coding=utf-8
+"""
+MySQL implementation of the storage backend, uses the connection pool, prepared statements and the rollup tables.
+"""
+import contextlib
+import datetime
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+from mysql.connector import Error
+from mysql.connector import errorcode
+
+from wetstat.common import logger
+from wetstat.model import binning
+from wetstat.model.db import backend
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import profiler
+from wetstat.model.db import query
+from wetstat.model.db import query_budget
+from wetstat.model.db import rollup
+from wetstat.model.db import schema
+
+
+@contextlib.contextmanager
+def _timeout_as_error() -> Iterator[None]:
+    """
+    raises TimeoutError if MySQL aborted a query because of query_budget.mysql_hint()
+    """
+    try:
+        yield
+    except Error as e:
+        if e.errno == errorcode.ER_QUERY_TIMEOUT:
+            raise TimeoutError(f"The query took longer than {query_budget.get_max_execution_seconds()} seconds") from e
+        raise
+
+
+class MySqlBackend(backend.StorageBackend):
+    name = "mysql"
+
+    def get_columns(self) -> List[str]:
+        return schema.get_columns()
+
+    def add_columns(self, names: Iterable[str]) -> None:
+        schema.add_columns(names)
+
+    def load_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]]) -> "db_model.DbData":
+        with _timeout_as_error(), connection_pool.cursor() as cur, profiler.profile() as entry:
+            db_model.execute_select_range(start, end, cur, columns)
+            entry.statement = cur.statement
+            data = db_model.fetch_to_db_data(cur)
+            entry.set_result(len(data), data.get_nbytes())
+        query_budget.check_rows(len(data))
+        return data
+
+    def iter_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]],
+                   chunk_rows: int) -> Iterator["db_model.DbData"]:
+        # unbuffered cursor, so the rows are read from the server while iterating
+        with _timeout_as_error(), connection_pool.connection() as conn:
+            cur = conn.cursor(buffered=False)
+            entry = profiler.new_entry()
+            fetch_start = time.perf_counter()
+            try:
+                db_model.execute_select_range(start, end, cur, columns)
+                entry.statement = cur.statement
+                entry.duration += time.perf_counter() - fetch_start
+                column_names = list(cur.column_names)
+                time_idx = column_names.index(db_const.COL_NAME_TIME)
+                value_idxs = [i for i in range(len(column_names)) if i != time_idx]
+                result_columns = [db_const.COL_NAME_TIME, *(column_names[i] for i in value_idxs)]
+                times = np.empty(chunk_rows, dtype="datetime64[s]")
+                values = np.empty((chunk_rows, len(value_idxs)), dtype=np.float64, order="F")
+                yielded = False
+                while True:
+                    fetch_start = time.perf_counter()
+                    rows = cur.fetchmany(chunk_rows)
+                    entry.duration += time.perf_counter() - fetch_start  # without the time of the consumer
+                    entry.rows += len(rows)
+                    entry.nbytes += len(rows) * len(column_names) * 8
+                    query_budget.check_rows(entry.rows)
+                    if not rows and yielded:
+                        break
+                    n = len(rows)
+                    if n:
+                        block = np.array(rows, dtype=object)
+                        times[:n] = binning.datetimes_to_seconds(block[:, time_idx]).view("datetime64[s]")
+                        values[:n] = block[:, value_idxs].astype(np.float64)
+                    yield db_model.DbData(times[:n], values[:n], result_columns)
+                    yielded = True
+                    if n < chunk_rows:
+                        break
+            finally:
+                if conn.unread_result:
+                    # the generator was closed before all rows were read (for example the client is gone) or a
+                    # budget was exceeded. reading the rest could take long, so the query is aborted instead.
+                    connection_pool.discard(conn)
+                else:
+                    cur.close()
+                profiler.add(entry)
+
+    def load_aggregated(self,
+                        interval: datetime.timedelta,
+                        start: datetime.datetime,
+                        end: datetime.datetime,
+                        short_names: Optional[Sequence[str]]) -> Optional["db_model.DbData"]:
+        with _timeout_as_error():
+            data = self._load_aggregated(interval, start, end, short_names)
+        if data is not None:
+            query_budget.check_rows(len(data))
+        return data
+
+    @staticmethod
+    def _load_aggregated(interval: datetime.timedelta,
+                         start: datetime.datetime,
+                         end: datetime.datetime,
+                         short_names: Optional[Sequence[str]]) -> Optional["db_model.DbData"]:
+        if interval in rollup.LEVEL_FOR_INTERVAL.keys():
+            try:
+                return db_model.load_data_from_rollup(rollup.LEVEL_FOR_INTERVAL[interval], start, end, short_names)
+            except Error as e:
+                if e.errno == errorcode.ER_QUERY_TIMEOUT:
+                    raise
+                logger.log.exception("Could not load from rollup table, falling back to group by")
+        if interval in db_model.SPECIAL_INTERVALS_GROUP_BY.keys():
+            return db_model.load_data_with_group_by(db_model.SPECIAL_INTERVALS_GROUP_BY[interval], start, end,
+                                                    short_names=short_names)
+        seconds = interval.total_seconds()
+        if seconds >= 1 and seconds == int(seconds):
+            return db_model.load_data_with_epoch_buckets(int(seconds), start, end, short_names)
+        return None
+
+    def select_nearest(self, timestamps: Sequence[datetime.datetime]) -> Tuple[List[tuple], List[str]]:
+        parts = []
+        for i in range(len(timestamps)):
+            for operator, order in ((">=", "ASC"), ("<=", "DESC")):
+                parts.append(f"(SELECT {i} AS QueryIndex, {db_const.DATA_DB_NAME}.* FROM {db_const.DATA_DB_NAME} "
+                             f"WHERE {db_const.COL_NAME_TIME} {operator} %s "
+                             f"ORDER BY {db_const.COL_NAME_TIME} {order} LIMIT 1)")
+        with connection_pool.connection() as conn:
+            rows, column_names = query.fetch_all(conn, " UNION ALL ".join(parts),
+                                                 [ts for ts in timestamps for _ in range(2)])
+        return rows, list(column_names)
+
+    def select_sums(self,
+                    columns: Sequence[str],
+                    windows: Sequence[backend.Window]) -> Tuple[List[tuple], List[str]]:
+        col_list = ", ".join(f"SUM({sn}) AS {sn}" for sn in columns)
+        statement = " UNION ALL ".join(f"(SELECT {i} AS QueryIndex, {col_list} FROM {db_const.DATA_DB_NAME} "
+                                       f"WHERE {db_const.COL_NAME_TIME} BETWEEN %s AND %s)"
+                                       for i in range(len(windows)))
+        with connection_pool.connection() as conn:
+            rows, column_names = query.fetch_all(conn, statement, [dt for window in windows for dt in window])
+        return rows, list(column_names)
+
+    def upsert(self, column_names: Sequence[str], rows: Sequence[Sequence[object]], update_if_exists=False) -> None:
+        if not len(rows):
+            return
+        time_idx = list(column_names).index(db_const.COL_NAME_TIME)
+        statement = db_model.build_insert_statement(column_names, update_if_exists)
+        with connection_pool.connection(writer=True) as conn:
+            if len(rows) == 1:
+                query.execute(conn, statement, rows[0])
+            else:
+                cur = conn.cursor()
+                try:
+                    with profiler.profile(statement) as entry:
+                        cur.executemany(statement, [tuple(row) for row in rows])
+                        entry.set_result(len(rows))
+                finally:
+                    cur.close()
+            cur = conn.cursor()
+            try:
+                db_model.refresh_rollups(min(row[time_idx] for row in rows), max(row[time_idx] for row in rows),
+                                         conn, cur)
+            finally:
+                cur.close()
+
+    def insert_daydatas(self, daydatas: Iterable, add_missing_columns=False, update_if_exists=False) -> int:
+        count = 0
+        with connection_pool.connection(writer=True) as conn:
+            for daydata in daydatas:
+                db_model._insert_daydata(conn, daydata, add_missing_columns, update_if_exists)
+                count += len(daydata.array)
+        return count
+
+    def get_stats(self) -> dict:
+        return connection_pool.get_stats()
+
+    def cleanup(self) -> None:
+        connection_pool.cleanup()
@@ -0,0 +1,190 @@
+# coding=utf-8
+"""
+Monthly RANGE partitions of the data table (MySQL only).
+
+Every month has its own partition named pYYYYMM, the last partition (pfuture) takes everything after the newest month.
+Queries with a condition on Time only read the partitions of the requested months (partition pruning).
+ensure_future_partitions() splits the next months off pfuture before data arrives there, so pfuture is always
+empty and reorganizing it doesn't copy any rows. Old months can be exported to csv and dropped, the rollup tables
+keep their aggregates.
+
+Run this file to convert the data table (rebuilds the whole table, can take a while).
+"""
+import datetime
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+from typing import Optional
+
+from mysql.connector.cursor import MySQLCursor
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model.db import connection_pool
+from wetstat.model.db import coverage
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import range_cache
+
+MONTHS_AHEAD = 3
+FUTURE_PARTITION = "pfuture"
+ARCHIVE_FILE_FORMAT = "data_%Y_%m.csv"
+_PARTITION_NAME_RE = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+@dataclass
+class Partition(object):
+    name: str
+    start: Optional[datetime.datetime]  # None for pfuture
+    less_than: Optional[datetime.datetime]  # None means MAXVALUE
+    rows: int  # estimated by MySQL
+
+
+def _month_start(dt: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt: datetime.datetime) -> datetime.datetime:
+    return (dt.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def get_partition_name(month: datetime.datetime) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def _partition_definition(month: datetime.datetime) -> str:
+    less_than = _next_month(month).strftime(db_const.DATETIME_FORMAT)
+    return f"PARTITION {get_partition_name(month)} VALUES LESS THAN ('{less_than}')"
+
+
+def _future_definition() -> str:
+    return f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)"
+
+
+def get_partitions(cursor: MySQLCursor) -> List[Partition]:
+    """
+    :return: the partitions of the data table in order, empty list if the table isn't partitioned
+    """
+    cursor.execute("SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+                   "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+                   "ORDER BY PARTITION_ORDINAL_POSITION",
+                   (db_const.DATABASE_NAME, db_const.DATA_DB_NAME))
+    result = []
+    for name, rows in cursor.fetchall():
+        name = name.decode() if isinstance(name, bytes) else name
+        match = _PARTITION_NAME_RE.match(name)
+        if match:
+            start = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+            result.append(Partition(name, start, _next_month(start), rows or 0))
+        else:
+            result.append(Partition(name, None, None, rows or 0))
+    return result
+
+
+def is_partitioned(cursor: MySQLCursor) -> bool:
+    return len(get_partitions(cursor)) > 0
+
+
+def convert_table(cursor: MySQLCursor, months_ahead: int = MONTHS_AHEAD) -> None:
+    """
+    partitions the data table by month, from the month of the oldest record to months_ahead months in the future.
+    does nothing if the table is already partitioned.
+    """
+    if is_partitioned(cursor):
+        logger.log.info("data table is already partitioned")
+        return
+    cursor.execute(f"SELECT MIN({db_const.COL_NAME_TIME}) FROM {db_const.DATA_DB_NAME};")
+    first = cursor.fetchone()[0]
+    month = _month_start(first if first is not None else config.get_date())
+    last = _month_start(config.get_date())
+    for i in range(months_ahead):
+        last = _next_month(last)
+    definitions = []
+    while month <= last:
+        definitions.append(_partition_definition(month))
+        month = _next_month(month)
+    definitions.append(_future_definition())
+    logger.log.info(f"Partitioning {db_const.DATA_DB_NAME} into {len(definitions)} partitions")
+    cursor.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} PARTITION BY RANGE COLUMNS({db_const.COL_NAME_TIME}) "
+                   f"({', '.join(definitions)});")
+    logger.log.info(f"Partitioned {db_const.DATA_DB_NAME}")
+
+
+def ensure_future_partitions(cursor: MySQLCursor, months_ahead: int = MONTHS_AHEAD) -> List[str]:
+    """
+    creates the partitions up to months_ahead months after the current month
+    :return: names of the created partitions
+    """
+    partitions = [p for p in get_partitions(cursor) if p.start is not None]
+    if not partitions:
+        return []
+    month = _next_month(partitions[-1].start)
+    last = _month_start(config.get_date())
+    for i in range(months_ahead):
+        last = _next_month(last)
+    new_months = []
+    while month <= last:
+        new_months.append(month)
+        month = _next_month(month)
+    if not new_months:
+        return []
+    cursor.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+                   f"({', '.join(map(_partition_definition, new_months))}, {_future_definition()});")
+    names = list(map(get_partition_name, new_months))
+    logger.log.info(f"Created partitions {names}")
+    return names
+
+
+def drop_partitions_before(before: datetime.datetime,
+                           cursor: MySQLCursor,
+                           archive_dir: Optional[str] = None) -> List[str]:
+    """
+    drops the partitions which only contain records before the given time
+    :param archive_dir: the records of each partition are exported to a csv file in this folder before it is dropped,
+                        None to drop without export
+    :return: names of the dropped partitions
+    """
+    if archive_dir is not None:
+        os.makedirs(archive_dir, exist_ok=True)
+    dropped = []
+    for p in get_partitions(cursor):
+        if p.less_than is None or p.less_than > before:
+            continue
+        if archive_dir is not None:
+            path = os.path.join(archive_dir, p.start.strftime(ARCHIVE_FILE_FORMAT))
+            db_model.export_to_csv(p.start, p.less_than - datetime.timedelta(seconds=1), path)
+        cursor.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} DROP PARTITION {p.name};")
+        range_cache.invalidate(p.start, p.less_than - datetime.timedelta(seconds=1))
+        coverage.remove(p.start, p.less_than - datetime.timedelta(seconds=1))
+        logger.log.info(f"Dropped partition {p.name} ({p.rows} rows)")
+        dropped.append(p.name)
+    return dropped
+
+
+def maintain() -> None:
+    """
+    called daily, creates the future partitions and archives the months older than config.DATA_RETENTION_MONTHS
+    """
+    if config.get_db_backend() != config.DB_BACKEND_MYSQL:
+        return
+    with connection_pool.cursor() as cur:
+        if not is_partitioned(cur):
+            logger.log.info("data table isn't partitioned, run wetstat/model/db/partition.py to convert it")
+            return
+        ensure_future_partitions(cur)
+        if config.DATA_RETENTION_MONTHS is not None:
+            before = _month_start(config.get_date())
+            for i in range(config.DATA_RETENTION_MONTHS):
+                before = _month_start(before - datetime.timedelta(days=1))
+            drop_partitions_before(before, cur, config.get_archive_folder())
+
+
+if __name__ == '__main__':
+    try:
+        with connection_pool.cursor() as c:
+            convert_table(c)
+            for part in get_partitions(c):
+                print(part)
+    finally:
+        connection_pool.cleanup()
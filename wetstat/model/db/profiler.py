@@ -0,0 +1,189 @@
+# coding=utf-8
+"""
+Records the executed queries in a ring buffer of this process: fingerprint of the sql (values replaced with ?),
+the first caller outside of wetstat.model.db, duration, number of rows, size of the fetched values and the time the
+query waited for a connection of the pool. get_stats() summarizes the buffer per fingerprint (percentiles),
+queries slower than SLOW_QUERY_SECONDS are logged as warning.
+
+usage:
+    with profiler.profile(statement) as entry:
+        cursor.execute(statement, params)
+        rows = cursor.fetchall()
+        entry.set_result(len(rows))
+"""
+import collections
+import contextlib
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from wetstat.common import logger
+from wetstat.model.db import connection_pool
+
+RING_SIZE = 2000
+SLOW_QUERY_SECONDS: Optional[float] = 1.0  # None disables the warning
+PERCENTILES = [50, 90, 99]
+
+_DB_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIPPED_FILES = {contextlib.__file__}
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@dataclass
+class QueryEntry(object):
+    statement: str
+    caller: str
+    start: float  # time.time()
+    pool_wait: float  # seconds
+    duration: float = 0.0  # seconds
+    rows: int = 0
+    nbytes: int = 0  # size of the fetched values (8 bytes per value), 0 if unknown
+    fingerprint: str = ""
+
+    def set_result(self, rows: int, nbytes: Optional[int] = None, columns: int = 0) -> None:
+        """
+        :param nbytes: None to estimate it as rows * columns * 8
+        """
+        self.rows = rows
+        self.nbytes = nbytes if nbytes is not None else rows * columns * 8
+
+
+_entries: Deque[QueryEntry] = collections.deque(maxlen=RING_SIZE)
+_lock = threading.Lock()
+query_count = 0
+slow_count = 0
+
+
+@functools.lru_cache(maxsize=1024)  # most statements have placeholders, so the same text is executed often
+def fingerprint(statement: str) -> str:
+    """
+    :return: the statement with ? instead of literal values and repeated UNION ALL parts written once, so all
+             executions of the same query have the same fingerprint (the number of repetitions is kept)
+    """
+    result = _WHITESPACE_RE.sub(" ", _NUMBER_RE.sub("?", _STRING_RE.sub("?", statement))).strip()
+    parts = result.split(" UNION ALL ")
+    for period in range(1, len(parts) // 2 + 1):
+        if len(parts) % period == 0 and parts == parts[:period] * (len(parts) // period):
+            return f"{' UNION ALL '.join(parts[:period])} UNION ALL ... ({len(parts) // period} times)"
+    return result
+
+
+def find_caller() -> str:
+    """
+    :return: module.function:line of the first frame outside of wetstat.model.db
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_DB_PACKAGE_DIR) and filename not in _SKIPPED_FILES:
+            return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+def new_entry(statement: str = "") -> QueryEntry:
+    """
+    for queries which can't be measured with profile(), set duration and call add()
+    """
+    return QueryEntry(statement, find_caller(), time.time(), connection_pool.pop_wait_time())
+
+
+@contextlib.contextmanager
+def profile(statement: str = "") -> Iterator[QueryEntry]:
+    """
+    measures the duration of the block, the statement can also be set later with entry.statement
+    """
+    entry = new_entry(statement)
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry.duration = time.perf_counter() - start
+        add(entry)
+
+
+def add(entry: QueryEntry) -> None:
+    global query_count, slow_count
+    entry.fingerprint = fingerprint(entry.statement)
+    slow = SLOW_QUERY_SECONDS is not None and entry.duration > SLOW_QUERY_SECONDS
+    with _lock:
+        _entries.append(entry)
+        query_count += 1
+        if slow:
+            slow_count += 1
+    if slow:
+        logger.log.warning(f"Slow query: {round(entry.duration * 1000, 1)}ms, {entry.rows} rows, "
+                           f"called from {entry.caller}: {entry.fingerprint}")
+
+
+def get_entries() -> List[QueryEntry]:
+    with _lock:
+        return list(_entries)
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
+
+
+def _summarize(entries: List[QueryEntry]) -> dict:
+    durations_ms = np.array([e.duration for e in entries]) * 1000
+    percentiles = np.percentile(durations_ms, PERCENTILES)
+    return {
+        "count": len(entries),
+        "total_ms": round(float(durations_ms.sum()), 3),
+        "avg_ms": round(float(durations_ms.mean()), 3),
+        "max_ms": round(float(durations_ms.max()), 3),
+        **{f"p{p}_ms": round(float(value), 3) for p, value in zip(PERCENTILES, percentiles)},
+        "avg_rows": round(sum(e.rows for e in entries) / len(entries), 1),
+        "total_bytes": sum(e.nbytes for e in entries),
+        "avg_pool_wait_ms": round(sum(e.pool_wait for e in entries) / len(entries) * 1000, 3),
+    }
+
+
+def get_stats(limit: int = 20) -> dict:
+    """
+    :param limit: number of fingerprints (the ones with the longest total duration) and slowest queries
+    :return: summary of the entries in the ring buffer, json serializable
+    """
+    entries = get_entries()
+    by_fingerprint: Dict[str, List[QueryEntry]] = collections.defaultdict(list)
+    for entry in entries:
+        by_fingerprint[entry.fingerprint].append(entry)
+    queries = []
+    for fp, fp_entries in by_fingerprint.items():
+        queries.append({
+            "fingerprint": fp,
+            "callers": dict(collections.Counter(e.caller for e in fp_entries).most_common(5)),
+            **_summarize(fp_entries),
+        })
+    queries.sort(key=lambda q: q["total_ms"], reverse=True)
+    slowest = sorted(entries, key=lambda e: e.duration, reverse=True)[:limit]
+    return {
+        "queries_total": query_count,
+        "slow_queries_total": slow_count,
+        "slow_query_ms": SLOW_QUERY_SECONDS * 1000 if SLOW_QUERY_SECONDS is not None else None,
+        "buffered": len(entries),
+        "overall": _summarize(entries) if entries else None,
+        "queries": queries[:limit],
+        "slowest": [{
+            "fingerprint": e.fingerprint,
+            "caller": e.caller,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e.start)),
+            "duration_ms": round(e.duration * 1000, 3),
+            "rows": e.rows,
+        } for e in slowest],
+    }
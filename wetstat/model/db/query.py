@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Server side prepared statements with bound parameters.
+
+Each connection keeps one prepared cursor per statement text, so the server parses a statement only once per
+connection and values are sent in the binary protocol instead of being formatted into the sql string.
+"""
+import threading
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+from mysql.connector import MySQLConnection
+from mysql.connector.cursor import MySQLCursorPrepared
+
+from wetstat.model.db import profiler
+
+# key: (id(connection), connection_id), a reconnect gets a new connection_id and therefore an empty cache
+# value: {statement: (statement, cursor)}, the statement object is stored too because the connector only
+#        skips preparing again if it gets the identical string object
+_statements: Dict[Tuple[int, int], Dict[str, Tuple[str, MySQLCursorPrepared]]] = {}
+_statements_lock = threading.Lock()
+
+
+def prepared_cursor(connection: MySQLConnection, statement: str) -> Tuple[str, MySQLCursorPrepared]:
+    key = (id(connection), connection.connection_id)
+    with _statements_lock:
+        cache = _statements.setdefault(key, {})
+    try:
+        return cache[statement]
+    except KeyError:
+        entry = statement, connection.cursor(prepared=True, buffered=False)
+        cache[statement] = entry
+        return entry
+
+
+def execute(connection: MySQLConnection, statement: str, params: Sequence[object] = ()) -> MySQLCursorPrepared:
+    """
+    executes the statement with %s placeholders as prepared statement.
+    the result must be read completely before the next statement is executed on the same connection.
+    """
+    with profiler.profile(statement) as entry:
+        cursor = _execute(connection, statement, params)
+        entry.set_result(max(cursor.rowcount, 0))
+    return cursor
+
+
+def _execute(connection: MySQLConnection, statement: str, params: Sequence[object]) -> MySQLCursorPrepared:
+    cached_statement, cursor = prepared_cursor(connection, statement)
+    cursor.execute(cached_statement, tuple(params))
+    return cursor
+
+
+def fetch_all(connection: MySQLConnection,
+              statement: str,
+              params: Sequence[object] = ()) -> Tuple[List[tuple], Tuple[str, ...]]:
+    """
+    :return: (rows, column names)
+    """
+    with profiler.profile(statement) as entry:
+        cursor = _execute(connection, statement, params)
+        rows = cursor.fetchall()
+        entry.set_result(len(rows), columns=len(cursor.column_names))
+    return rows, cursor.column_names
+
+
+def forget_connection(connection: MySQLConnection) -> None:
+    """
+    closes all prepared statements of the connection, call before the connection is closed
+    """
+    with _statements_lock:
+        keys = [key for key in _statements.keys() if key[0] == id(connection)]
+        caches = [_statements.pop(key) for key in keys]
+    for cache in caches:
+        for _, cursor in cache.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Limits for the database queries of one request, so a few huge requests can't occupy the database and the connection
+pool for minutes.
+
+The budget is set per thread with limit() (wsgi_v2 sets one per endpoint) and read by the backends:
+- max_execution_seconds: MySQL aborts a select after this time (MAX_EXECUTION_TIME optimizer hint), SQLite with a
+  progress handler. The backends raise TimeoutError.
+- max_rows: the raw selects get a LIMIT of max_rows + 1 and check_rows() raises RowLimitError if there are more rows,
+  so a request never holds more than max_rows records in memory. estimate_rows() estimates the records of a request
+  before it is executed, wsgi_v2 uses it to switch to a coarser interval.
+
+When the client of a streamed response is gone, the server closes the response, which closes the generators of the
+backends, so the rest of the query is never read (see wsgi_v2.iter_with_budget()).
+"""
+import contextlib
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Iterator
+from typing import Optional
+
+RECORD_INTERVAL = datetime.timedelta(minutes=10)  # distance of two raw records, see SensorMaster.measure()
+
+
+class RowLimitError(Exception):
+    pass
+
+
+@dataclass
+class QueryBudget(object):
+    max_execution_seconds: Optional[float] = None  # per query
+    max_rows: Optional[int] = None  # per query
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def limit(budget: Optional[QueryBudget]) -> Iterator[Optional[QueryBudget]]:
+    """
+    sets the budget for the queries of this thread inside the block, None means no limits
+    """
+    previous = getattr(_local, "budget", None)
+    _local.budget = budget
+    try:
+        yield budget
+    finally:
+        _local.budget = previous
+
+
+def get_current() -> Optional[QueryBudget]:
+    return getattr(_local, "budget", None)
+
+
+def get_max_rows() -> Optional[int]:
+    budget = get_current()
+    return budget.max_rows if budget is not None else None
+
+
+def get_max_execution_seconds() -> Optional[float]:
+    budget = get_current()
+    return budget.max_execution_seconds if budget is not None else None
+
+
+def mysql_hint() -> str:
+    """
+    :return: optimizer hint for the current budget, put it directly after SELECT. empty string if there is no limit
+    """
+    seconds = get_max_execution_seconds()
+    if seconds is None:
+        return ""
+    return f"/*+ MAX_EXECUTION_TIME({max(1, int(seconds * 1000))}) */ "
+
+
+def limit_clause() -> str:
+    """
+    :return: LIMIT clause which returns one row more than allowed (so check_rows() can notice it), or empty string
+    """
+    max_rows = get_max_rows()
+    return f" LIMIT {max_rows + 1}" if max_rows is not None else ""
+
+
+def check_rows(rows: int) -> None:
+    """
+    :param rows: number of rows of the query so far
+    :raise RowLimitError: if there are more rows than the budget allows
+    """
+    max_rows = get_max_rows()
+    if max_rows is not None and rows > max_rows:
+        raise RowLimitError(f"The query returns more than {max_rows} rows")
+
+
+def estimate_rows(start: datetime.datetime,
+                  end: datetime.datetime,
+                  interval: Optional[datetime.timedelta] = None) -> int:
+    """
+    :param interval: None for raw records
+    :return: number of records between start and end if there is a record every RECORD_INTERVAL
+    """
+    step = max(interval, RECORD_INTERVAL) if interval is not None else RECORD_INTERVAL
+    return max(0, int((end - start) / step) + 1)
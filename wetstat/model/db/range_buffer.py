@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+Buffer of the loaded records of a growing and moving time window, for example the range of the date pickers in
+bokeh_view.
+
+The records are kept in read-only blocks of at most one day each, sorted by time. Extending the window only loads
+and adds the new blocks, trimming only removes blocks, the existing blocks are never copied. between() finds the
+blocks with a binary search and only copies the requested range.
+"""
+import bisect
+import datetime
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+
+_ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+class RangeBuffer(object):
+
+    def __init__(self, columns: Optional[Iterable[str]] = None) -> None:
+        """
+        :param columns: short names to load (and Time), None for all, see db_model.load_data_for_date_range()
+        """
+        self.requested_columns = list(columns) if columns is not None else None
+        self.columns: Optional[List[str]] = None  # known after the first load
+        self.blocks: List[db_model.DbData] = []
+        self._firsts: List[np.datetime64] = []  # time of the first record of each block
+        self._lasts: List[np.datetime64] = []  # time of the last record of each block
+        self.loaded_start: Optional[datetime.datetime] = None
+        self.loaded_end: Optional[datetime.datetime] = None  # everything between loaded_start and loaded_end is loaded
+
+    def __len__(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+    def get_nbytes(self) -> int:
+        return sum(block.get_nbytes() for block in self.blocks)
+
+    def clear(self) -> None:
+        self.blocks = []
+        self._firsts = []
+        self._lasts = []
+        self.loaded_start = self.loaded_end = None
+
+    def ensure(self, start: datetime.datetime, end: datetime.datetime) -> None:
+        """
+        loads the records between start and end (both inclusive) which aren't loaded yet.
+        if the range doesn't touch the loaded range, the buffer is cleared instead of loading the gap.
+        """
+        if self.loaded_start is None or end + _ONE_SECOND < self.loaded_start or start - _ONE_SECOND > self.loaded_end:
+            self.clear()
+            self._add(self._load(start, end))
+            self.loaded_start, self.loaded_end = start, end
+            return
+        if start < self.loaded_start:
+            self._add(self._load(start, self.loaded_start - _ONE_SECOND))
+            self.loaded_start = start
+        if end > self.loaded_end:
+            self._add(self._load(self.loaded_end + _ONE_SECOND, end))
+            self.loaded_end = end
+
+    def trim(self, start: datetime.datetime, end: datetime.datetime) -> None:
+        """
+        removes the blocks which only contain records before start or after end
+        """
+        if self.loaded_start is None:
+            return
+        first = bisect.bisect_left(self._lasts, np.datetime64(start, "s"))
+        last = bisect.bisect_right(self._firsts, np.datetime64(end, "s"))
+        if first == 0 and last == len(self.blocks):
+            return
+        if first >= last:
+            self.clear()
+            return
+        # the removed records aren't loaded anymore, the kept blocks start and end with a record
+        if first > 0:
+            self.loaded_start = self._firsts[first].item()
+        if last < len(self.blocks):
+            self.loaded_end = self._lasts[last - 1].item()
+        self.blocks = self.blocks[first:last]
+        self._firsts = self._firsts[first:last]
+        self._lasts = self._lasts[first:last]
+
+    def between(self, start: datetime.datetime, end: datetime.datetime) -> "db_model.DbData":
+        """
+        :return: the loaded records between start and end (both inclusive), a view if they are in one block
+        """
+        first = bisect.bisect_left(self._lasts, np.datetime64(start, "s"))
+        last = bisect.bisect_right(self._firsts, np.datetime64(end, "s"))
+        parts = list(self.blocks[first:last])
+        if parts:
+            parts[0] = parts[0].between(start, end)
+            parts[-1] = parts[-1].between(start, end)
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return db_model.DbData.empty(self.columns or [db_const.COL_NAME_TIME])
+        if len(parts) == 1:
+            return parts[0]
+        return db_model.concatenate(parts)
+
+    def _load(self, start: datetime.datetime, end: datetime.datetime) -> "db_model.DbData":
+        data = db_model.load_data_for_date_range(start, end, columns=self.requested_columns)
+        self.columns = data.columns
+        return data
+
+    def _add(self, data: "db_model.DbData") -> None:
+        if not len(data):
+            return
+        days = data.times.astype("datetime64[D]")
+        bounds = [0, *(np.flatnonzero(days[1:] != days[:-1]) + 1), len(data)]
+        new_blocks = []
+        for block_start, block_end in zip(bounds[:-1], bounds[1:]):
+            times = data.times[block_start:block_end].copy()
+            values = np.array(data.values[block_start:block_end], order="F")
+            times.flags.writeable = False
+            values.flags.writeable = False
+            new_blocks.append(db_model.DbData(times, values, data.columns))
+        # the new records are either all before or all after the existing blocks
+        index = bisect.bisect_left(self._firsts, data.times[0])
+        self.blocks[index:index] = new_blocks
+        self._firsts[index:index] = [block.times[0] for block in new_blocks]
+        self._lasts[index:index] = [block.times[-1] for block in new_blocks]
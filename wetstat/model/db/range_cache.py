@@ -0,0 +1,289 @@
+# coding=utf-8
+"""
+Process wide LRU cache of loaded ranges, in blocks of whole days.
+
+A request is split into the part before the first whole day, the whole days and the rest. The whole days are taken
+from the cache (missing days are loaded with one query per gap and cached), the other parts are always loaded fresh.
+Days which aren't over yet (today and later) are never cached because the values are still being measured.
+
+The inserting functions of db_model and bulk_load call invalidate(). The cache lives in each process (SensorMaster,
+Apache, Bokeh), so invalidate() also appends the changed days before today to a shared log
+(config.get_range_cache_invalidation_file(), one line "<first day> <last day>" per call). load() reads the lines which
+other processes appended since the last load() and removes these days too. When the log exceeds MAX_LOG_BYTES, it is
+replaced by an empty file; a process which sees the new file (another inode) clears its whole cache, because it could
+have missed lines of the old one.
+"""
+import collections
+import datetime
+import fcntl
+import os
+import threading
+from typing import Callable
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model.db import db_model
+
+MAX_BYTES = 64 * 2 ** 20
+MAX_LOG_BYTES = 64 * 2 ** 10
+BUCKET = datetime.timedelta(days=1)
+_BUCKET_SECONDS = int(BUCKET.total_seconds())
+
+# key: (variant, bucket start), variant describes the query (for example the columns), value: DbData of the bucket
+_entries: "collections.OrderedDict[Tuple[Hashable, datetime.datetime], db_model.DbData]" = collections.OrderedDict()
+_bytes = 0
+_generation = 0  # incremented by invalidate(), so data loaded during an invalidation isn't cached
+_lock = threading.Lock()
+_log_position: Optional[Tuple[int, int]] = None  # inode and size of the shared log which were read, inode 0: no log
+hit_count = 0
+miss_count = 0
+eviction_count = 0
+invalidation_count = 0
+
+Loader = Callable[[datetime.datetime, datetime.datetime], "db_model.DbData"]
+
+
+def get_bucket_start(dt: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(dt.year, dt.month, dt.day)
+
+
+def is_aligned_interval(interval: datetime.timedelta) -> bool:
+    """
+    :return: True if the buckets of binning.aggregate() never span two days, so aggregated days can be joined
+    """
+    seconds = interval.total_seconds()
+    return seconds >= 1 and seconds == int(seconds) and _BUCKET_SECONDS % int(seconds) == 0
+
+
+def load(variant: Hashable,
+         start: datetime.datetime,
+         end: datetime.datetime,
+         loader: Loader) -> "db_model.DbData":
+    """
+    :param variant: everything except start and end which changes the result of loader
+    :param loader: loads the records between start and end (both inclusive) from the database.
+                   the result of one day must be the same as the part of that day in the result of a longer range.
+    """
+    _read_shared_log()
+    first = get_bucket_start(start)
+    if first < start:
+        first += BUCKET
+    last = min(get_bucket_start(end + datetime.timedelta(seconds=1)), get_bucket_start(config.get_date()))
+    if first >= last or MAX_BYTES <= 0:
+        return loader(start, end)
+    parts = []
+    if start < first:
+        parts.append(loader(start, first - datetime.timedelta(seconds=1)))
+    parts.extend(_load_buckets(variant, first, last, loader))
+    if last <= end:
+        parts.append(loader(last, end))
+    non_empty = [part for part in parts if len(part)]
+    if not non_empty:
+        return parts[0]
+    if len(non_empty) == 1:
+        return db_model.DbData(non_empty[0].times, non_empty[0].values, non_empty[0].columns)
+    return db_model.concatenate(non_empty)
+
+
+def _load_buckets(variant: Hashable,
+                  first: datetime.datetime,
+                  last: datetime.datetime,
+                  loader: Loader) -> List["db_model.DbData"]:
+    global hit_count, miss_count
+    result: List[Optional[db_model.DbData]] = []
+    with _lock:
+        generation = _generation
+        bucket = first
+        while bucket < last:
+            data = _entries.get((variant, bucket))
+            if data is not None:
+                _entries.move_to_end((variant, bucket))
+                hit_count += 1
+            else:
+                miss_count += 1
+            result.append(data)
+            bucket += BUCKET
+    # consecutive missing days are loaded with one query
+    i = 0
+    while i < len(result):
+        if result[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < len(result) and result[j] is None:
+            j += 1
+        gap_start = first + i * BUCKET
+        loaded = loader(gap_start, first + j * BUCKET - datetime.timedelta(seconds=1))
+        bounds = np.searchsorted(loaded.times, np.array([gap_start + k * BUCKET for k in range(j - i + 1)],
+                                                        dtype="datetime64[s]"))
+        for k in range(j - i):
+            data = _copy_readonly(loaded.slice(bounds[k], bounds[k + 1]))
+            result[i + k] = data
+            _put((variant, gap_start + k * BUCKET), data, generation)
+        i = j
+    return result
+
+
+def _copy_readonly(data: "db_model.DbData") -> "db_model.DbData":
+    # slices keep the whole loaded array alive, so each bucket gets its own arrays
+    times = data.times.copy()
+    values = np.array(data.values, order="F")
+    times.flags.writeable = False
+    values.flags.writeable = False
+    return db_model.DbData(times, values, data.columns)
+
+
+def _put(key: Tuple[Hashable, datetime.datetime], data: "db_model.DbData", generation: int) -> None:
+    global _bytes, eviction_count
+    size = data.get_nbytes()
+    if size > MAX_BYTES:
+        return
+    with _lock:
+        if generation != _generation:
+            return
+        old = _entries.pop(key, None)
+        if old is not None:
+            _bytes -= old.get_nbytes()
+        _entries[key] = data
+        _bytes += size
+        while _bytes > MAX_BYTES:
+            _, evicted = _entries.popitem(last=False)
+            _bytes -= evicted.get_nbytes()
+            eviction_count += 1
+
+
+def invalidate(start: datetime.datetime, end: Optional[datetime.datetime] = None) -> None:
+    """
+    removes the days between start and end (both inclusive) of all variants in all processes, call it after records
+    were inserted
+    :param end: None for only the day of start
+    """
+    first = get_bucket_start(start)
+    last = get_bucket_start(end if end is not None else start)
+    _invalidate_local(first, last)
+    if first < get_bucket_start(config.get_date()):  # the other days are never cached
+        try:
+            _append_shared_log(first, last)
+        except OSError:
+            logger.log.exception("Could not tell the other processes to invalidate their range cache")
+
+
+def _invalidate_local(first: datetime.datetime, last: datetime.datetime) -> None:
+    global _bytes, _generation, invalidation_count
+    with _lock:
+        _generation += 1
+        for key in [key for key in _entries.keys() if first <= key[1] <= last]:
+            _bytes -= _entries.pop(key).get_nbytes()
+            invalidation_count += 1
+
+
+def _append_shared_log(first: datetime.datetime, last: datetime.datetime) -> None:
+    path = config.get_range_cache_invalidation_file()
+    line = f"{first.date().isoformat()} {last.date().isoformat()}\n".encode()
+    while True:
+        with open(path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino != _get_inode(path):
+                    continue  # replaced while waiting for the lock, append to the new file
+                before = (os.fstat(f.fileno()).st_ino, f.tell())
+                if before[1] + len(line) > MAX_LOG_BYTES:
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "wb") as new:
+                        new.write(line)
+                    os.replace(tmp_path, path)  # the other processes clear their cache when they see the new file
+                    after = (_get_inode(path), len(line))
+                else:
+                    f.write(line)
+                    after = (before[0], before[1] + len(line))
+                _skip_own_line(before, after)
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _skip_own_line(before: Tuple[int, int], after: Tuple[int, int]) -> None:
+    """
+    this process already removed the days of its own line
+    """
+    global _log_position
+    with _lock:
+        if _log_position == before:
+            _log_position = after
+
+
+def _get_inode(path: str) -> int:
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return 0
+
+
+def _read_shared_log() -> None:
+    """
+    removes the days which other processes invalidated since the last call
+    """
+    global _log_position
+    path = config.get_range_cache_invalidation_file()
+    try:
+        stat = os.stat(path)
+        inode, size = stat.st_ino, stat.st_size
+    except FileNotFoundError:
+        inode, size = 0, 0
+    with _lock:
+        position = _log_position
+        if position is None:  # first call in this process, the cache is still empty
+            _log_position = (inode, size)
+            return
+    if position == (inode, size):
+        return
+    old_inode, offset = position
+    if inode != old_inode:
+        if old_inode != 0:
+            clear()  # the log was replaced, lines of the old one could be missed
+        offset = 0
+    lines = b""
+    if inode != 0:
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_ino == inode:
+                    f.seek(offset)
+                    lines = f.read()
+        except FileNotFoundError:
+            pass
+    lines = lines[:lines.rfind(b"\n") + 1]  # without a line which is being written
+    for line in lines.splitlines():
+        try:
+            first, last = (datetime.datetime.fromisoformat(day) for day in line.decode().split())
+        except ValueError:
+            continue
+        _invalidate_local(first, last)
+    with _lock:
+        _log_position = (inode, offset + len(lines))
+
+
+def clear() -> None:
+    global _bytes
+    with _lock:
+        _entries.clear()
+        _bytes = 0
+    logger.log.debug("Range cache cleared")
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {
+            "max_bytes": MAX_BYTES,
+            "used_bytes": _bytes,
+            "entries": len(_entries),
+            "hits": hit_count,
+            "misses": miss_count,
+            "evictions": eviction_count,
+            "invalidations": invalidation_count,
+        }
@@ -0,0 +1,238 @@
+# coding=utf-8
+"""
+Store of the samples which SensorMaster.measure_now() takes every few seconds, the data table only gets their mean,
+min or max per MEASURING_FREQ_SECONDS.
+
+There is one append-only file per day in config.get_raw_samples_folder(), named YYYY-MM-DD.bin (YYYY-MM-DD_N.bin if
+the sampled sensors changed during the day). A file starts with MAGIC, the length of the json header as uint32 and the
+json header with the columns. Then follow fixed width records: Time as int64 naive seconds (like DbData.seconds()) and
+one float32 per column, NaN is a missing value. The records are appended in time order, so the time column is the
+index of the file: load() maps the file with np.memmap and finds the range with a binary search.
+
+Files older than config.RAW_SAMPLE_RETENTION_DAYS are deleted when the first sample of a new day is written.
+"""
+import datetime
+import json
+import os
+import re
+import struct
+import threading
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+
+MAGIC = b"WSRAW001"
+_HEADER_LENGTH = struct.Struct("<I")
+_FILE_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:_(\d+))?\.bin$")
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# the file which is appended to
+_file: Optional[BinaryIO] = None
+_file_day: Optional[datetime.date] = None
+_file_columns: Optional[List[str]] = None
+_file_dtype: Optional[np.dtype] = None
+_last_seconds: Optional[int] = None
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return config.RAW_SAMPLE_RETENTION_DAYS != 0
+
+
+def record_dtype(columns: Sequence[str]) -> np.dtype:
+    return np.dtype([(db_const.COL_NAME_TIME, "<i8"), *((col, "<f4") for col in columns)])
+
+
+def _to_seconds(dt: datetime.datetime) -> int:
+    return (dt - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+def _day_files(day: datetime.date) -> List[str]:
+    """
+    :return: paths of the files of the day in the order in which they were written
+    """
+    return _range_files(day, day)
+
+
+def _range_files(first: datetime.date, last: datetime.date) -> List[str]:
+    """
+    lists the folder once, however long the range is
+    :return: paths of the files of the days first to last (both inclusive), sorted by day and in the order in which
+             they were written
+    """
+    folder = config.get_raw_samples_folder()
+    if not os.path.isdir(folder):
+        return []
+    first_iso, last_iso = first.isoformat(), last.isoformat()
+    numbered = []
+    for name in os.listdir(folder):
+        match = _FILE_NAME.match(name)
+        if match and first_iso <= match.group(1) <= last_iso:
+            numbered.append((match.group(1), int(match.group(2) or 1), os.path.join(folder, name)))
+    return [path for _, _, path in sorted(numbered)]
+
+
+def get_oldest_day() -> Optional[datetime.date]:
+    """
+    :return: the first day which is kept by the retention, None if everything is kept
+    """
+    if config.RAW_SAMPLE_RETENTION_DAYS is None:
+        return None
+    return config.get_date().date() - datetime.timedelta(days=config.RAW_SAMPLE_RETENTION_DAYS)
+
+
+def read_header(f: BinaryIO) -> Tuple[List[str], int]:
+    """
+    :return: the columns (without Time) and the offset of the first record
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} isn't a raw sample file")
+    length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode())
+    return header["columns"], len(MAGIC) + _HEADER_LENGTH.size + length
+
+
+def _close_locked() -> None:
+    global _file, _file_day, _file_columns, _file_dtype
+    if _file is not None:
+        _file.close()
+    _file = _file_day = _file_columns = _file_dtype = None
+
+
+def _open_locked(day: datetime.date, columns: List[str]) -> None:
+    """
+    continues the last file of the day if it has the same columns, otherwise a new file is started
+    """
+    global _file, _file_day, _file_columns, _file_dtype, _last_seconds
+    _close_locked()
+    dtype = record_dtype(columns)
+    files = _day_files(day)
+    if files:
+        with open(files[-1], "rb") as f:
+            file_columns, offset = read_header(f)
+        if file_columns == columns:
+            size = os.path.getsize(files[-1])
+            complete = offset + (size - offset) // dtype.itemsize * dtype.itemsize
+            _file = open(files[-1], "r+b")
+            _file.truncate(complete)  # a record which was written halfway (power loss) is dropped
+            if complete > offset:
+                _file.seek(complete - dtype.itemsize)
+                last = np.frombuffer(_file.read(dtype.itemsize), dtype=dtype)[0][db_const.COL_NAME_TIME]
+                _last_seconds = max(_last_seconds or 0, int(last))
+            _file.seek(complete)
+    if _file is None:
+        os.makedirs(config.get_raw_samples_folder(), exist_ok=True)
+        name = day.isoformat() + (f"_{len(files) + 1}" if files else "") + ".bin"
+        _file = open(os.path.join(config.get_raw_samples_folder(), name), "wb")
+        header = json.dumps({"columns": columns}).encode()
+        _file.write(MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+    _file_day = day
+    _file_columns = columns
+    _file_dtype = dtype
+
+
+def append(timestamp: datetime.datetime, columns: Sequence[str], values: Sequence[Optional[float]]) -> None:
+    """
+    appends one sample row, samples which aren't newer than the last one (the clock was set back) are dropped
+    :param values: one per column, None for a missing value
+    """
+    global _last_seconds
+    if not is_enabled():
+        return
+    seconds = _to_seconds(timestamp)
+    with _lock:
+        if _last_seconds is not None and seconds <= _last_seconds:
+            logger.log.warning(f"Dropped raw sample of {timestamp.isoformat()}, it isn't newer than the last sample")
+            return
+        columns = list(columns)
+        if timestamp.date() != _file_day or columns != _file_columns:
+            new_day = timestamp.date() != _file_day
+            _open_locked(timestamp.date(), columns)
+            if new_day:
+                delete_expired(timestamp.date())
+        record = np.zeros(1, dtype=_file_dtype)
+        record[db_const.COL_NAME_TIME] = seconds
+        for col, value in zip(columns, values):
+            record[col] = value if value is not None else np.nan
+        _file.write(record.tobytes())
+        _file.flush()
+        _last_seconds = seconds
+
+
+def delete_expired(today: datetime.date) -> None:
+    """
+    deletes the files older than config.RAW_SAMPLE_RETENTION_DAYS
+    """
+    if config.RAW_SAMPLE_RETENTION_DAYS is None:
+        return
+    oldest = (today - datetime.timedelta(days=config.RAW_SAMPLE_RETENTION_DAYS)).isoformat()
+    folder = config.get_raw_samples_folder()
+    for name in sorted(os.listdir(folder)):
+        match = _FILE_NAME.match(name)
+        if match and match.group(1) < oldest:
+            os.remove(os.path.join(folder, name))
+            logger.log.info(f"Deleted expired raw samples {name}")
+
+
+def _load_file(path: str,
+               start_seconds: int,
+               end_seconds: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    with open(path, "rb") as f:
+        columns, offset = read_header(f)
+    dtype = record_dtype(columns)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if not count:
+        return np.empty(0, dtype=np.int64), {}
+    records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+    times = records[db_const.COL_NAME_TIME]
+    istart = np.searchsorted(times, start_seconds, "left")
+    iend = np.searchsorted(times, end_seconds, "right")
+    selected = np.array(records[istart:iend])  # copies only the selected records
+    del records
+    return selected[db_const.COL_NAME_TIME], {col: selected[col] for col in columns}
+
+
+def load(start: datetime.datetime,
+         end: datetime.datetime,
+         columns: Optional[Sequence[str]] = None) -> "db_model.DbData":
+    """
+    :param columns: short names, None for all columns of the files in the range
+    :return: the samples between start and end (both inclusive), float32 converted to float64. start is moved to the
+             first day of the retention, older files are about to be deleted
+    """
+    oldest = get_oldest_day()
+    if oldest is not None:
+        start = max(start, datetime.datetime(oldest.year, oldest.month, oldest.day))
+    start_seconds, end_seconds = _to_seconds(start), _to_seconds(end)
+    parts = [_load_file(path, start_seconds, end_seconds) for path in _range_files(start.date(), end.date())]
+    if columns is None:
+        columns = list(dict.fromkeys(col for _, part_columns in parts for col in part_columns))
+    columns = [col for col in columns if col != db_const.COL_NAME_TIME]
+    if not parts:
+        return db_model.DbData.empty([db_const.COL_NAME_TIME, *columns])
+    times = np.concatenate([part_times for part_times, _ in parts])
+    values = np.full((len(times), len(columns)), np.nan, order="F")
+    row = 0
+    for part_times, part_columns in parts:
+        for i, col in enumerate(columns):
+            if col in part_columns:
+                values[row:row + len(part_times), i] = part_columns[col]
+        row += len(part_times)
+    order = np.argsort(times, kind="stable")  # files of one day can overlap if the process was restarted
+    return db_model.DbData(times[order].view("datetime64[s]"), np.asfortranarray(values[order]),
+                           [db_const.COL_NAME_TIME, *columns])
+
+
+def cleanup() -> None:
+    with _lock:
+        _close_locked()
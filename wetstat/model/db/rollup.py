@@ -0,0 +1,284 @@
+# coding=utf-8
+"""
+Rollup tables (data_hour, data_day, data_week, data_month, data_year) with precalculated aggregates.
+
+Every rollup row stores the aggregates of one bucket (for example one day), the bucket start is saved in the Time
+column. Hour buckets are calculated from the raw data table, all others from the next finer rollup table, so keeping
+them up to date after an insert only touches a few rows per level.
+
+Run this file to (re)create and backfill all rollup tables.
+"""
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Callable
+from typing import Collection
+from typing import Iterable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from mysql.connector.cursor import MySQLCursor
+
+from wetstat.common import logger
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import query_budget
+from wetstat.model.db import schema
+from wetstat.sensors import sensor_master
+from wetstat.sensors.abstract.base_sensor import CompressionFunction
+
+COL_TIME_SUM = "TimeSum"
+COL_ROW_COUNT = "RowCount"
+
+SUFFIX_SUM = "_SUM"
+SUFFIX_COUNT = "_CNT"
+SUFFIX_MIN = "_MIN"
+SUFFIX_MAX = "_MAX"
+
+# suffix: (sql type, aggregate function on raw data, aggregate function on finer rollup table)
+AGGREGATES: Dict[str, Tuple[str, str, str]] = {
+    SUFFIX_SUM: ("DOUBLE", "SUM", "SUM"),
+    SUFFIX_COUNT: ("INT", "COUNT", "SUM"),
+    SUFFIX_MIN: ("FLOAT", "MIN", "MIN"),
+    SUFFIX_MAX: ("FLOAT", "MAX", "MAX"),
+}
+
+SUFFIXES_FOR_COMPRESSION_FUNCTION = {
+    CompressionFunction.MINMAXAVG: [SUFFIX_SUM, SUFFIX_COUNT, SUFFIX_MIN, SUFFIX_MAX],
+    CompressionFunction.SUM: [SUFFIX_SUM],
+    CompressionFunction.MIN: [SUFFIX_MIN],
+    CompressionFunction.MAX: [SUFFIX_MAX],
+}
+
+
+def _start_of_hour(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _start_of_day(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _start_of_week(dt: datetime.datetime) -> datetime.datetime:
+    return _start_of_day(dt) - datetime.timedelta(days=dt.weekday())
+
+
+def _start_of_month(dt: datetime.datetime) -> datetime.datetime:
+    return _start_of_day(dt).replace(day=1)
+
+
+def _start_of_year(dt: datetime.datetime) -> datetime.datetime:
+    return _start_of_month(dt).replace(month=1)
+
+
+def _next_month(dt: datetime.datetime) -> datetime.datetime:
+    return (dt.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+@dataclass
+class RollupLevel(object):
+    table: str
+    source: Optional[str]  # None means the raw data table
+    bucket_sql: str  # sql expression which calculates the bucket start of the Time column
+    bucket_start: Callable[[datetime.datetime], datetime.datetime]
+    next_bucket: Callable[[datetime.datetime], datetime.datetime]
+
+
+LEVEL_HOUR = RollupLevel("data_hour", None,
+                         "DATE_FORMAT(Time, '%Y-%m-%d %H:00:00')",
+                         _start_of_hour,
+                         lambda dt: dt + datetime.timedelta(hours=1))
+LEVEL_DAY = RollupLevel("data_day", LEVEL_HOUR.table,
+                        "DATE(Time)",
+                        _start_of_day,
+                        lambda dt: dt + datetime.timedelta(days=1))
+LEVEL_WEEK = RollupLevel("data_week", LEVEL_DAY.table,
+                         "DATE(Time) - INTERVAL WEEKDAY(Time) DAY",
+                         _start_of_week,
+                         lambda dt: dt + datetime.timedelta(weeks=1))
+LEVEL_MONTH = RollupLevel("data_month", LEVEL_DAY.table,
+                          "DATE_FORMAT(Time, '%Y-%m-01')",
+                          _start_of_month,
+                          _next_month)
+LEVEL_YEAR = RollupLevel("data_year", LEVEL_MONTH.table,
+                         "DATE_FORMAT(Time, '%Y-01-01')",
+                         _start_of_year,
+                         lambda dt: dt.replace(year=dt.year + 1))
+
+# ordered so that the source of a level is always refreshed before the level itself
+ALL_LEVELS: List[RollupLevel] = [LEVEL_HOUR, LEVEL_DAY, LEVEL_WEEK, LEVEL_MONTH, LEVEL_YEAR]
+
+# same keys as db_model.SPECIAL_INTERVALS_GROUP_BY
+LEVEL_FOR_INTERVAL: Dict[datetime.timedelta, RollupLevel] = {
+    datetime.timedelta(hours=1): LEVEL_HOUR,
+    datetime.timedelta(days=1): LEVEL_DAY,
+    datetime.timedelta(weeks=1): LEVEL_WEEK,
+    datetime.timedelta(days=30): LEVEL_MONTH,
+    datetime.timedelta(days=31): LEVEL_MONTH,
+    datetime.timedelta(days=365): LEVEL_YEAR,
+    datetime.timedelta(days=366): LEVEL_YEAR,
+}
+
+
+_columns_checked = False  # ensure_columns() already ran in this process
+_columns_lock = threading.Lock()
+
+
+def get_rollup_columns(existing: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """
+    :param existing: only the sensors which have one of these columns in the data table, None for all sensors
+    :return: list of (sensor short name, suffix), for example [("Temp1", "_SUM"), ("Temp1", "_CNT"), ...]
+    """
+    existing = set(existing) if existing is not None else None
+    columns = []
+    for sens in sensor_master.ALL_SENSORS:
+        if existing is not None and sens.get_short_name() not in existing:
+            continue
+        for suffix in SUFFIXES_FOR_COMPRESSION_FUNCTION[sens.get_compression_function()]:
+            columns.append((sens.get_short_name(), suffix))
+    return columns
+
+
+def create_tables(cursor: MySQLCursor, drop_existing=False) -> None:
+    col_defs = [f"{db_const.COL_NAME_TIME} DATETIME NOT NULL PRIMARY KEY",
+                f"{COL_TIME_SUM} BIGINT",
+                f"{COL_ROW_COUNT} INT"]
+    col_defs.extend(f"{short_name}{suffix} {AGGREGATES[suffix][0]}"
+                    for short_name, suffix in get_rollup_columns(schema.get_columns(cursor)))
+    for level in ALL_LEVELS:
+        if drop_existing:
+            cursor.execute(f"DROP TABLE IF EXISTS {level.table};")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {level.table} ({', '.join(col_defs)});")
+    ensure_columns(cursor, force=True)  # tables which already existed can miss columns
+    logger.log.info(f"Created rollup tables {', '.join(level.table for level in ALL_LEVELS)}")
+
+
+def ensure_columns(cursor: MySQLCursor, force=False) -> None:
+    """
+    adds the rollup columns of the sensors which have a column in the data table to the rollup tables which don't
+    have them yet (the sensor was added after the rollup tables were created). rollup tables which don't exist are
+    skipped. only checked once per process, schema.add_columns() calls it with force=True.
+    """
+    global _columns_checked
+    with _columns_lock:
+        if _columns_checked and not force:
+            return
+        tables = [level.table for level in ALL_LEVELS]
+        cursor.execute(f"SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+                       f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({', '.join(['%s'] * len(tables))});",
+                       tables)
+        table_columns: Dict[str, set] = {}
+        for table, column in cursor.fetchall():
+            table_columns.setdefault(table, set()).add(column)
+        expected = get_rollup_columns(schema.get_columns(cursor))
+        for table, existing in table_columns.items():
+            missing = [(short_name, suffix) for short_name, suffix in expected if short_name + suffix not in existing]
+            if missing:
+                cursor.execute(f"ALTER TABLE {table} "
+                               f"{', '.join(f'ADD {sn}{suffix} {AGGREGATES[suffix][0]}' for sn, suffix in missing)};")
+                logger.log.info(f"Added rollup columns {[sn + suffix for sn, suffix in missing]} to {table}")
+        _columns_checked = True
+
+
+def refresh_level(level: RollupLevel, start: datetime.datetime, end: datetime.datetime, cursor: MySQLCursor) -> None:
+    """
+    recalculates all buckets of the level which overlap the range between start and end (both inclusive)
+    """
+    lower = level.bucket_start(start)
+    upper = level.next_bucket(level.bucket_start(end))
+    lower_str, upper_str = lower.strftime(db_const.DATETIME_FORMAT), upper.strftime(db_const.DATETIME_FORMAT)
+    target_columns = [db_const.COL_NAME_TIME, COL_TIME_SUM, COL_ROW_COUNT]
+    if level.source is None:
+        source = db_const.DATA_DB_NAME
+        select_columns = [f"{level.bucket_sql} AS bucket",
+                          f"SUM(UNIX_TIMESTAMP({db_const.COL_NAME_TIME}))",
+                          "COUNT(*)"]
+    else:
+        source = level.source
+        select_columns = [f"{level.bucket_sql} AS bucket",
+                          f"SUM({COL_TIME_SUM})",
+                          f"SUM({COL_ROW_COUNT})"]
+    for short_name, suffix in get_rollup_columns(schema.get_columns(cursor)):
+        target_columns.append(short_name + suffix)
+        if level.source is None:
+            select_columns.append(f"{AGGREGATES[suffix][1]}({short_name})")
+        else:
+            select_columns.append(f"{AGGREGATES[suffix][2]}({short_name}{suffix})")
+    cursor.execute(f"DELETE FROM {level.table} "
+                   f"WHERE {db_const.COL_NAME_TIME} >= '{lower_str}' AND {db_const.COL_NAME_TIME} < '{upper_str}';")
+    cursor.execute(f"INSERT INTO {level.table} ({', '.join(target_columns)}) "
+                   f"SELECT {', '.join(select_columns)} FROM {source} "
+                   f"WHERE {db_const.COL_NAME_TIME} >= '{lower_str}' AND {db_const.COL_NAME_TIME} < '{upper_str}' "
+                   f"GROUP BY bucket;")
+
+
+def refresh(start: datetime.datetime, end: datetime.datetime, cursor: MySQLCursor) -> None:
+    """
+    recalculates all rollup buckets which contain records between start and end (both inclusive).
+    the caller has to commit.
+    """
+    ensure_columns(cursor)
+    for level in ALL_LEVELS:
+        refresh_level(level, start, end, cursor)
+
+
+def select_level(level: RollupLevel,
+                 start: datetime.datetime,
+                 end: datetime.datetime,
+                 cursor: MySQLCursor,
+                 short_names: Optional[Collection[str]] = None) -> None:
+    """
+    executes a select statement on the rollup table which returns the same columns as db_model.load_data_with_group_by
+    :param short_names: only these sensors, None for all
+    """
+    columns = [f"FROM_UNIXTIME({COL_TIME_SUM} / {COL_ROW_COUNT}) AS {db_const.COL_NAME_TIME}"]
+    for sens in sensor_master.ALL_SENSORS:
+        short_name = sens.get_short_name()
+        if (short_names is not None and short_name not in short_names) or not schema.has_column(short_name):
+            continue
+        cf = sens.get_compression_function()
+        if cf == CompressionFunction.MINMAXAVG:
+            columns.append(f"{short_name}{SUFFIX_SUM} / {short_name}{SUFFIX_COUNT} AS {short_name}")
+            columns.append(f"{short_name}{SUFFIX_MIN} AS {short_name}_MIN")
+            columns.append(f"{short_name}{SUFFIX_MAX} AS {short_name}_MAX")
+        else:
+            columns.append(f"{short_name}{SUFFIXES_FOR_COMPRESSION_FUNCTION[cf][0]} AS {short_name}")
+    lower_str = level.bucket_start(start).strftime(db_const.DATETIME_FORMAT)
+    end_str = end.strftime(db_const.DATETIME_FORMAT)
+    cursor.execute(f"SELECT {query_budget.mysql_hint()}{', '.join(columns)} FROM {level.table} "
+                   f"WHERE {db_const.COL_NAME_TIME} BETWEEN '{lower_str}' AND '{end_str}' "
+                   f"ORDER BY {db_const.COL_NAME_TIME};")
+
+
+def refresh_in_chunks(start: datetime.datetime, end: datetime.datetime, cursor: MySQLCursor) -> None:
+    """
+    like refresh(), but one year after another, for large ranges like after an import
+    """
+    ensure_columns(cursor)
+    year_start = LEVEL_YEAR.bucket_start(start)
+    while year_start <= end:
+        year_end = LEVEL_YEAR.next_bucket(year_start) - datetime.timedelta(seconds=1)
+        for level in ALL_LEVELS[:-1]:
+            refresh_level(level, year_start, year_end, cursor)
+        logger.log.info(f"refreshed rollup tables for {year_start.year}")
+        year_start = LEVEL_YEAR.next_bucket(year_start)
+    refresh_level(LEVEL_YEAR, start, end, cursor)
+
+
+def backfill(drop_existing=True) -> None:
+    """
+    (re)creates the rollup tables and fills them with the whole content of the data table, one year after another
+    """
+    with connection_pool.cursor() as cur:
+        create_tables(cur, drop_existing=drop_existing)
+        cur.execute(f"SELECT MIN({db_const.COL_NAME_TIME}), MAX({db_const.COL_NAME_TIME}) FROM {db_const.DATA_DB_NAME};")
+        first, last = cur.fetchone()
+        if first is None:
+            logger.log.info("data table is empty, nothing to backfill")
+            return
+        refresh_in_chunks(first, last, cur)
+
+if __name__ == '__main__':
+    backfill()
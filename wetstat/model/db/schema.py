@@ -0,0 +1,86 @@
+# coding=utf-8
+"""
+Process wide cache of the columns of the data table.
+
+The columns are loaded once and only loaded again after add_columns() or invalidate(), so the hot paths
+don't need a metadata round trip per request.
+"""
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from mysql.connector.cursor import MySQLCursor
+
+from wetstat.common import logger
+from wetstat.model import util
+from wetstat.model.db import connection_pool
+from wetstat.model.db import db_const
+from wetstat.model.db import rollup
+
+_column_types: Optional[Dict[str, str]] = None  # key: column name, value: sql type, in table order
+_lock = threading.RLock()
+
+
+def _load(cursor: Optional[MySQLCursor] = None) -> Dict[str, str]:
+    global _column_types
+    with _lock:
+        if _column_types is None:
+            if cursor is None:
+                with connection_pool.cursor() as cur:
+                    return _load(cur)
+            cursor.execute("EXPLAIN " + db_const.DATA_DB_NAME)
+            _column_types = {row[0]: row[1].decode() if isinstance(row[1], bytes) else row[1]
+                             for row in cursor.fetchall()}
+        return _column_types
+
+
+def get_columns(cursor: Optional[MySQLCursor] = None) -> List[str]:
+    return list(_load(cursor).keys())
+
+
+def get_column_types(cursor: Optional[MySQLCursor] = None) -> Dict[str, str]:
+    return dict(_load(cursor))
+
+
+def has_column(name: str) -> bool:
+    return name in _load()
+
+
+def filter_existing(columns: Iterable[str]) -> List[str]:
+    """
+    :return: the given columns which exist in the data table, in the given order
+    """
+    existing = _load()
+    return [col for col in columns if col in existing]
+
+
+def invalidate() -> None:
+    global _column_types
+    with _lock:
+        _column_types = None
+
+
+def add_columns(names: Iterable[str], cursor: Optional[MySQLCursor] = None, sql_type: str = "FLOAT") -> None:
+    """
+    adds all columns which don't exist yet with a single ALTER TABLE, and their columns in the rollup tables
+    """
+    if cursor is None:
+        with connection_pool.cursor() as cur:
+            return add_columns(names, cur, sql_type)
+    with _lock:
+        existing = _load(cursor)
+        missing = [name for name in dict.fromkeys(names) if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            if not util.is_valid_sql_name(name):
+                raise ValueError(f"Invalid column name: '{name}'!!!!")
+        try:
+            cursor.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} "
+                           f"{', '.join(f'ADD {name} {sql_type}' for name in missing)};")
+        finally:
+            invalidate()
+        logger.log.info(f"Added columns {missing} in {db_const.DATABASE_NAME}.{db_const.DATA_DB_NAME}")
+    rollup.ensure_columns(cursor, force=True)  # outside of _lock, ensure_columns() takes it after its own lock
@@ -0,0 +1,330 @@
+# coding=utf-8
+"""
+SQLite implementation of the storage backend, for a Pi without MySQL server.
+
+The database is in WAL mode, so the readers (wsgi_v2, bokeh) never block the writer (SensorMaster) and the other way
+round. Every thread has its own connection, writes in this process are serialized with a lock.
+Time is saved as text in db_const.DATETIME_FORMAT and is the primary key of a WITHOUT ROWID table, so the records
+are stored in time order and a range select reads them sequentially.
+"""
+import contextlib
+import datetime
+import sqlite3
+import threading
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+from wetstat.common import logger
+from wetstat.model import util
+from wetstat.model.db import backend
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.model.db import profiler
+from wetstat.model.db import query_budget
+from wetstat.sensors import sensor_master
+from wetstat.sensors.abstract.base_sensor import CompressionFunction
+
+BUSY_TIMEOUT_MS = 10000
+CACHE_SIZE_KIB = 8192
+MMAP_SIZE_BYTES = 64 * 1024 * 1024
+PROGRESS_HANDLER_STEPS = 10000  # virtual machine instructions between two checks of the query_budget
+
+# seconds since 1970-01-01 of the Time column, naive like binning.datetimes_to_seconds()
+TIME_SECONDS_SQL = f"CAST(strftime('%s', {db_const.COL_NAME_TIME}) AS INTEGER)"
+
+# bucket of the intervals which have calendar boundaries, same keys as db_model.SPECIAL_INTERVALS_GROUP_BY
+SPECIAL_INTERVALS_BUCKET = {
+    datetime.timedelta(hours=1): f"strftime('%Y-%m-%d %H', {db_const.COL_NAME_TIME})",
+    datetime.timedelta(days=1): f"date({db_const.COL_NAME_TIME})",
+    datetime.timedelta(weeks=1): f"date({db_const.COL_NAME_TIME}, 'weekday 0', '-6 days')",  # monday of the week
+    datetime.timedelta(days=30): f"strftime('%Y-%m', {db_const.COL_NAME_TIME})",
+    datetime.timedelta(days=31): f"strftime('%Y-%m', {db_const.COL_NAME_TIME})",
+    datetime.timedelta(days=365): f"strftime('%Y', {db_const.COL_NAME_TIME})",
+    datetime.timedelta(days=366): f"strftime('%Y', {db_const.COL_NAME_TIME})",
+}
+
+
+class SqliteBackend(backend.StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # only one writer at a time, sqlite would return SQLITE_BUSY otherwise
+        self._columns: Optional[List[str]] = None
+        self._columns_lock = threading.Lock()
+        self._create_table()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            # autocommit mode, transactions are started explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable enough with WAL, doesn't fsync every commit
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.connection = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _create_table(self) -> None:
+        short_names = sensor_master.SensorMaster.get_all_sensor_short_names()
+        columns = [f"{db_const.COL_NAME_TIME} TEXT NOT NULL PRIMARY KEY", *(f"{sn} REAL" for sn in short_names)]
+        with self._write_lock:
+            self._connection().execute(f"CREATE TABLE IF NOT EXISTS {db_const.DATA_DB_NAME} "
+                                       f"({', '.join(columns)}) WITHOUT ROWID")
+        self.add_columns(short_names)  # the table can be older than some sensors
+
+    def get_columns(self) -> List[str]:
+        with self._columns_lock:
+            if self._columns is None:
+                cur = self._connection().execute(f"PRAGMA table_info({db_const.DATA_DB_NAME})")
+                self._columns = [row[1] for row in cur.fetchall()]
+            return list(self._columns)
+
+    def add_columns(self, names: Iterable[str]) -> None:
+        existing = self.get_columns()
+        missing = [name for name in dict.fromkeys(names) if name not in existing]
+        for name in missing:
+            if not util.is_valid_sql_name(name):
+                raise ValueError(f"Invalid column name: '{name}'!!!!")
+        if not missing:
+            return
+        with self._write_lock:
+            conn = self._connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for name in missing:  # sqlite can only add one column per statement
+                    conn.execute(f"ALTER TABLE {db_const.DATA_DB_NAME} ADD COLUMN {name} REAL")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                with self._columns_lock:
+                    self._columns = None
+        logger.log.info(f"Added columns {missing} in {self.path}")
+
+    def _select_range_statement(self, columns: Optional[List[str]]) -> Tuple[str, List[str]]:
+        """
+        :return: (statement with two parameters start and end, result columns)
+        """
+        if columns is None:
+            columns = self.get_columns()
+        value_columns = [col for col in columns if col != db_const.COL_NAME_TIME]
+        select = ", ".join([TIME_SECONDS_SQL, *value_columns])
+        statement = f"SELECT {select} FROM {db_const.DATA_DB_NAME} " \
+                    f"WHERE {db_const.COL_NAME_TIME} BETWEEN ? AND ? ORDER BY {db_const.COL_NAME_TIME}" \
+                    f"{query_budget.limit_clause()}"
+        return statement, [db_const.COL_NAME_TIME, *value_columns]
+
+    @staticmethod
+    def _get_deadline() -> Optional[float]:
+        """
+        :return: time.monotonic() at which the query_budget time is over, None if there is no time limit
+        """
+        seconds = query_budget.get_max_execution_seconds()
+        return time.monotonic() + seconds if seconds is not None else None
+
+    @contextlib.contextmanager
+    def _budget_guard(self, deadline: Optional[float] = None) -> Iterator[sqlite3.Connection]:
+        """
+        interrupts the statements of the block if the query_budget time is over.
+        the progress handler is only installed inside the block, so keep it around single calls: other queries of
+        the thread (for example while a generator waits for its consumer) must not be interrupted.
+        :param deadline: see _get_deadline(), default is a new one
+        :raise TimeoutError: if the time is over
+        """
+        conn = self._connection()
+        if deadline is None:
+            deadline = self._get_deadline()
+        if deadline is None:
+            yield conn
+            return
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"The query took longer than {query_budget.get_max_execution_seconds()} "
+                                   f"seconds") from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def load_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]]) -> "db_model.DbData":
+        statement, result_columns = self._select_range_statement(columns)
+        with self._budget_guard() as conn, profiler.profile(statement) as entry:
+            cur = conn.execute(statement, (_to_sql_value(start), _to_sql_value(end)))
+            data = _rows_to_db_data(cur.fetchall(), result_columns)
+            entry.set_result(len(data), data.get_nbytes())
+        query_budget.check_rows(len(data))
+        return data
+
+    def iter_range(self,
+                   start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]],
+                   chunk_rows: int) -> Iterator["db_model.DbData"]:
+        # a sqlite cursor steps through the result while fetching, so only one chunk is in memory
+        statement, result_columns = self._select_range_statement(columns)
+        entry = profiler.new_entry(statement)
+        fetch_start = time.perf_counter()
+        deadline = self._get_deadline()  # one deadline for all chunks, the time of the consumer counts too
+        with self._budget_guard(deadline) as conn:
+            cur = conn.execute(statement, (_to_sql_value(start), _to_sql_value(end)))
+        try:
+            while True:
+                with self._budget_guard(deadline):
+                    rows = cur.fetchmany(chunk_rows)
+                data = _rows_to_db_data(rows, result_columns)
+                entry.duration += time.perf_counter() - fetch_start  # without the time of the consumer
+                entry.rows += len(data)
+                entry.nbytes += data.get_nbytes()
+                query_budget.check_rows(entry.rows)
+                yield data
+                fetch_start = time.perf_counter()
+                if len(rows) < chunk_rows:
+                    break
+        finally:
+            cur.close()
+            profiler.add(entry)
+
+    def load_aggregated(self,
+                        interval: datetime.timedelta,
+                        start: datetime.datetime,
+                        end: datetime.datetime,
+                        short_names: Optional[Sequence[str]]) -> Optional["db_model.DbData"]:
+        if interval in SPECIAL_INTERVALS_BUCKET.keys():
+            bucket = SPECIAL_INTERVALS_BUCKET[interval]
+        else:
+            bucket = f"{TIME_SECONDS_SQL} / {int(interval.total_seconds())}"  # aligned like binning.aggregate()
+        existing = set(self.get_columns())
+        select = [f"CAST(AVG({TIME_SECONDS_SQL}) AS INTEGER)"]
+        result_columns = [db_const.COL_NAME_TIME]
+        for sens in sensor_master.ALL_SENSORS:
+            short_name = sens.get_short_name()
+            if (short_names is not None and short_name not in short_names) or short_name not in existing:
+                continue
+            cf = sens.get_compression_function()
+            if cf == CompressionFunction.MINMAXAVG:
+                select.extend([f"AVG({short_name})", f"MIN({short_name})", f"MAX({short_name})"])
+                result_columns.extend([short_name, short_name + "_MIN", short_name + "_MAX"])
+            else:
+                func = {
+                    CompressionFunction.MIN: "MIN",
+                    CompressionFunction.MAX: "MAX",
+                    CompressionFunction.SUM: "SUM"
+                }[cf]
+                select.append(f"{func}({short_name})")
+                result_columns.append(short_name)
+        statement = f"SELECT {', '.join(select)} FROM {db_const.DATA_DB_NAME} " \
+                    f"WHERE {db_const.COL_NAME_TIME} BETWEEN ? AND ? GROUP BY {bucket} ORDER BY 1"
+        with self._budget_guard() as conn, profiler.profile(statement) as entry:
+            cur = conn.execute(statement, (_to_sql_value(start), _to_sql_value(end)))
+            data = _rows_to_db_data(cur.fetchall(), result_columns)
+            entry.set_result(len(data), data.get_nbytes())
+        query_budget.check_rows(len(data))
+        return data
+
+    def select_nearest(self, timestamps: Sequence[datetime.datetime]) -> Tuple[List[tuple], List[str]]:
+        parts = []
+        for i in range(len(timestamps)):
+            for operator, order in ((">=", "ASC"), ("<=", "DESC")):
+                parts.append(f"SELECT * FROM (SELECT {i} AS QueryIndex, * FROM {db_const.DATA_DB_NAME} "
+                             f"WHERE {db_const.COL_NAME_TIME} {operator} ? "
+                             f"ORDER BY {db_const.COL_NAME_TIME} {order} LIMIT 1)")
+        statement = " UNION ALL ".join(parts)
+        with profiler.profile(statement) as entry:
+            cur = self._connection().execute(statement, [_to_sql_value(ts) for ts in timestamps for _ in range(2)])
+            fetched = cur.fetchall()
+            column_names = [desc[0] for desc in cur.description]
+            entry.set_result(len(fetched), columns=len(column_names))
+        time_idx = column_names.index(db_const.COL_NAME_TIME)
+        rows = []
+        for row in fetched:
+            row = list(row)
+            row[time_idx] = datetime.datetime.fromisoformat(row[time_idx])
+            rows.append(tuple(row))
+        return rows, column_names
+
+    def select_sums(self,
+                    columns: Sequence[str],
+                    windows: Sequence[backend.Window]) -> Tuple[List[tuple], List[str]]:
+        col_list = ", ".join(f"SUM({sn}) AS {sn}" for sn in columns)
+        statement = " UNION ALL ".join(f"SELECT {i} AS QueryIndex, {col_list} FROM {db_const.DATA_DB_NAME} "
+                                       f"WHERE {db_const.COL_NAME_TIME} BETWEEN ? AND ?"
+                                       for i in range(len(windows)))
+        with profiler.profile(statement) as entry:
+            cur = self._connection().execute(statement, [_to_sql_value(dt) for window in windows for dt in window])
+            rows = cur.fetchall()
+            entry.set_result(len(rows), columns=len(cur.description))
+        return rows, [desc[0] for desc in cur.description]
+
+    def upsert(self, column_names: Sequence[str], rows: Sequence[Sequence[object]], update_if_exists=False) -> None:
+        if not all(map(util.is_valid_sql_name, column_names)):
+            raise ValueError("Invalid column name!!!")
+        statement = f"INSERT INTO {db_const.DATA_DB_NAME} ({', '.join(column_names)}) " \
+                    f"VALUES ({', '.join(['?'] * len(column_names))})"
+        if update_if_exists:
+            statement += f" ON CONFLICT({db_const.COL_NAME_TIME}) DO UPDATE SET " + \
+                         ", ".join(f"{col}=excluded.{col}" for col in column_names if col != db_const.COL_NAME_TIME)
+        with self._write_lock, profiler.profile(statement) as entry:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(statement, ([_to_sql_value(value) for value in row] for row in rows))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            entry.set_result(len(rows))
+
+    def get_stats(self) -> dict:
+        with self._connections_lock:
+            return {"open_connections": len(self._connections)}
+
+    def cleanup(self) -> None:
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        self._local = threading.local()
+        for conn in connections:
+            conn.close()
+
+
+def _to_sql_value(value: object) -> object:
+    if isinstance(value, datetime.datetime):
+        return value.strftime(db_const.DATETIME_FORMAT)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _rows_to_db_data(rows: List[tuple], columns: List[str]) -> "db_model.DbData":
+    """
+    :param rows: Time in seconds (TIME_SECONDS_SQL) first, then the values
+    """
+    if not rows:
+        return db_model.DbData.empty(columns)
+    block = np.array(rows, dtype=np.float64)  # None becomes NaN
+    return db_model.DbData(block[:, 0].astype(np.int64).view("datetime64[s]"),
+                           np.asfortranarray(block[:, 1:]),
+                           columns)
@@ -0,0 +1,192 @@
+# coding=utf-8
+"""
+Write-ahead log of the measured records, so a record isn't lost if the database is unavailable when it is measured.
+
+SensorMaster.measure_now() appends every record to config.get_wal_file() (one json line, fsynced) and then calls
+replay(), which inserts all records which aren't in the database yet. If the database fails, the records stay in the
+log and the wal_replay service (see run_replayer()) inserts them as soon as the database is reachable again.
+
+The offset of the first record which isn't inserted yet is the checkpoint, saved in the file <wal>.checkpoint. It is
+moved after the records were inserted, so after a crash in between they are inserted again, which doesn't change
+anything because they are upserted. When all records are inserted, the checkpoint is reset and then the log is
+truncated.
+"""
+import datetime
+import json
+import os
+import threading
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from wetstat.common import config
+from wetstat.common import logger
+from wetstat.model.db import db_model
+
+REPLAY_INTERVAL_SECONDS = 30.0
+REPLAY_BATCH_RECORDS = 1000  # records per insert
+
+Record = Tuple[datetime.datetime, Dict[str, object]]
+
+_lock = threading.Lock()  # log file and checkpoint
+_replay_lock = threading.Lock()  # only one replay at a time
+
+
+def _get_checkpoint_file() -> str:
+    return config.get_wal_file() + ".checkpoint"
+
+
+def _fsync_write(path: str, content: bytes) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_checkpoint() -> int:
+    try:
+        with open(_get_checkpoint_file()) as f:
+            checkpoint = int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+    return checkpoint if checkpoint <= _get_size() else 0  # the log was replaced
+
+
+def _get_size() -> int:
+    try:
+        return os.path.getsize(config.get_wal_file())
+    except FileNotFoundError:
+        return 0
+
+
+def _drop_partial_line_locked() -> None:
+    """
+    removes the end of a line which was written halfway (crash or power loss during append())
+    """
+    path = config.get_wal_file()
+    size = _get_size()
+    if not size:
+        return
+    with open(path, "r+b") as f:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        complete = f.read().rfind(b"\n") + 1
+        f.truncate(complete)
+        f.flush()
+        os.fsync(f.fileno())
+    logger.log.warning(f"Removed {size - complete} bytes of an incomplete record from {path}")
+
+
+def append(timestamp: datetime.datetime, values: Dict[str, object]) -> None:
+    """
+    appends a record to the log, it is on the disk when this function returns
+    :param values: key: short name, value: float or None
+    """
+    line = json.dumps({"time": timestamp.isoformat(), "values": values}).encode() + b"\n"
+    path = config.get_wal_file()
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _drop_partial_line_locked()
+        with open(path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _read_records(offset: int, max_records: int) -> Tuple[List[Record], int]:
+    """
+    :return: the complete records after offset and the offset after the last returned record
+    """
+    try:
+        with open(config.get_wal_file(), "rb") as f:
+            f.seek(offset)
+            content = f.read()
+    except FileNotFoundError:
+        return [], offset
+    records = []
+    position = 0
+    while len(records) < max_records:
+        end = content.find(b"\n", position)
+        if end < 0:
+            break  # the rest is a line which is being written
+        try:
+            entry = json.loads(content[position:end].decode())
+            records.append((datetime.datetime.fromisoformat(entry["time"]), entry["values"]))
+        except (ValueError, KeyError, TypeError):
+            logger.log.error(f"Skipped invalid record in {config.get_wal_file()} at offset {offset + position}")
+        position = end + 1
+    return records, offset + position
+
+
+def _set_checkpoint(offset: int) -> None:
+    with _lock:
+        if offset >= _get_size():
+            # everything is inserted, start a new log. append() holds the lock, so no record is lost. the checkpoint is
+            # reset first: after a crash in between, the old records are inserted again (upsert), while a truncated
+            # log with the old checkpoint would skip the first new records
+            _fsync_write(_get_checkpoint_file(), b"0")
+            _truncate_log_locked()
+        else:
+            _fsync_write(_get_checkpoint_file(), str(offset).encode())
+
+
+def _truncate_log_locked() -> None:
+    with open(config.get_wal_file(), "wb") as f:
+        os.fsync(f.fileno())
+
+
+def get_backlog() -> int:
+    """
+    :return: number of records in the log which aren't inserted into the database yet
+    """
+    with _lock:
+        offset = _read_checkpoint()
+        try:
+            with open(config.get_wal_file(), "rb") as f:
+                f.seek(offset)
+                return f.read().count(b"\n")
+        except FileNotFoundError:
+            return 0
+
+
+def replay() -> int:
+    """
+    inserts the records of the log which aren't in the database yet
+    :return: number of inserted records
+    :raise Exception: the exception of the database if an insert failed, the records stay in the log
+    """
+    with _replay_lock:
+        replayed = 0
+        while True:
+            records, end = _read_records(_read_checkpoint(), REPLAY_BATCH_RECORDS)
+            if records:
+                db_model.insert_records(sorted(records, key=lambda record: record[0]), update_if_exists=True)
+                replayed += len(records)
+            if end == _read_checkpoint():
+                return replayed
+            _set_checkpoint(end)
+
+
+def run_replayer(stop_event: Optional[threading.Event] = None) -> None:
+    """
+    replays the log every REPLAY_INTERVAL_SECONDS until stop_event is set
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    logger.log.info("Started WAL replayer")
+    while True:
+        backlog = get_backlog()
+        if backlog:
+            try:
+                replayed = replay()
+                logger.log.info(f"Inserted {replayed} records from the WAL")
+            except Exception as e:
+                logger.log.warning(f"Could not insert {backlog} records from the WAL, will retry in "
+                                   f"{REPLAY_INTERVAL_SECONDS}s: {type(e).__name__}: {e}")
+        if stop_event.wait(REPLAY_INTERVAL_SECONDS):
+            return
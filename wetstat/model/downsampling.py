@@ -0,0 +1,141 @@
+# coding=utf-8
+"""
+Downsampling of records for plots with Largest-Triangle-Three-Buckets (LTTB).
+
+The records are split into max_points buckets of (almost) the same number of records, the first and the last record
+are buckets of their own. LTTB selects one record per bucket, the one which forms the largest triangle with the record
+selected in the previous bucket and the average of the next bucket, so peaks are kept while flat parts are thinned
+out. With several columns the triangle areas of all columns are added up (each column scaled to its range), so one
+record per bucket is selected for all columns and the result never has more than max_points records. Only the
+dependency on the previous bucket is a python loop.
+
+The selected records keep their time and values. SUM columns contain the sum of the bucket instead, _MIN and _MAX
+columns (the envelope of MINMAXAVG sensors) the minimum and maximum of the bucket. The envelope is calculated from
+the values if the data doesn't have it yet (raw records), aggregated data (db_model.load_data_with_interval()) already
+has it and it is reduced further.
+"""
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from wetstat.model import binning
+from wetstat.model.db import db_const
+from wetstat.model.db import db_model
+from wetstat.sensors import sensor_master
+from wetstat.sensors.abstract.base_sensor import CompressionFunction
+
+MIN_POINTS = 3
+
+
+def bucket_edges(n: int, max_points: int) -> np.ndarray:
+    """
+    :param n: number of records, must be greater than max_points
+    :return: max_points + 1 indices, bucket k contains the records edges[k] to edges[k + 1] - 1
+    """
+    # the step is at least 1 because n > max_points, so every bucket contains at least one record
+    inner = np.linspace(1, n - 1, max_points - 1).astype(np.intp)
+    return np.concatenate(([0], inner, [n]))
+
+
+def lttb_select(x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    :param x: float64 times, sorted
+    :param y: float64 values, one column per series, NaN is ignored
+    :param edges: see bucket_edges()
+    :return: index of the selected record of each bucket, the one with the largest sum of the triangle areas of all
+             series. the first record of the bucket if no series has a value in it
+    """
+    n_buckets = len(edges) - 1
+    low = np.fmin.reduce(y, axis=0)
+    scale = np.fmax.reduce(y, axis=0) - low
+    scale[~(scale > 0)] = 1.0  # constant or empty series
+    y = (y - low) / scale
+    is_value = ~np.isnan(y)
+    counts = np.add.reduceat(is_value, edges[:-1], axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_y = np.add.reduceat(np.where(is_value, y, 0.0), edges[:-1], axis=0) / counts
+    avg_x = np.add.reduceat(x, edges[:-1]) / np.diff(edges)
+
+    selected = np.empty(n_buckets, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = len(x) - 1
+    anchor_x = x[0]
+    anchor_y = y[0].copy()
+    for k in range(1, n_buckets - 1):
+        start, end = edges[k], edges[k + 1]
+        next_x, next_y = avg_x[k + 1], avg_y[k + 1]
+        next_y = np.where(np.isnan(next_y), anchor_y, next_y)
+        anchor_y = np.where(np.isnan(anchor_y), next_y, anchor_y)
+        bucket_x = x[start:end, np.newaxis]
+        bucket_y = y[start:end]
+        # twice the area of the triangle anchor, candidate, next average
+        area = np.abs((anchor_x - next_x) * (bucket_y - anchor_y) - (anchor_x - bucket_x) * (next_y - anchor_y))
+        best = start + np.argmax(np.where(np.isnan(area), 0.0, area).sum(axis=1))
+        selected[k] = best
+        anchor_x = x[best]
+        anchor_y = np.where(np.isnan(y[best]), anchor_y, y[best])
+    return selected
+
+
+def _get_envelope_function(short_name: str, value_columns: List[str]) -> Optional[np.ufunc]:
+    """
+    :return: np.fmin for <sn>_MIN and np.fmax for <sn>_MAX if the data has the column <sn>, otherwise None
+    """
+    for suffix, function in ((binning.SUFFIX_MIN, np.fmin), (binning.SUFFIX_MAX, np.fmax)):
+        if short_name.endswith(suffix) and short_name[:-len(suffix)] in value_columns:
+            return function
+    return None
+
+
+def downsample(data: "db_model.DbData", max_points: int) -> "db_model.DbData":
+    """
+    reduces the records to max_points records (one per bucket) for plotting.
+    MINMAXAVG sensors get additional _MIN and _MAX columns with the minimum and maximum of the bucket (like
+    db_model.load_data_with_interval()), SUM sensors contain the sum of the bucket.
+    :param data: raw or aggregated records
+    :param max_points: number of buckets, at least MIN_POINTS. data with max_points records or less is returned as is
+    """
+    if max_points < MIN_POINTS:
+        raise ValueError(f"max_points must be at least {MIN_POINTS}")
+    n = len(data)
+    if n <= max_points:
+        return data
+    edges = bucket_edges(n, max_points)
+    starts = edges[:-1]
+    value_columns = data.get_value_columns()
+    functions = {}
+    for short_name in value_columns:
+        sensor = sensor_master.SensorMaster.get_sensor_for_info("short_name", short_name)
+        functions[short_name] = sensor.get_compression_function() if sensor is not None else None
+    envelopes = {sn: _get_envelope_function(sn, value_columns) for sn in value_columns}
+    lttb_columns = [sn for sn in value_columns if functions[sn] != CompressionFunction.SUM and envelopes[sn] is None]
+
+    if lttb_columns:
+        seconds = data.seconds()
+        x = (seconds - seconds[0]).astype(np.float64)
+        rows = lttb_select(x, np.stack([data.column(sn) for sn in lttb_columns], axis=1), edges)
+    else:
+        rows = starts
+
+    result: Dict[str, np.ndarray] = {}
+    for short_name in value_columns:
+        column = data.column(short_name)
+        if envelopes[short_name] is not None:
+            result[short_name] = envelopes[short_name].reduceat(column, starts)
+        elif functions[short_name] == CompressionFunction.SUM:
+            is_value = ~np.isnan(column)
+            sums = np.add.reduceat(np.where(is_value, column, 0.0), starts)
+            result[short_name] = np.where(np.add.reduceat(is_value, starts) > 0, sums, np.nan)
+        else:
+            result[short_name] = column[rows]
+            has_envelope = short_name + binning.SUFFIX_MIN in value_columns
+            if functions[short_name] == CompressionFunction.MINMAXAVG and not has_envelope:
+                result[short_name + binning.SUFFIX_MIN] = np.fmin.reduceat(column, starts)
+                result[short_name + binning.SUFFIX_MAX] = np.fmax.reduceat(column, starts)
+    result_columns: List[str] = [db_const.COL_NAME_TIME, *result.keys()]
+    values = np.empty((max_points, len(result)), order="F")
+    for i, column in enumerate(result.values()):
+        values[:, i] = column
+    return db_model.DbData(data.times[rows], values, result_columns)
@@ -1,6 +1,24 @@
 # coding=utf-8
+import collections
+import threading
+import time
 from abc import ABC, abstractmethod
 from enum import Enum
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+from wetstat.common import config
+
+T = TypeVar("T")
+
+# key: device key, value: (time.monotonic() of the reading, reading)
+_shared_samples: Dict[Hashable, Tuple[float, object]] = {}
+_device_locks: Dict[Hashable, threading.Lock] = collections.defaultdict(threading.Lock)
+_device_locks_lock = threading.Lock()
 
 
 class CompressionFunction(Enum):
@@ -43,3 +61,28 @@ class BaseSensor(ABC):
     @abstractmethod
     def measure(self) -> float:
         pass
+
+    def get_device_key(self) -> Optional[Hashable]:
+        """
+        :return: key of the physical device if it measures more than one quantity (one sensor per quantity), None if
+                 the sensor doesn't share its device
+        """
+        return None
+
+    def get_shared_sample(self, read: Callable[[], T]) -> T:
+        """
+        calls read() or returns the result of the last read() of a sensor with the same device key if it isn't older
+        than config.SHARED_SAMPLE_MAX_AGE_SECONDS. Sensors which are read at the same time wait for one read().
+        """
+        key = self.get_device_key()
+        if key is None:
+            return read()
+        with _device_locks_lock:
+            lock = _device_locks[key]
+        with lock:
+            cached = _shared_samples.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= config.SHARED_SAMPLE_MAX_AGE_SECONDS:
+                return cached[1]
+            sample = read()  # an exception isn't cached, the next sensor tries again
+            _shared_samples[key] = (time.monotonic(), sample)
+            return sample
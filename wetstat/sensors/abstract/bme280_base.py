@@ -1,5 +1,7 @@
 # coding=utf-8
+import threading
 from abc import ABC
+from typing import Hashable
 
 try:
     import bme280
@@ -15,6 +17,10 @@ class Const(object):
     ADDRESS = 0x76
 
 
+# the temperature, pressure and humidity sensor are the same chip, sampling.SamplingScheduler reads them in parallel
+_bus_lock = threading.Lock()
+
+
 class BME280Base(BaseSensor, ABC):
 
     def __init__(self) -> None:
@@ -25,10 +31,21 @@ class BME280Base(BaseSensor, ABC):
         except (PermissionError, NameError):
             self.dry_mode = True
 
-    def get_sample(self) -> bme280.compensated_readings:
+    def get_device_key(self) -> Hashable:
+        return "bme280", Const.BUS_NR, Const.ADDRESS
+
+    def get_sample(self) -> "bme280.compensated_readings":
+        """
+        :return: one reading with temperature, pressure and humidity, shared by all BME280 sensors within
+                 config.SHARED_SAMPLE_MAX_AGE_SECONDS
+        """
+        return self.get_shared_sample(self._read_sample)
+
+    def _read_sample(self) -> "bme280.compensated_readings":
         if self.dry_mode:
             raise ConnectionError("Can't get sample because of a permission problem while opening I2C bus")
-        return bme280.sample(self.bus,
-                             address=Const.ADDRESS,
-                             compensation_params=self.calibration,
-                             sampling=bme280.oversampling.x16)
+        with _bus_lock:
+            return bme280.sample(self.bus,
+                                 address=Const.ADDRESS,
+                                 compensation_params=self.calibration,
+                                 sampling=bme280.oversampling.x16)
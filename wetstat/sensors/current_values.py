@@ -0,0 +1,159 @@
+# coding=utf-8
+"""
+Shares the latest sample row of SensorMaster with the other processes (Apache, Django, Bokeh) through a memory mapped
+file (config.get_current_values_file()), so reading the current values doesn't need a connection to the
+current value provider server.
+
+Layout (little endian, fixed size):
+- MAGIC (8 bytes)
+- sequence (uint64): odd while the writer changes the data, incremented twice per publish()
+- number of columns (uint32), unix timestamp of the row (float64)
+- MAX_COLUMNS entries: short name (NAME_BYTES, utf-8, null padded), unix timestamp of the value (float64), value
+  (float64, NaN if the sensor never had a value)
+
+There is only one writer (the measuring process), so this is a seqlock: a reader copies the data and accepts the copy
+if the sequence was even and didn't change meanwhile, otherwise it tries again. Readers never block the writer.
+A sensor whose last sample failed keeps its last value with the time of that value.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from wetstat.common import config
+from wetstat.common import logger
+
+MAGIC = b"WSCURV01"
+MAX_COLUMNS = 32
+NAME_BYTES = 32
+MAX_AGE_SECONDS = 60.0  # older values are None, an older row means that nothing is measured
+READ_ATTEMPTS = 100
+
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = len(MAGIC)
+_ROW = struct.Struct("<Id")
+_ENTRY = struct.Struct(f"<{NAME_BYTES}sdd")
+_DATA_OFFSET = _SEQUENCE_OFFSET + _SEQUENCE.size
+SIZE = _DATA_OFFSET + _ROW.size + MAX_COLUMNS * _ENTRY.size
+
+# writer
+_writer_map: Optional[mmap.mmap] = None
+_sequence = 0
+_last_valid: Dict[str, Tuple[float, float]] = {}  # key: short name, value: (timestamp, value)
+_writer_lock = threading.Lock()
+
+# reader, the file is mapped once per process
+_reader_map: Optional[mmap.mmap] = None
+_reader_lock = threading.Lock()
+
+
+def _open_writer_locked() -> mmap.mmap:
+    global _writer_map, _sequence
+    if _writer_map is None:
+        path = config.get_current_values_file()
+        # an existing file is reused, so the readers which already mapped it see the new values
+        with open(path, "a+b") as f:
+            f.truncate(SIZE)
+            _writer_map = mmap.mmap(f.fileno(), SIZE)
+        _sequence, = _SEQUENCE.unpack_from(_writer_map, _SEQUENCE_OFFSET)
+        _sequence += _sequence % 2  # the last writer stopped during a publish()
+        _writer_map[:len(MAGIC)] = MAGIC
+    return _writer_map
+
+
+def publish(timestamp: float, columns: Sequence[str], values: Sequence[Optional[float]]) -> None:
+    """
+    :param timestamp: unix timestamp of the row
+    :param values: one per column, None for a failed sample
+    """
+    global _sequence
+    with _writer_lock:
+        for col, value in zip(columns, values):
+            if value is not None:
+                _last_valid[col] = (timestamp, value)
+        columns = list(columns)[:MAX_COLUMNS]
+        data = bytearray(_ROW.pack(len(columns), timestamp))
+        for col in columns:
+            value_time, value = _last_valid.get(col, (0.0, math.nan))
+            data += _ENTRY.pack(col.encode()[:NAME_BYTES], value_time, value)
+        mm = _open_writer_locked()
+        _SEQUENCE.pack_into(mm, _SEQUENCE_OFFSET, _sequence + 1)
+        mm[_DATA_OFFSET:_DATA_OFFSET + len(data)] = data
+        _sequence += 2
+        _SEQUENCE.pack_into(mm, _SEQUENCE_OFFSET, _sequence)
+
+
+def _open_reader_locked() -> Optional[mmap.mmap]:
+    global _reader_map
+    if _reader_map is None:
+        try:
+            with open(config.get_current_values_file(), "rb") as f:
+                if os.fstat(f.fileno()).st_size < SIZE:
+                    return None
+                mm = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            return None
+        _reader_map = mm
+    return _reader_map
+
+
+def read(max_age: float = MAX_AGE_SECONDS) -> Optional[Dict[str, Optional[float]]]:
+    """
+    :return: key: short name, value: the latest value or None if it is older than max_age seconds.
+             None if there are no current values (nothing is measured, the row is older than max_age)
+    """
+    with _reader_lock:
+        mm = _open_reader_locked()
+    if mm is None:
+        return None
+    for _ in range(READ_ATTEMPTS):
+        before, = _SEQUENCE.unpack_from(mm, _SEQUENCE_OFFSET)
+        if before % 2:
+            time.sleep(0)  # the writer is in the middle of publish()
+            continue
+        data = mm[_DATA_OFFSET:SIZE]
+        after, = _SEQUENCE.unpack_from(mm, _SEQUENCE_OFFSET)
+        if before == after:
+            break
+    else:
+        logger.log.warning(f"Could not read the current values after {READ_ATTEMPTS} attempts")
+        return None
+    count, row_time = _ROW.unpack_from(data)
+    now = time.time()
+    if now - row_time > max_age:
+        _forget_reader()  # maybe the file was replaced, it is mapped again by the next read()
+        return None
+    result = {}
+    for i in range(count):
+        name, value_time, value = _ENTRY.unpack_from(data, _ROW.size + i * _ENTRY.size)
+        fresh = not math.isnan(value) and now - value_time <= max_age
+        result[name.rstrip(b"\0").decode()] = value if fresh else None
+    return result
+
+
+def _forget_reader() -> None:
+    # not closed, other threads can still read it. it is unmapped when the last reference is gone
+    global _reader_map
+    with _reader_lock:
+        _reader_map = None
+
+
+def cleanup() -> None:
+    global _writer_map, _reader_map
+    with _writer_lock:
+        if _writer_map is not None:
+            _writer_map.close()
+            _writer_map = None
+    with _reader_lock:
+        if _reader_map is not None:
+            _reader_map.close()
+            _reader_map = None
@@ -0,0 +1,164 @@
+# coding=utf-8
+"""
+Scheduler for the samples of one measuring period (see SensorMaster.measure_now()).
+
+The ticks are deadlines on the monotonic clock (start + n * SAMPLE_INTERVAL_SECONDS), so a slow tick doesn't shift
+the following ones and wall clock changes don't matter. At every tick the sensors are read in parallel in a small
+thread pool. A read which isn't finished READ_TIMEOUT_SECONDS after the tick, or which fails, is a missing value (None)
+in this row. A sensor whose previous read is still running is skipped, so a hanging sensor only occupies one worker.
+The latency of every read is kept per sensor, see get_stats().
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+
+from wetstat.common import logger
+from wetstat.sensors.abstract.base_sensor import BaseSensor
+
+SAMPLE_INTERVAL_SECONDS = 5.0
+READ_TIMEOUT_SECONDS = 2.0
+MAX_WORKERS = 4
+LATENCY_HISTORY = 1000  # latencies per sensor for the percentiles
+PERCENTILES = [50, 90, 99]
+
+
+class SensorStats(object):
+    """
+    read latencies and failures of one sensor, thread safe
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Deque[float] = collections.deque(maxlen=LATENCY_HISTORY)
+        self.reads = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def add_latency(self, seconds: float) -> None:
+        with self.lock:
+            self.reads += 1
+            self.latencies.append(seconds)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            latencies_ms = np.array(self.latencies) * 1000
+            result = {
+                "reads": self.reads,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+            }
+        if len(latencies_ms):
+            result["max_ms"] = round(float(latencies_ms.max()), 3)
+            for p, value in zip(PERCENTILES, np.percentile(latencies_ms, PERCENTILES)):
+                result[f"p{p}_ms"] = round(float(value), 3)
+        return result
+
+
+_stats: Dict[str, SensorStats] = collections.defaultdict(SensorStats)
+missed_ticks = 0
+
+
+def get_stats() -> dict:
+    """
+    :return: json serializable statistics of all sensors which were read
+    """
+    return {
+        "missed_ticks": missed_ticks,
+        "sensors": {short_name: stats.to_dict() for short_name, stats in list(_stats.items())},
+    }
+
+
+class SamplingScheduler(object):
+
+    def __init__(self,
+                 sensors: Sequence[BaseSensor],
+                 interval: float = SAMPLE_INTERVAL_SECONDS,
+                 read_timeout: float = READ_TIMEOUT_SECONDS,
+                 max_workers: int = MAX_WORKERS) -> None:
+        """
+        :param sensors: the sensors which are read at every tick, in the order of the values of a row
+        """
+        self.sensors = list(sensors)
+        self.interval = interval
+        self.read_timeout = read_timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, max(len(sensors), 1)),
+                                                              thread_name_prefix="sampling")
+        self._running: Dict[int, concurrent.futures.Future] = {}  # key: index of the sensor
+
+    def _read(self, sensor: BaseSensor) -> float:
+        start = time.monotonic()
+        try:
+            return sensor.measure()
+        finally:
+            _stats[sensor.get_short_name()].add_latency(time.monotonic() - start)
+
+    def sample_row(self) -> List[Optional[float]]:
+        """
+        reads all sensors in parallel
+        :return: one value per sensor, None if the read failed or took longer than read_timeout
+        """
+        deadline = time.monotonic() + self.read_timeout
+        futures: Dict[int, concurrent.futures.Future] = {}
+        row: List[Optional[float]] = [None] * len(self.sensors)
+        for i, sensor in enumerate(self.sensors):
+            running = self._running.get(i)
+            if running is not None and not running.done():
+                _stats[sensor.get_short_name()].skipped += 1
+                continue
+            futures[i] = self._running[i] = self.executor.submit(self._read, sensor)
+        for i, future in futures.items():
+            short_name = self.sensors[i].get_short_name()
+            try:
+                row[i] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                _stats[short_name].timeouts += 1
+                logger.log.warning(f"Reading {short_name} took longer than {self.read_timeout}s")
+            except Exception:
+                _stats[short_name].errors += 1
+                logger.log.exception(f"Could not read {short_name}")
+        return row
+
+    def run(self,
+            stop_at: float,
+            on_row: Callable[[List[Optional[float]]], None],
+            should_stop: Callable[[], bool] = lambda: False) -> bool:
+        """
+        samples at every tick until stop_at
+        :param stop_at: time.monotonic() of the last tick
+        :param on_row: called with the values of every tick
+        :param should_stop: checked before every tick, True ends the sampling
+        :return: False if should_stop ended the sampling
+        """
+        global missed_ticks
+        next_tick = time.monotonic()
+        while next_tick <= stop_at:
+            while True:
+                if should_stop():
+                    return False
+                remaining = next_tick - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, 1.0))  # wakes up at least once per second to check should_stop
+            on_row(self.sample_row())
+            next_tick += self.interval
+            now = time.monotonic()
+            if now > next_tick:  # the row took longer than an interval, the missed ticks are skipped
+                skipped = int((now - next_tick) // self.interval) + 1
+                missed_ticks += skipped
+                next_tick += skipped * self.interval
+        return True
+
+    def shutdown(self) -> None:
+        # reads which hang aren't waited for, their threads end with the read
+        self.executor.shutdown(wait=False)
@@ -9,11 +9,15 @@ from typing import List
 from typing import Optional
 
 import numpy as np
-import schedule
 
+from wetstat.common import config
 from wetstat.common import logger
 from wetstat.model import util
 from wetstat.model.db import db_model
+from wetstat.model.db import raw_samples
+from wetstat.model.db import wal
+from wetstat.sensors import current_values
+from wetstat.sensors import sampling
 from wetstat.sensors.abstract.base_sensor import BaseSensor
 from wetstat.sensors.abstract.base_sensor import CompressionFunction
 from wetstat.sensors.real.digital_temp_sensor import DigitalTempSensor
@@ -54,14 +58,15 @@ UNIT_NAMES = {
     "mm": "Millimeter",
 }
 
-schedule.logger.setLevel(schedule.logging.ERROR)
-
 measuring_allowed = True
 measuring_allowed_lock = threading.Lock()
 
 last_row = {}
 last_row_lock = threading.Lock()
 CURRENT_VALUE_PORT = 61357
+SAMPLING_STATS_REQUEST = "sampling_stats"
+
+_scheduler: Optional[sampling.SamplingScheduler] = None  # created by the first measure_now()
 
 
 def run_current_value_provider_server() -> None:
@@ -72,14 +77,16 @@ def run_current_value_provider_server() -> None:
         sock.listen(3)
         while True:
             com, addr = sock.accept()
-            logger.log.info(f"current_value_provider_server accepted from {addr}")
+            logger.log.debug(f"current_value_provider_server accepted from {addr}")
             data = com.recv(1024).decode()
-            if data:
+            if data == SAMPLING_STATS_REQUEST:
+                com.sendall(json.dumps(sampling.get_stats()).encode())
+            elif data:
                 res = "{}"
                 with last_row_lock:
                     res = json.dumps({sname: val for sname, val
                                       in zip(SensorMaster.get_used_sensor_short_names(), last_row)})
-                com.send(res.encode())
+                com.sendall(res.encode())
             com.close()
     except Exception:
         logger.log.exception("Exception occurred in current_value_provider_server")
@@ -88,15 +95,51 @@ def run_current_value_provider_server() -> None:
 
 
 def get_current_values() -> dict:
+    """
+    :return: key: short name, value: latest sample. from the shared memory of the measuring process if it is available,
+             otherwise from the current value provider server
+    """
+    values = current_values.read()
+    if values is not None:
+        return values
     try:
-        sock = socket.create_connection(("127.0.0.1", CURRENT_VALUE_PORT), 1)
-        sock.send("aaaa".encode())
-        return json.loads(sock.recv(4096).decode())
-    except (ConnectionError, socket.timeout) as e:
+        return _request_current_value_provider("aaaa")
+    except (ConnectionError, socket.timeout, ValueError):
         logger.log.exception("Caught exception in get_current_values")
         return {}
 
 
+def get_sampling_stats() -> dict:
+    """
+    :return: sampling.get_stats() of the measuring process, empty if it doesn't run
+    """
+    try:
+        return _request_current_value_provider(SAMPLING_STATS_REQUEST)
+    except (ConnectionError, socket.timeout, ValueError):
+        logger.log.exception("Caught exception in get_sampling_stats")
+        return {}
+
+
+def _request_current_value_provider(request: str) -> dict:
+    """
+    :return: the json answer of run_current_value_provider_server(), read until the server closes the connection
+    """
+    with socket.create_connection(("127.0.0.1", CURRENT_VALUE_PORT), 1) as sock:
+        sock.sendall(request.encode())
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode())
+
+
+def is_measuring_allowed() -> bool:
+    with measuring_allowed_lock:
+        return measuring_allowed
+
+
 def stop_measuring() -> None:
     with measuring_allowed_lock:
         global measuring_allowed
@@ -129,26 +172,40 @@ class SensorMaster(object):
         return [s.get_short_name() for s in SUM_SENSORS]
 
     @staticmethod
-    def _measure_row(data: list, stoptime: datetime.datetime):
-        logger.log.debug(f"SensorMaster._measure_row(len(data)={len(data)}, stoptime={stoptime.isoformat()})")
-        # data.append([s.measure() for s in USED_SENSORS])
-        row = []
-        for s in USED_SENSORS:
-            if s.get_compression_function() == CompressionFunction.SUM:
-                row.append(None)  # don't call measure because it would change internal counters
-            else:
-                row.append(s.measure())
+    def _get_scheduler() -> sampling.SamplingScheduler:
+        # SUM sensors aren't sampled because measure() would change their internal counters
+        global _scheduler
+        if _scheduler is None:
+            _scheduler = sampling.SamplingScheduler([s for s in USED_SENSORS if s not in SUM_SENSORS])
+        return _scheduler
+
+    @staticmethod
+    def _measure_row(data: list, sampled_row: List[Optional[float]]) -> None:
+        logger.log.debug(f"SensorMaster._measure_row(len(data)={len(data)})")
+        sampled = iter(sampled_row)
+        row = [None if s in SUM_SENSORS else next(sampled) for s in USED_SENSORS]
         data.append(row)
         with last_row_lock:
             global last_row
             last_row = row
-        if datetime.datetime.now() > stoptime:  # should stop
-            return schedule.CancelJob
+        try:
+            current_values.publish(time.time(), SensorMaster.get_used_sensor_short_names(), row)
+        except OSError:
+            logger.log.exception("Could not publish the current values")
+        try:
+            raw_samples.append(datetime.datetime.now(),
+                               [s.get_short_name() for s in SensorMaster._get_scheduler().sensors],
+                               sampled_row)
+        except OSError:
+            logger.log.exception("Could not save the raw samples")
 
     @staticmethod
     def measure_now(stoptime: datetime.datetime,
                     savedate: datetime.datetime = None):
         """
+        samples the sensors every sampling.SAMPLE_INTERVAL_SECONDS until shortly before stoptime and saves the
+        compressed values. Samples which failed or were too late are missing values, a sensor without any sample is
+        saved as NULL.
         :param stoptime: timestamp on which the measurement should be finished
         :param savedate: under which date the values are saved
         :return: None
@@ -156,40 +213,44 @@ class SensorMaster(object):
         heads = SensorMaster.get_used_sensor_short_names()
 
         data = []
-        schedule.every(5).seconds.do(SensorMaster._measure_row,
-                                     data=data,
-                                     stoptime=stoptime - datetime.timedelta(seconds=10)
-                                     )
-        while len(schedule.jobs):
-            schedule.run_pending()
-            with measuring_allowed_lock:
-                if not measuring_allowed:
-                    logger.log.info("Measuring stopped in measure_row()")
-                    return
-            time.sleep(1)
+        # the wall clock is only used once, the ticks are on the monotonic clock
+        sampling_seconds = (stoptime - datetime.timedelta(seconds=10) - datetime.datetime.now()).total_seconds()
+        finished = SensorMaster._get_scheduler().run(time.monotonic() + sampling_seconds,
+                                                     functools.partial(SensorMaster._measure_row, data),
+                                                     should_stop=lambda: not is_measuring_allowed())
+        if not finished:
+            logger.log.info("Measuring stopped in measure_now()")
+            return
 
         values = []
-        data_rows = list(zip(*data))
         for isens, sens in enumerate(USED_SENSORS):
             cf = sens.get_compression_function()
-            svals = data_rows[isens]
-            if cf == CompressionFunction.MINMAXAVG:
+            svals = [row[isens] for row in data if row[isens] is not None]
+            if cf == CompressionFunction.SUM:
+                val = sens.measure()
+            elif not svals:
+                val = None
+            elif cf == CompressionFunction.MINMAXAVG:
                 val = np.mean(svals)
             elif cf == CompressionFunction.MIN:
                 val = min(svals)
             elif cf == CompressionFunction.MAX:
                 val = max(svals)
-            elif cf == CompressionFunction.SUM:
-                val = sens.measure()
             else:
                 val = 0
-            values.append(round(val, 3))
+            values.append(round(val, 3) if val is not None else None)
 
-        db_model.insert_record(savedate, update_if_exists=True, **db_model.record_to_dict(values, heads))
+        wal.append(savedate, db_model.record_to_dict(values, heads))
+        try:
+            wal.replay()  # inserts this record and the ones which failed before
+        except Exception:
+            logger.log.exception(f"Could not insert the values of {savedate.isoformat()}, "
+                                 f"the wal_replay service inserts them later")
+            return
         logger.log.debug(f"measured and saved values {str(values)}")
 
     @staticmethod
-    def measure(freq: int = 600):
+    def measure(freq: int = config.MEASURING_FREQ_SECONDS):
         """
         measures values forever
         :param freq: measuring frequency in seconds
@@ -2,8 +2,10 @@
 import datetime
 import os.path
 import subprocess
+import threading
 import time
 from abc import ABC, abstractmethod
+from typing import Dict
 
 import gpiozero
 import psutil
@@ -11,6 +13,8 @@ import psutil
 from wetstat import bokeh_view
 from wetstat.common import config, logger
 from wetstat.model import plot_cleanup, log_parser
+from wetstat.model.db import partition
+from wetstat.model.db import wal
 from wetstat.sensors import counter_service, sensor_master
 
 
@@ -36,6 +40,12 @@ class BaseService(ABC):
     def stop(self) -> bool:
         return False
 
+    def get_details(self) -> Dict[str, object]:
+        """
+        :return: status values which are shown on /system/services
+        """
+        return {}
+
     @staticmethod
     @abstractmethod
     def is_restart_after_crash() -> bool:
@@ -101,6 +111,28 @@ class SensorService(BaseService):
         return True
 
 
+class WalReplayService(BaseService):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        self.stop_event.clear()
+        wal.run_replayer(self.stop_event)
+
+    def stop(self) -> bool:
+        self.stop_event.set()
+        return True
+
+    def get_details(self) -> Dict[str, object]:
+        return {"backlog": wal.get_backlog()}
+
+    @staticmethod
+    def is_restart_after_crash() -> bool:
+        return True
+
+
 class CounterService(BaseService):
 
     def run(self) -> None:
@@ -161,6 +193,19 @@ class LogCleanupService(DailyService):
         return True
 
 
+class PartitionService(DailyService):
+
+    def get_sleep_before_action(self) -> int:
+        return 600
+
+    def daily_run(self) -> None:
+        partition.maintain()
+
+    @staticmethod
+    def is_restart_after_crash() -> bool:
+        return True
+
+
 class ShutdownButtonService(BaseService):
     pin: int = 21  # BCM
     demo_mode = True
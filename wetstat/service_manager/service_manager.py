@@ -82,7 +82,8 @@ class ServiceManager:
             with self.submitted_lock:
                 sens_data = {"name": sens_name,
                              "running": sens_name in self.submitted and self.submitted[sens_name].running(),
-                             "last_crash": lc.timestamp() if lc is not None else None
+                             "last_crash": lc.timestamp() if lc is not None else None,
+                             "details": sens_obj.get_details(),
                              }
             data[sens_name] = sens_data
         return data
@@ -138,6 +139,8 @@ if __name__ == '__main__':
     manager.update_service("counter", service.CounterService())
     manager.update_service("plot_cleanup", service.PlotCleanupService())
     manager.update_service("log_cleanup", service.LogCleanupService())
+    manager.update_service("partitions", service.PartitionService())
+    manager.update_service("wal_replay", service.WalReplayService())
     #manager.update_service("shutdown_button", service.ShutdownButtonService())
     manager.update_service("current_value_provider", service.CurrentValueProviderService())
     manager.update_service("bokeh_server", service.BokehServerService())
@@ -148,6 +151,8 @@ if __name__ == '__main__':
     manager.start_service("counter")
     manager.start_service("plot_cleanup")
     manager.start_service("log_cleanup")
+    manager.start_service("partitions")
+    manager.start_service("wal_replay")
     #manager.start_service("shutdown_button")
     manager.start_service("current_value_provider")
     manager.start_service("bokeh_server")
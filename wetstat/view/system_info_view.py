@@ -11,6 +11,7 @@ from django.utils.safestring import mark_safe
 
 from wetstat.common import config, logger
 from wetstat.model import system_info as system_info_model, log_parser
+from wetstat.model import columnar_export
 from wetstat.model.data_download import DataDownload
 from wetstat.sensors import sensor_master
 from wetstat.service_manager import service_manager_com
@@ -83,10 +84,16 @@ def system_real_download(request: WSGIRequest) -> HttpResponse:
     except ValueError:
         return views.show_error(request, "Falsches Format für Start/Ende!", "/system/download")
     dd.make_zip = "zip" in request.GET.keys()
+    dd.file_format = request.GET.get("format", columnar_export.FORMAT_CSV)
+    if dd.file_format != columnar_export.FORMAT_CSV and not columnar_export.is_available(dd.file_format):
+        return views.show_error(request, f"Format {dd.file_format} nicht verfügbar!", "/system/download")
     path = dd.prepare_download()
     with open(path, "rb") as out:
         response = HttpResponse(out.read())
-    response["Content-Type"] = 'text/csv' if path.endswith(".csv") else "application/zip"
+    if dd.file_format != columnar_export.FORMAT_CSV:
+        response["Content-Type"] = columnar_export.get_mime_type(dd.file_format)
+    else:
+        response["Content-Type"] = 'text/csv' if path.endswith(".csv") else "application/zip"
     response["Content-Disposition"] = "attachment; filename=\"" + os.path.basename(path) + "\""
     end = time.perf_counter()
     days = (dd.end - dd.start).days
@@ -2,7 +2,7 @@
 import datetime
 import os
 import time
-from typing import Dict, Union, Tuple, Any
+from typing import Dict, Union, Tuple, Any, List
 
 from django.http import HttpResponse
 from django.shortcuts import render
@@ -26,42 +26,50 @@ from wetstat.view.message_container import MessageContainer
 message_container = MessageContainer()
 
 
-def load_previous_values(ndays: int) -> Tuple[datetime.datetime, Dict[str, float]]:
-    delta = datetime.timedelta(days=ndays)
+def load_previous_values(*ndays: int) -> List[Tuple[datetime.datetime, Dict[str, float]]]:
+    """
+    :param ndays: for example 1 for the values of yesterday at the current time
+    :return: (timestamp of the record, values) for each element of ndays, loaded with two queries
+    """
     oneday = datetime.timedelta(days=1)
     now_date = config.get_date()
+    timestamps = [now_date - datetime.timedelta(days=n) for n in ndays]
     try:
-        value_record = db_model.find_nearest_record(now_date - delta)
-        sum_record = db_model.get_value_sums(columns=SensorMaster.get_sum_sensor_short_names(),
-                                             end=now_date - delta,
-                                             duration=oneday)
+        value_records = db_model.find_nearest_records(timestamps)
+        sum_records = db_model.get_value_sums_multi(SensorMaster.get_sum_sensor_short_names(),
+                                                    [(ts - oneday, ts) for ts in timestamps])
     except ValueError or FileNotFoundError:
         logger.log.exception(f"Error while loading data for {ndays} before!")
-        return datetime.datetime.fromtimestamp(0), MockDict()
-    ret_record = {}
-    record_timestamp = None
-    for short_name in value_record.keys():
-        if short_name == "Time":
-            record_timestamp = value_record[short_name]
+        return [(datetime.datetime.fromtimestamp(0), MockDict()) for _ in ndays]
+    result = []
+    for value_record, sum_record in zip(value_records, sum_records):
+        if value_record is None:
+            result.append((datetime.datetime.fromtimestamp(0), MockDict()))
             continue
-        sensor = SensorMaster.get_sensor_for_info("short_name", short_name)
-        if sensor.get_compression_function() == CompressionFunction.SUM:
-            rec = sum_record
-        else:
-            rec = value_record
-        ret_record[short_name] = rec[short_name]
-    return record_timestamp, ret_record
+        ret_record = {}
+        record_timestamp = None
+        for short_name in value_record.keys():
+            if short_name == "Time":
+                record_timestamp = value_record[short_name]
+                continue
+            sensor = SensorMaster.get_sensor_for_info("short_name", short_name)
+            if sensor.get_compression_function() == CompressionFunction.SUM:
+                rec = sum_record
+            else:
+                rec = value_record
+            ret_record[short_name] = rec[short_name]
+        result.append((record_timestamp, ret_record))
+    return result
 
 
 def index(request) -> HttpResponse:
     log_request(request)
 
     ts_0, today = datetime.datetime.now(), sensor_master.get_current_values()
-    if not today:
-        ts_0, today = load_previous_values(0)
-    ts_1, yesterday = load_previous_values(1)
-    ts_30, lastmonth = load_previous_values(30)
-    ts_365, lastyear = load_previous_values(365)
+    if today:
+        (ts_1, yesterday), (ts_30, lastmonth), (ts_365, lastyear) = load_previous_values(1, 30, 365)
+    else:
+        (ts_0, today), (ts_1, yesterday), (ts_30, lastmonth), (ts_365, lastyear) = load_previous_values(0, 1, 30, 365)
 
     if isinstance(today, MockDict):
         return show_error(request, "Es wurden keine Daten zum aktuellen Zeitpunkt gefunden.", "week.html")
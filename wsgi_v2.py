@@ -1,12 +1,18 @@
 import collections
+import dataclasses
 import datetime
+import io
 import json
+import math
 import os
 import sys
 import time
 import traceback
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
 from urllib import parse
 
 MIME_CSV = "text/csv"
@@ -20,18 +26,33 @@ if di2 not in sys.path:
     sys.path.append(di2)
 # print(sys.path, file=sys.stderr)
 
+import numpy as np
+
 from wetstat.model.db import connection_pool
+from wetstat.common import config
 from wetstat.common import logger
+from wetstat.model import columnar_export
+from wetstat.model import downsampling
+from wetstat.model.db import coverage
+from wetstat.model.db import db_const
 from wetstat.model.db import db_model
+from wetstat.model.db import profiler
+from wetstat.model.db import query_budget
+from wetstat.model.db import range_cache
 from wetstat.sensors import sensor_master
 
 wsgi_environ = {}
 
 INTERVALS = collections.defaultdict(lambda x: datetime.timedelta(minutes=10), {
     "10min": datetime.timedelta(minutes=10),
+    "30min": datetime.timedelta(minutes=30),
     "hour": datetime.timedelta(hours=1),
+    "3hours": datetime.timedelta(hours=3),
+    "6hours": datetime.timedelta(hours=6),
+    "12hours": datetime.timedelta(hours=12),
     "day": datetime.timedelta(days=1),
     "week": datetime.timedelta(weeks=1),
+    "month": datetime.timedelta(days=30),
     "year": datetime.timedelta(days=365),
 })
 
@@ -50,9 +71,22 @@ def row_to_csv(row: list) -> str:
     return ";".join(res)
 
 
+def data_to_csv_lines(data: db_model.DbData) -> List[str]:
+    """
+    same format as row_to_csv(), but vectorized over the columns of data (without the header)
+    """
+    times = data.timestamps().astype(np.int64).tolist()
+    rounded = np.where(data.values < 1000, np.round(data.values, 2), np.round(data.values)).tolist()
+    return [";".join([str(ts), *("" if math.isnan(val) else str(val) for val in row)])
+            for ts, row in zip(times, rounded)]
+
+
 def get_sensors(params: dict):
     data = []
+    existing = db_model.get_all_columns()
     for sens in sensor_master.USED_SENSORS:
+        if sens.get_short_name() not in existing:
+            continue
         data.append({
             "name": sens.get_long_name(),
             "short_name": sens.get_short_name(),
@@ -67,11 +101,10 @@ def get_current_values(params: dict):
     now = datetime.datetime.now()
     values = sensor_master.get_current_values()
     if not values:
-        values = db_model.find_nearest_record(now)
+        values = db_model.find_nearest_records([now])[0]
     sum_sensors = [sens.get_short_name() for sens in sensor_master.SUM_SENSORS]
     if sum_sensors:
-        sums = db_model.get_value_sums(sum_sensors, end=now, start=now-datetime.timedelta(days=1))
-        print("sums=", json.dumps(sums), file=sys.stderr)
+        sums = db_model.get_value_sums_multi(sum_sensors, [(now - datetime.timedelta(days=1), now)])[0]
         values.update(sums)
     heads = list(values.keys())
     row1 = [values[sn] for sn in heads]
@@ -86,28 +119,130 @@ def get_values(params: dict):
     from_ = datetime.datetime.fromtimestamp(int(params["from"]))
     to = datetime.datetime.fromtimestamp(int(params["to"]))
 
-    data = (db_model.load_data_with_interval(INTERVALS.get(params["interval"]), start=from_, end=to)
-            if "interval" in params
-            else db_model.load_data_for_date_range(from_, to))
-    rows = list(data.array)
-    result = to_bytes_csv([data.columns, *rows]), MIME_CSV
+    columns = params["columns"].split(",") if params.get("columns") else None
+    fmt = params.get("format", columnar_export.FORMAT_CSV)
+    if fmt != columnar_export.FORMAT_CSV:
+        columnar_export.check_format(fmt)
+    narrowed = coverage.narrow(columns, from_, to)
+    if narrowed is None:
+        if fmt != columnar_export.FORMAT_CSV:
+            return to_columnar_bytes([db_model.DbData.empty([db_const.COL_NAME_TIME])], fmt)
+        return row_to_csv([db_const.COL_NAME_TIME]).encode(), MIME_CSV
+    columns, from_, to = narrowed
+
+    interval = get_interval(params) if "max_points" not in params else None
+    max_rows = query_budget.get_max_rows()
+    if max_rows is not None and query_budget.estimate_rows(from_, to, interval) > max_rows:
+        if params.get("auto_interval") == "0":
+            raise query_budget.RowLimitError(f"The request would return more than {max_rows} records, "
+                                             f"use a larger interval or a smaller range")
+        interval = find_fitting_interval(from_, to, max_rows)
+        logger.log.info(f"Switched to interval {interval} for {from_} to {to}, raw records would exceed {max_rows}")
+
+    if "max_points" in params:
+        if interval is None:
+            data = db_model.load_data_for_date_range(from_, to, columns=columns)
+        else:
+            data = db_model.load_data_with_interval(interval, start=from_, end=to, columns=columns)
+        data = downsampling.downsample(data, int(params["max_points"]))
+    elif interval is None:
+        if fmt != columnar_export.FORMAT_CSV:
+            chunks = db_model.iter_range(from_, to, columns)
+            return columnar_export.iter_bytes(chunks, fmt), columnar_export.get_mime_type(fmt)
+        return iter_csv_range(from_, to, columns), MIME_CSV
+    else:
+        data = db_model.load_data_with_interval(interval, start=from_, end=to, columns=columns)
+    if fmt != columnar_export.FORMAT_CSV:
+        return to_columnar_bytes([data], fmt)
+    rows = data_to_csv_lines(data)
+    result = "\n".join([row_to_csv(data.columns), *rows]).encode(), MIME_CSV
 
     stop = time.perf_counter()
     used = (stop - start)
     if rows:
-        print("Used", used, "s for ", len(rows), "rows, that's", used / len(rows), "s/row", file=sys.stderr)
+        logger.log.debug(f"Used {round(used, 3)}s for {len(rows)} rows, that's {used / len(rows)}s/row")
     return result
 
 
+def get_raw_values(params: dict):
+    """
+    :param params: from and to (unix timestamps, default is the last hour), columns (comma separated short names,
+                   optional), format (like api/values)
+    :return: the samples of the sensors (every few seconds) from the raw sample store
+    """
+    params.setdefault("to", int(time.time()))
+    params.setdefault("from", int(params["to"]) - 60 * 60)
+    from_ = datetime.datetime.fromtimestamp(int(params["from"]))
+    to = datetime.datetime.fromtimestamp(int(params["to"]))
+    columns = params["columns"].split(",") if params.get("columns") else None
+    fmt = params.get("format", columnar_export.FORMAT_CSV)
+    if fmt != columnar_export.FORMAT_CSV:
+        columnar_export.check_format(fmt)
+    data = db_model.load_raw_samples(from_, to, columns)
+    if fmt != columnar_export.FORMAT_CSV:
+        return to_columnar_bytes([data], fmt)
+    return "\n".join([row_to_csv(data.columns), *data_to_csv_lines(data)]).encode(), MIME_CSV
+
+
+def get_interval(params: dict) -> Optional[datetime.timedelta]:
+    """
+    :return: the interval of interval_seconds or interval, None for raw records
+    """
+    if "interval_seconds" in params:
+        interval_seconds = int(params["interval_seconds"])
+        if interval_seconds < 1:
+            raise ValueError("interval_seconds must be at least 1")
+        return datetime.timedelta(seconds=interval_seconds)
+    if "interval" in params:
+        if params["interval"] not in INTERVALS.keys():
+            raise ValueError(f"Unknown interval: '{params['interval']}'")
+        return INTERVALS[params["interval"]]
+    return None
+
+
+def find_fitting_interval(start: datetime.datetime, end: datetime.datetime, max_rows: int) -> datetime.timedelta:
+    """
+    :return: the shortest interval of INTERVALS which returns at most max_rows records
+    """
+    for interval in sorted(INTERVALS.values()):
+        if query_budget.estimate_rows(start, end, interval) <= max_rows:
+            return interval
+    raise query_budget.RowLimitError(f"The range is too large for {max_rows} records")
+
+
+def to_columnar_bytes(chunks: Iterable[db_model.DbData], fmt: str):
+    """
+    for data which is already in memory, large ranges are streamed with columnar_export.iter_bytes()
+    """
+    out = io.BytesIO()
+    columnar_export.write(chunks, out, fmt)
+    return out.getvalue(), columnar_export.get_mime_type(fmt)
+
+
+def iter_csv_range(start: datetime.datetime,
+                   end: datetime.datetime,
+                   columns: Optional[List[str]] = None) -> Iterator[bytes]:
+    """
+    streams the raw records as csv, one block of lines per chunk of db_model.iter_range()
+    """
+    for i, chunk in enumerate(db_model.iter_range(start, end, columns)):
+        lines = []
+        if i == 0:
+            lines.append(row_to_csv(chunk.columns))
+        lines.extend(data_to_csv_lines(chunk))
+        if lines:
+            yield ("\n" if i > 0 else "").encode() + "\n".join(lines).encode()
+
+
 def next_value(params: dict):
     params.setdefault("to", int(time.time()))
     params.setdefault("sum_span", 60 * 60 * 24)
     to = datetime.datetime.fromtimestamp(int(params["to"]))
     sum_span = datetime.timedelta(seconds=params["sum_span"])
-    values = db_model.find_nearest_record(to)
+    values = db_model.find_nearest_records([to])[0]
     sum_sensors = [sens.get_short_name() for sens in sensor_master.SUM_SENSORS]
     if sum_sensors:
-        values.update(db_model.get_value_sums(sum_sensors, end=to, duration=sum_span))
+        values.update(db_model.get_value_sums_multi(sum_sensors, [(to - sum_span, to)])[0])
     heads = list(values.keys())
     row1 = [values[sn] for sn in heads]
     return to_bytes_csv([heads, row1]), MIME_CSV
@@ -129,21 +264,83 @@ def system_info(params: dict):
     return json.dumps({
         "pid": os.getpid(),
         "executable": sys.executable,
+        "db_backend": config.get_db_backend(),
         "used_db_connections": connection_pool.get_used_count(),
         "open_db_connections": connection_pool.get_open_count(),
+        "db_pool": connection_pool.get_stats(),
+        "range_cache": range_cache.get_stats(),
+        "sampling": sensor_master.get_sampling_stats(),
         "wsgi_environ": to_serializable_dict(wsgi_environ),
     }).encode(), "application/json"
 
 
+def get_coverage(params: dict):
+    """
+    :param params: from and to (unix timestamps, optional), columns (comma separated short names, optional)
+    :return: json with the spans of each column as [first, last] unix timestamps
+    """
+    from_ = datetime.datetime.fromtimestamp(int(params["from"])) if "from" in params else None
+    to = datetime.datetime.fromtimestamp(int(params["to"])) if "to" in params else None
+    columns = params["columns"].split(",") if params.get("columns") else coverage.get_columns()
+    return json.dumps({
+        "available": coverage.is_available(),
+        "max_gap": coverage.MAX_GAP.total_seconds(),
+        "columns": {short_name: [[int(first.timestamp()), int(last.timestamp())]
+                                 for first, last in coverage.get_spans(short_name, from_, to)]
+                    for short_name in columns},
+    }).encode(), "application/json"
+
+
+def query_stats(params: dict):
+    """
+    :param params: limit: number of query fingerprints and slowest queries, default is 20
+    """
+    return json.dumps(profiler.get_stats(int(params.get("limit", 20)))).encode(), "application/json"
+
+
+# limits of the database queries of one request, see query_budget
+DEFAULT_BUDGET = query_budget.QueryBudget(max_execution_seconds=10)
+ENDPOINT_BUDGETS = {
+    "/api/values": query_budget.QueryBudget(max_execution_seconds=30, max_rows=200000),
+    "/api/raw_values": query_budget.QueryBudget(max_execution_seconds=30, max_rows=200000),
+}
+
 URI_FUNC_MAP = {
     "/api/sensors": get_sensors,
     "/api/current_values": get_current_values,
     "/api/values": get_values,
+    "/api/raw_values": get_raw_values,
     "/api/next_value": next_value,
     "/api/system_info": system_info,
+    "/api/coverage": get_coverage,
+    "/api/query_stats": query_stats,
 }
 
 
+def iter_with_budget(iterable: Iterable[bytes], budget: query_budget.QueryBudget) -> Iterator[bytes]:
+    """
+    runs every step of a streamed response with the budget. if the client is gone, the server closes this generator,
+    which closes the database generators below, so the query is aborted.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            with query_budget.limit(budget):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+    except Exception:
+        logger.log.exception("Exception in streamed response of wsgi_v2")
+        raise
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            with query_budget.limit(budget):
+                close()
+
+
 def application(environ: Dict[str, object], start_response: callable) -> list:
     content_type = "text/plain"
     global wsgi_environ
@@ -160,14 +357,27 @@ def application(environ: Dict[str, object], start_response: callable) -> list:
             uri = full_uri
         if uri in URI_FUNC_MAP.keys():
             status = "200 OK"
-            result = URI_FUNC_MAP[uri](params)
+            budget = dataclasses.replace(ENDPOINT_BUDGETS.get(uri, DEFAULT_BUDGET))
+            with query_budget.limit(budget):
+                result = URI_FUNC_MAP[uri](params)
             if isinstance(result, tuple) and len(result) == 2:
                 output, content_type = result
             else:
                 output = result
+            if not isinstance(output, bytes):  # generator, the response is streamed
+                start_response(status, [("Content-type", content_type)])
+                return iter_with_budget(output, budget)
         else:
             status = "404 Not Found"
             output = b"The requestet URL " + uri.encode() + b" was not found."
+    except query_budget.RowLimitError as e:
+        logger.log.warning(f"Rejected request {environ.get('REQUEST_URI')}: {e}")
+        status = "413 Payload Too Large"
+        output = str(e).encode()
+    except TimeoutError as e:
+        logger.log.warning(f"Timeout in request {environ.get('REQUEST_URI')}: {e}")
+        status = "503 Service Unavailable"
+        output = str(e).encode()
     except Exception:
         logger.log.exception("Exception in wsgi_v2")
         status = "500 Server Error"